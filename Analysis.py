@@ -0,0 +1,774 @@
+#=======================================================================
+# Analysis
+#
+# Aim: To estimate the mean order parameter, the susceptibility, the
+#      Binder cumulant and the autocorrelation time of a saved
+#      simulation of the 2D Viscek Model, with error bars that take into
+#      account the correlation of the samples, reading the time series
+#      in chunks so that it is never loaded whole, and to calculate the
+#      density structure factor, the velocity correlation function and
+#      the clusters of interacting particles of the saved frames, and to
+#      simulate until the order parameter has reached the steady state
+#      and enough independent samples of it have been collected.
+#=======================================================================
+
+import configparser
+import json
+import os
+import sys
+import numpy as np
+from scipy.fft import next_fast_len
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+import Vicsek_Model
+import Trajectory
+
+def Chunks(series,start=0,chunk_size=2**20,overlap=0):
+
+    """
+    This function reads a time series in consecutive chunks, in double precision. The series can be an array, a memory mapped .npy file or a field of a trajectory (see Trajectory.TrajectoryField).
+
+    Parameters
+        series: time series
+        start: index of the first sample read
+        chunk_size: number of samples of each chunk
+        overlap: number of samples read after the end of each chunk, up to the end of the series
+
+    Returns:
+        Generator of the index of the first sample of each chunk and of the chunk, followed by the overlapping samples (begin, data).
+    """
+
+    num_samples = len(series)
+
+    for begin in range(start,num_samples,chunk_size):
+        yield begin, np.asarray(series[begin:min(begin+chunk_size+overlap,num_samples)],dtype=np.float64)
+
+def Moments(series,start=0,chunk_size=2**20):
+
+    """
+    This function calculates the running sums of the order parameter moments of a time series, read in chunks.
+
+    Parameters
+        series: order parameter time series
+        start: number of initial samples excluded (transient)
+        chunk_size: number of samples of each chunk
+
+    Returns:
+        Running sums [number of samples, sum of phi, sum of phi^2, sum of phi^4] (moments), as accumulated by Vicsek_Model.AccumulateMoments.
+    """
+
+    moments = np.zeros(4)
+
+    for begin, data in Chunks(series,start,chunk_size):
+        moments += [len(data),np.sum(data),np.sum(data**2),np.sum(data**4)]
+
+    return moments
+
+def Autocorrelation(series,max_lag=None,start=0,chunk_size=2**20,angular=False):
+
+    """
+    This function calculates the normalized autocorrelation function of a time series up to max_lag, through the fast Fourier transform of each chunk against the chunk itself followed by the next max_lag samples, so that the sums over all the pairs of samples are exact but only a chunk is in memory at a time.
+    With angular True the samples are angles (e.g. the mean heading) and the autocorrelation of the unit vector of each angle is calculated.
+
+    Parameters
+        series: time series
+        max_lag: largest lag, if None 4096 or the length of the series minus one if shorter
+        start: number of initial samples excluded (transient)
+        chunk_size: number of samples of each chunk
+        angular: if True the samples are angles
+
+    Returns:
+        Autocorrelation function at lags 0,...,max_lag (rho), equal to 1 at lag 0.
+    """
+
+    num_samples = len(series)-start
+    if max_lag is None:
+        max_lag = 4096
+    max_lag = max(min(max_lag,num_samples-1),0)
+
+    def Samples(data):
+        return np.exp(1j*data) if angular else data
+
+    # First pass, mean of the series
+    mean = 0.
+    for begin, data in Chunks(series,start,chunk_size):
+        mean += np.sum(Samples(data))
+    mean /= num_samples
+
+    # Second pass, sums of the products of the samples at distance 0,...,max_lag
+    sums = np.zeros(max_lag+1)
+    for begin, data in Chunks(series,start,chunk_size,max_lag):
+
+        data = Samples(data)-mean
+        chunk = data[:chunk_size]
+
+        size = next_fast_len(len(data)+len(chunk))
+        if angular:
+            products = np.fft.ifft(np.conj(np.fft.fft(chunk,size))*np.fft.fft(data,size)).real
+        else:
+            products = np.fft.irfft(np.conj(np.fft.rfft(chunk,size))*np.fft.rfft(data,size),size)
+
+        # Near the end of the series the chunk has no pairs at the largest lags
+        lags = min(max_lag+1,len(data))
+        sums[:lags] += products[:lags]
+
+    # A constant series is not correlated
+    if sums[0] == 0:
+        rho = np.zeros(max_lag+1)
+        rho[0] = 1.
+        return rho
+
+    rho = sums/sums[0]
+
+    return rho
+
+def IntegratedTime(rho,window=5.):
+
+    """
+    This function calculates the integrated autocorrelation time with the automatic window of Sokal: the autocorrelation function is summed up to the smallest lag M such that M >= window*tau(M).
+
+    Parameters
+        rho: autocorrelation function (see Autocorrelation)
+        window: window factor
+
+    Returns:
+        Integrated autocorrelation time tau = 1 + 2 sum of rho, in samples, so that the variance of the mean is tau times the variance over the number of samples, and lag at which the sum is stopped (lag). If lag is the last lag of rho the window was not reached and tau is underestimated.
+    """
+
+    taus = 2*np.cumsum(rho)-1
+
+    lags = np.arange(len(taus)) < window*taus
+    lag = int(np.argmin(lags)) if not np.all(lags) else len(taus)-1
+
+    return float(taus[lag]), lag
+
+def Blocking(series,start=0,chunk_size=2**20):
+
+    """
+    This function calculates the standard error of the mean of a time series grouping the samples in blocks of 1, 2, 4, ... samples (Flyvbjerg-Petersen blocking). The blocks shorter than a chunk are averaged while reading each chunk, the longer ones are formed from the means of the chunks. At least 2 samples must follow the transient, otherwise a ValueError is raised.
+
+    Parameters
+        series: time series
+        start: number of initial samples excluded (transient)
+        chunk_size: number of samples of each chunk, rounded down to a power of 2
+
+    Returns:
+        Size of the blocks (block_sizes), standard error of the mean (errors) and its uncertainty (errors_err) for each size of the blocks with at least 2 blocks.
+    """
+
+    # Without 2 samples after the transient there are no blocks to compare
+    if len(series)-start < 2:
+        raise ValueError("At least 2 samples after the transient are needed, got {} samples with start {}".format(len(series),start))
+
+    chunk_size = 2**int(np.log2(chunk_size))
+    num_levels = int(np.log2(chunk_size))+1
+
+    # The samples are shifted by the first one, so that the variances are not lost in rounding
+    shift = float(np.asarray(series[start]))
+
+    sums = np.zeros(num_levels)
+    squares = np.zeros(num_levels)
+    counts = np.zeros(num_levels,dtype=np.int64)
+    chunk_means = []
+
+    for begin, data in Chunks(series,start,chunk_size):
+
+        data = data-shift
+
+        for level in range(num_levels):
+            size = 2**level
+            num_blocks = len(data)//size
+            if num_blocks == 0:
+                break
+            means = data[:num_blocks*size].reshape(num_blocks,size).mean(axis=1)
+            sums[level] += np.sum(means)
+            squares[level] += np.sum(means**2)
+            counts[level] += num_blocks
+
+        if len(data) == chunk_size:
+            chunk_means.append(means[0])
+
+    # Blocks longer than a chunk
+    means = np.array(chunk_means)
+    while len(means) >= 4:
+        means = means[:len(means)//2*2].reshape(-1,2).mean(axis=1)
+        sums = np.append(sums,np.sum(means))
+        squares = np.append(squares,np.sum(means**2))
+        counts = np.append(counts,len(means))
+
+    block_sizes = 2**np.arange(len(counts))
+
+    valid = counts >= 2
+    block_sizes, sums, squares, counts = block_sizes[valid], sums[valid], squares[valid], counts[valid]
+
+    variances = np.maximum(squares/counts-(sums/counts)**2,0)
+    errors = np.sqrt(variances/(counts-1))
+    errors_err = errors/np.sqrt(2*(counts-1))
+
+    return block_sizes, errors, errors_err
+
+def BlockingError(block_sizes,errors,num_samples):
+
+    """
+    This function chooses the size of the blocks of the blocking analysis as the smallest size B such that B^3 > 2 num_samples (error_B/error_1)^4 (Lee, Needs and Drummond).
+
+    Parameters
+        block_sizes: size of the blocks (see Blocking)
+        errors: standard error of the mean for each size of the blocks
+        num_samples: number of samples of the series
+
+    Returns:
+        Standard error of the mean (error) and size of the blocks (block_size). If no size satisfies the condition, the error of the largest blocks is returned and block_size is None.
+    """
+
+    if errors[0] == 0:
+        return 0., int(block_sizes[0])
+
+    optimal = block_sizes**3 > 2*num_samples*(errors/errors[0])**4
+
+    if not np.any(optimal):
+        return float(errors[-1]), None
+
+    index = int(np.argmax(optimal))
+
+    return float(errors[index]), int(block_sizes[index])
+
+def Jackknife(series,num_part,num_blocks=50,start=0,chunk_size=2**20):
+
+    """
+    This function calculates the mean order parameter, the susceptibility and the Binder cumulant and their jackknife errors. The series is split in num_blocks contiguous blocks, whose moments are accumulated while reading the chunks, and the estimates are calculated leaving out one block at a time. The blocks must be much longer than the autocorrelation time.
+
+    Parameters
+        series: order parameter time series
+        num_part: number of particles
+        num_blocks: number of jackknife blocks
+        start: number of initial samples excluded (transient)
+        chunk_size: number of samples of each chunk
+
+    Returns:
+        Estimates of the mean order parameter, susceptibility and Binder cumulant (estimates) and their errors (errors).
+    """
+
+    num_samples = len(series)-start
+    num_blocks = max(min(num_blocks,num_samples),2)
+
+    # Moments of each block
+    moments = np.zeros((num_blocks,4))
+    for begin, data in Chunks(series,start,chunk_size):
+        blocks = (np.arange(begin-start,begin-start+len(data))*num_blocks)//num_samples
+        for power, column in zip([0,1,2,4],range(4)):
+            moments[:,column] += np.bincount(blocks,data**power,minlength=num_blocks)
+
+    estimates = np.array(Vicsek_Model.OrderParameterStatistics(np.sum(moments,axis=0),num_part))
+
+    # Estimates leaving out each block
+    partial = np.array([Vicsek_Model.OrderParameterStatistics(np.sum(moments,axis=0)-block,num_part) for block in moments])
+    errors = np.sqrt((num_blocks-1)/num_blocks*np.sum((partial-np.mean(partial,axis=0))**2,axis=0))
+
+    return estimates, errors
+
+def Analyze(phi,num_part,heading=None,start=0,max_lag=None,num_blocks=50,chunk_size=2**20):
+
+    """
+    This function analyzes the order parameter time series (and the mean heading one, if given) of a simulation.
+
+    Parameters
+        phi: order parameter time series
+        num_part: number of particles
+        heading: mean heading time series, if None it is not analyzed
+        start: number of initial samples excluded (transient)
+        max_lag: largest lag of the autocorrelation functions (see Autocorrelation)
+        num_blocks: number of jackknife blocks
+        chunk_size: number of samples of each chunk
+
+    Returns:
+        Dictionary of the results (results): number of samples, mean order parameter with its blocking error and the one from the integrated autocorrelation time, autocorrelation time, susceptibility and Binder cumulant with their jackknife errors and, if heading is given, the autocorrelation time of the heading.
+    """
+
+    num_samples = len(phi)-start
+
+    # The blocking analysis first, it checks that there are samples after the transient
+    block_sizes, errors, errors_err = Blocking(phi,start,chunk_size)
+    error, block_size = BlockingError(block_sizes,errors,num_samples)
+
+    rho = Autocorrelation(phi,max_lag,start,chunk_size)
+    tau, lag = IntegratedTime(rho)
+
+    estimates, jackknife_errors = Jackknife(phi,num_part,num_blocks,start,chunk_size)
+
+    # Standard error of the mean from the variance and the integrated autocorrelation time, a check of the blocking one
+    moments = Moments(phi,start,chunk_size)
+    variance = max(moments[2]/moments[0]-(moments[1]/moments[0])**2,0)
+
+    results = {'num_samples': num_samples,
+               'mean_phi': estimates[0],
+               'mean_phi_err': error,
+               'mean_phi_err_tau': float(np.sqrt(tau*variance/num_samples)),
+               'block_size': block_size,
+               'tau_phi': tau,
+               'tau_phi_converged': lag < len(rho)-1,
+               'chi': estimates[1],
+               'chi_err': jackknife_errors[1],
+               'binder': estimates[2],
+               'binder_err': jackknife_errors[2]}
+
+    if heading is not None:
+        rho_heading = Autocorrelation(heading,max_lag,start,chunk_size,angular=True)
+        tau_heading, lag_heading = IntegratedTime(rho_heading)
+        results['tau_heading'] = tau_heading
+        results['tau_heading_converged'] = lag_heading < len(rho_heading)-1
+
+    return {key: value.item() if isinstance(value,np.generic) else value for key, value in results.items()}
+
+def GridFields(position,theta,space_dim,grid_size):
+
+    """
+    This function bins the particles of a batch of frames onto a periodic grid of grid_size X grid_size cells, giving the density and velocity fields of each frame.
+
+    Parameters
+        position: particles position at each frame (num_frames X 2 X num_part array)
+        theta: particles orientation at each frame (num_frames X num_part array)
+        space_dim: linear dimension of space
+        grid_size: number of cells per side
+
+    Returns:
+        Number of particles in each cell (density, num_frames X grid_size X grid_size array) and sum of the directions of motion of the particles in each cell (velocity, num_frames X 2 X grid_size X grid_size array).
+    """
+
+    position = np.asarray(position,dtype=np.float64)
+    theta = np.asarray(theta,dtype=np.float64)
+    num_frames = len(position)
+
+    # Index of the cell of each particle, offset by the frame, so that all the frames are binned at once
+    cells = np.floor(position/space_dim*grid_size).astype(np.int64) % grid_size
+    index = ((np.arange(num_frames)[:,None]*grid_size+cells[:,0])*grid_size+cells[:,1]).ravel()
+    size = num_frames*grid_size*grid_size
+
+    density = np.bincount(index,minlength=size).reshape(num_frames,grid_size,grid_size).astype(np.float64)
+    velocity = np.stack([np.bincount(index,np.cos(theta).ravel(),minlength=size).reshape(num_frames,grid_size,grid_size),
+                         np.bincount(index,np.sin(theta).ravel(),minlength=size).reshape(num_frames,grid_size,grid_size)],axis=1)
+
+    return density, velocity
+
+def Shells(grid_size):
+
+    """
+    This function assigns each wave vector, or each periodic displacement, of a grid to the shell of its modulus, in units of the grid spacing.
+
+    Parameters
+        grid_size: number of cells per side
+
+    Returns:
+        Index of the shell of each point of the grid in the order of numpy.fft (shells, grid_size X grid_size array) and number of shells up to half the grid (num_shells).
+    """
+
+    n = np.fft.fftfreq(grid_size)*grid_size
+    shells = np.rint(np.sqrt(n[:,None]**2+n[None,:]**2)).astype(np.int64)
+
+    return shells, grid_size//2+1
+
+def SpatialSums(density,velocity,num_part):
+
+    """
+    This function calculates, through fast Fourier transforms, the sums over a batch of frames of the density structure factor at each wave vector of the grid and of the velocity correlation at each displacement of the grid.
+
+    Parameters
+        density: number of particles in each cell (see GridFields)
+        velocity: sum of the directions of motion in each cell (see GridFields)
+        num_part: number of particles
+
+    Returns:
+        Sums of the structure factor |rho(k)|^2/num_part (structure), of the products of the velocity fluctuations of the pairs of particles (correlation) and of the number of pairs of particles (pairs) at each point of the grid.
+    """
+
+    density_k = np.fft.fft2(density)
+    structure = np.sum(np.abs(density_k)**2,axis=0)/num_part
+
+    # Fluctuations of the directions of motion around the mean one of each frame
+    mean_direction = np.sum(velocity,axis=(2,3))/num_part
+    fluctuation = velocity-mean_direction[:,:,None,None]*density[:,None]
+
+    correlation = np.sum(np.fft.ifft2(np.abs(np.fft.fft2(fluctuation))**2).real,axis=(0,1))
+    pairs = np.sum(np.fft.ifft2(np.abs(density_k)**2).real,axis=0)
+
+    return structure, correlation, pairs
+
+def SpatialAnalysis(position,theta,space_dim,grid_size=64,start=0,stride=1,batch_frames=64):
+
+    """
+    This function calculates the radially averaged density structure factor and velocity correlation function of the saved frames of a simulation. The frames are read in batches, from memory mapped .npy files or from a trajectory, and binned onto a periodic grid, so that each frame costs O(M log M) operations for a grid of M cells instead of O(N^2).
+
+    Parameters
+        position: particles position at each frame (num_frames X 2 X num_part array)
+        theta: particles orientation at each frame (num_frames X num_part array)
+        space_dim: linear dimension of space
+        grid_size: number of cells per side
+        start: number of initial frames excluded (transient)
+        stride: number of saved frames between two analyzed frames
+        batch_frames: number of frames read and transformed at a time
+
+    Returns:
+        Dictionary of the results (results): number of analyzed frames, wave numbers (k) and structure factor S(k) averaged over the frames, distances (r) and velocity correlation C(r) averaged over the pairs of particles at distance r and over the frames, correlation length (first zero of C(r), nan if C(r) has no zero).
+    """
+
+    num_part = np.shape(theta)[1]
+    shells, num_shells = Shells(grid_size)
+
+    structure = np.zeros((grid_size,grid_size))
+    correlation = np.zeros((grid_size,grid_size))
+    pairs = np.zeros((grid_size,grid_size))
+    num_frames = 0
+
+    for begin in range(start,len(theta),stride*batch_frames):
+        stop = min(begin+stride*batch_frames,len(theta))
+
+        density, velocity = GridFields(position[begin:stop:stride],theta[begin:stop:stride],space_dim,grid_size)
+        sums = SpatialSums(density,velocity,num_part)
+
+        structure += sums[0]
+        correlation += sums[1]
+        pairs += sums[2]
+        num_frames += len(density)
+
+    # Radial averages, the structure factor without the k=0 shell
+    counts = np.bincount(shells.ravel(),minlength=num_shells)[:num_shells]
+    structure_factor = np.bincount(shells.ravel(),structure.ravel(),minlength=num_shells)[1:num_shells]/counts[1:]/num_frames
+
+    # The numbers of pairs are integers, rounded so that the empty shells are exactly 0
+    pair_counts = np.rint(np.bincount(shells.ravel(),pairs.ravel(),minlength=num_shells)[:num_shells])
+    velocity_correlation = np.bincount(shells.ravel(),correlation.ravel(),minlength=num_shells)[:num_shells]/np.where(pair_counts > 0,pair_counts,np.nan)
+
+    r = np.arange(num_shells)*space_dim/grid_size
+
+    results = {'num_frames': num_frames,
+               'k': 2*np.pi*np.arange(1,num_shells)/space_dim,
+               'structure_factor': structure_factor,
+               'r': r,
+               'velocity_correlation': velocity_correlation,
+               'correlation_length': CorrelationLength(r,velocity_correlation)}
+
+    return results
+
+def CorrelationLength(r,correlation):
+
+    """
+    This function calculates the correlation length as the first zero of the correlation function, interpolated linearly.
+
+    Parameters
+        r: distances
+        correlation: correlation function at the distances
+
+    Returns:
+        Correlation length (length), nan if the correlation function has no zero.
+    """
+
+    negative = np.nonzero(correlation <= 0)[0]
+    if len(negative) == 0 or negative[0] == 0:
+        return np.nan
+
+    i = negative[0]
+    length = r[i-1]+correlation[i-1]/(correlation[i-1]-correlation[i])*(r[i]-r[i-1])
+
+    return float(length)
+
+def InteractionGraph(positions,int_radius,space_dim,neighbor_method='kdtree',pairs=None,num_replicas=1):
+
+    """
+    This function builds the periodic interaction graph of a configuration as a sparse matrix, whose nonzero entries are the pairs of particles within int_radius of each other.
+
+    Parameters
+        positions: particles positions (N X 2 array)
+        int_radius: interaction radius
+        space_dim: linear dimension of space
+        neighbor_method: neighbor search method, 'kdtree', 'cells' or a Vicsek_Model.VerletList
+        pairs: neighbor pairs (i,j) already found, for instance in a simulation step, if None they are found with neighbor_method
+        num_replicas: number of independent systems whose particles are stored one after the other in positions
+
+    Returns:
+        Sparse adjacency matrix of the pairs (i,j) with i < j (graph, N X N scipy.sparse matrix).
+    """
+
+    num_part = len(positions)
+
+    if pairs is None:
+        pairs = Vicsek_Model.NeighborPairs(positions,int_radius,space_dim,neighbor_method,num_replicas)
+
+    graph = coo_matrix((np.ones(len(pairs),dtype=np.int8),(pairs[:,0],pairs[:,1])),shape=(num_part,num_part)).tocsr()
+
+    return graph
+
+def Clusters(graph,theta,num_replicas=1):
+
+    """
+    This function labels the clusters of a configuration, the connected components of its interaction graph, and calculates their size and polarization.
+
+    Parameters
+        graph: interaction graph (see InteractionGraph)
+        theta: particles orientation
+        num_replicas: number of independent systems whose particles are stored one after the other
+
+    Returns:
+        Cluster of each particle (labels), size (sizes) and polarization, the modulus of the mean direction of motion of its particles, (polarizations) of each cluster, and system of each cluster (replicas). The clusters are ordered by system and then by their first particle.
+    """
+
+    num_clusters, labels = connected_components(graph,directed=False)
+
+    theta = np.asarray(theta,dtype=np.float64).ravel()
+    sizes = np.bincount(labels,minlength=num_clusters)
+    polarizations = np.hypot(np.bincount(labels,np.cos(theta),minlength=num_clusters),np.bincount(labels,np.sin(theta),minlength=num_clusters))/sizes
+
+    # The graph of many systems has no edges between them, each cluster belongs to the system of any of its particles
+    replicas = np.zeros(num_clusters,dtype=np.int64)
+    replicas[labels] = np.arange(len(labels))//(len(labels)//num_replicas)
+
+    return labels, sizes, polarizations, replicas
+
+def ClusterAnalysis(position,theta,int_radius,space_dim,neighbor_method='kdtree',start=0,stride=1,batch_frames=None):
+
+    """
+    This function finds the clusters of interacting particles of the saved frames of a simulation. The frames are read from memory mapped .npy files or from a trajectory, batch_frames at a time, and the frames of a batch are labeled together as independent systems of a single graph.
+
+    Parameters
+        position: particles position at each frame (num_frames X 2 X num_part array)
+        theta: particles orientation at each frame (num_frames X num_part array)
+        int_radius: interaction radius
+        space_dim: linear dimension of space
+        neighbor_method: neighbor search method, 'kdtree' or 'cells'
+        start: number of initial frames excluded (transient)
+        stride: number of saved frames between two analyzed frames
+        batch_frames: number of frames labeled at a time, if None about 65536 particles are labeled at a time
+
+    Returns:
+        Dictionary of the results (results): index of the analyzed frames, number of clusters and size of the largest cluster at each frame, size and polarization of all the clusters one frame after the other with the index of the first cluster of each frame (offsets), and number of clusters of each size summed over the frames (size_histogram).
+    """
+
+    num_part = np.shape(theta)[1]
+    batch_frames = batch_frames or max(1,2**16//num_part)
+
+    frames = np.arange(start,len(theta),stride)
+    sizes_list = []
+    polarizations_list = []
+    num_clusters = []
+
+    for begin in range(0,len(frames),batch_frames):
+        batch = frames[begin:begin+batch_frames]
+
+        # The particles of the frames one after the other, as the replicas of the batched engine
+        positions = np.asarray(position[batch[0]:batch[-1]+1:stride],dtype=np.float64).transpose(0,2,1).reshape(-1,2)
+        orientations = np.asarray(theta[batch[0]:batch[-1]+1:stride])
+
+        graph = InteractionGraph(positions,int_radius,space_dim,neighbor_method,num_replicas=len(batch))
+        labels, sizes, polarizations, replicas = Clusters(graph,orientations,len(batch))
+
+        sizes_list.append(sizes)
+        polarizations_list.append(polarizations)
+        num_clusters.append(np.bincount(replicas,minlength=len(batch)))
+
+    sizes = np.concatenate(sizes_list) if sizes_list else np.zeros(0,dtype=np.int64)
+    num_clusters = np.concatenate(num_clusters) if num_clusters else np.zeros(0,dtype=np.int64)
+    offsets = np.concatenate([[0],np.cumsum(num_clusters)])
+
+    results = {'frames': frames,
+               'num_clusters': num_clusters,
+               'largest_cluster': np.maximum.reduceat(sizes,offsets[:-1]) if len(frames) > 0 else np.zeros(0,dtype=np.int64),
+               'sizes': sizes,
+               'polarizations': np.concatenate(polarizations_list) if polarizations_list else np.zeros(0),
+               'offsets': offsets,
+               'size_histogram': np.bincount(sizes,minlength=num_part+1)}
+
+    return results
+
+def Equilibration(series,batch_size=5):
+
+    """
+    This function detects the end of the transient of a time series with the marginal standard error rule (MSER-5): the series is averaged in batches of batch_size samples and truncated at the batch d that minimizes the variance of the following batch means divided by their number squared. d is searched in the first half of the series and, if the minimum is at its end, the transient has not ended yet.
+
+    Parameters
+        series: time series
+        batch_size: number of samples of each batch
+
+    Returns:
+        Index of the first sample after the transient (start), None if the transient has not ended.
+    """
+
+    num_batches = len(series)//batch_size
+    if num_batches < 4:
+        return None
+
+    means = np.asarray(series[:num_batches*batch_size],dtype=np.float64).reshape(num_batches,batch_size).mean(axis=1)
+
+    # Sums of the batch means from each batch to the last one
+    sums = np.cumsum(means[::-1])[::-1]
+    squares = np.cumsum((means**2)[::-1])[::-1]
+    counts = np.arange(num_batches,0,-1)
+
+    mser = np.maximum(squares-sums**2/counts,0)/counts**2
+
+    # The truncation is searched in the first half, the few last batch means would give a spuriously small statistic
+    batch = int(np.argmin(mser[:num_batches//2+1]))
+    if batch == num_batches//2:
+        return None
+
+    return batch*batch_size
+
+class AdaptiveStop:
+
+    """
+    This class is the stopping criterion of an adaptive run (see Vicsek_Model.Simulate): the run stops when the order parameter has reached the steady state and num_samples effectively independent samples of it have been collected after the transient.
+    The order parameter is recorded at each step and checked at increasing intervals of at least check_every steps: the end of the transient is detected with Equilibration and the number of independent samples after it is the number of steps divided by the integrated autocorrelation time. The next check is at the step at which enough samples are expected, or after a quarter more steps if the transient has not ended.
+
+    Parameters:
+        num_samples: number of effectively independent samples after the transient
+        max_steps: maximum number of steps, the num_steps of the simulation
+        check_every: minimum number of steps between two checks
+        transient: number of initial steps always excluded, the end of the transient is searched after them
+    """
+
+    def __init__(self,num_samples=100,max_steps=10**6,check_every=1000,transient=0):
+
+        self.num_samples=num_samples
+        self.max_steps=max_steps
+        self.check_every=check_every
+        self.transient=transient
+
+        # The order parameter of each step, in an array doubled when full
+        self.phi=np.zeros(min(check_every,max_steps)+1)
+
+        self.step=0
+        self.next_check=min(check_every,max_steps)
+        self.start=None
+        self.tau=np.nan
+        self.independent=0.
+
+    def __call__(self,step,config):
+
+        """
+        This method records the order parameter of a step and, at the steps of the checks, decides whether the run stops.
+
+        Parameters:
+            step: index of the step
+            config: particles configuration after the step
+
+        Returns:
+            True if num_samples independent samples have been collected after the transient (stop).
+        """
+
+        if step >= len(self.phi):
+            self.phi=np.concatenate([self.phi,np.zeros(len(self.phi))])
+        self.phi[step]=Vicsek_Model.OrderParameter(config[2])
+        self.step=step
+
+        if step < self.next_check:
+            return False
+
+        # End of the transient and number of independent samples after it
+        start=Equilibration(self.phi[self.transient:step+1])
+        self.start=start+self.transient if start is not None else None
+        self.tau, self.independent=np.nan, 0.
+        if self.start is not None:
+            rho=Autocorrelation(self.phi[:step+1],(step-self.start)//2,self.start)
+            self.tau, lag=IntegratedTime(rho)
+            self.independent=(step+1-self.start)/self.tau if lag < len(rho)-1 else 0.
+
+        stop=bool(self.independent >= self.num_samples)
+
+        if not stop:
+            if self.independent > 0:
+                next_check=self.start+int(np.ceil(self.num_samples*self.tau))
+            else:
+                next_check=int(1.25*step)
+            self.next_check=min(max(next_check,step+self.check_every),self.max_steps)
+
+        return stop
+
+    def Moments(self):
+
+        """
+        This method calculates the order parameter moments of the steps after the transient, the detected one or else the given one.
+
+        Returns:
+            Running sums of the order parameter moments (moments), as accumulated by Vicsek_Model.AccumulateMoments.
+        """
+
+        moments=Moments(self.phi[:self.step+1],self.start if self.start is not None else self.transient)
+
+        return moments
+
+    def Info(self):
+
+        """
+        This method collects the information of the run at its last step.
+
+        Returns:
+            Dictionary of the run (info): number of steps, detected equilibration step (None if the transient has not ended), integrated autocorrelation time of the order parameter in steps, number of independent samples after the transient and whether num_samples were collected.
+        """
+
+        info={'num_steps': self.step,
+              'equilibration_step': self.start,
+              'tau': float(self.tau),
+              'independent_samples': float(self.independent),
+              'converged': bool(self.independent >= self.num_samples)}
+
+        return info
+
+if __name__ == "__main__":
+
+    # Read configuration file
+    config=configparser.ConfigParser()
+    config.read(sys.argv[1])
+
+    num_part = int(config['parameters']['num_part'])                             # Number of particles
+    save_every = config.getint('output','save_every',fallback=1)                # Number of steps between saved frames
+    transient = config.getint('output','transient',fallback=0)                  # Number of initial steps excluded
+    container = config.getboolean('output','container',fallback=False)          # Read the fields from the trajectory folder
+    max_lag = config.getint('analysis','max_lag',fallback=4096)                 # Largest lag of the autocorrelation functions
+    num_blocks = config.getint('analysis','num_blocks',fallback=50)             # Number of jackknife blocks
+    chunk_size = config.getint('analysis','chunk_size',fallback=2**20)          # Number of samples read at a time
+    spatial = config.getboolean('analysis','spatial',fallback=False)           # Calculate the structure factor and the velocity correlation
+    grid_size = config.getint('analysis','grid_size',fallback=64)               # Number of cells per side of the grid
+    stride = config.getint('analysis','stride',fallback=1)                      # Number of saved frames between two spatially analyzed frames or clustered frames
+    batch_frames = config.getint('analysis','batch_frames',fallback=64)         # Number of frames transformed at a time
+    clusters = config.getboolean('analysis','clusters',fallback=False)         # Find the clusters of interacting particles
+    space_dim = float(config['parameters']['space_dim'])                        # Linear dimension of space
+    int_radius = float(config['parameters']['int_radius'])                      # Interaction radius
+    neighbor_method = config.get('numerics','neighbor_method',fallback='kdtree')
+    results_path = config.get('paths','analysis',fallback='./data/analysis.json')
+    spatial_path = config.get('paths','spatial',fallback='./data/spatial.npz')
+    clusters_path = config.get('paths','clusters',fallback='./data/clusters.npz')
+
+    # The series are memory mapped or read from the trajectory folder one chunk at a time
+    if container:
+        reader = Trajectory.TrajectoryReader(config.get('paths','trajectory',fallback='./data/trajectory'))
+        phi = reader['phi']
+        heading = reader['heading'] if 'heading' in reader.fields else None
+        if spatial or clusters:
+            position = reader['position']
+            theta = reader['theta']
+    else:
+        phi = np.load(config['paths']['order_param'],mmap_mode='r')
+        heading_path = config.get('paths','heading',fallback='./data/heading.npy')
+        heading = np.load(heading_path,mmap_mode='r') if os.path.exists(heading_path) else None
+        if spatial or clusters:
+            position = np.load(config['paths']['position'],mmap_mode='r')
+            theta = np.load(config['paths']['orientation'],mmap_mode='r')
+
+    # First saved frame after the transient
+    start = -(-transient//save_every)
+
+    results = Analyze(phi,num_part,heading,start,max_lag,num_blocks,chunk_size)
+
+    # The structure factor and the velocity correlation are saved with the correlation length in the .npz file
+    if spatial:
+        spatial_results = SpatialAnalysis(position,theta,space_dim,grid_size,start,stride,batch_frames)
+        results['correlation_length'] = spatial_results['correlation_length']
+        np.savez(spatial_path,**spatial_results)
+
+    # The clusters of each frame are saved in the .npz file, their mean number and largest size with the other results
+    if clusters:
+        cluster_results = ClusterAnalysis(position,theta,int_radius,space_dim,neighbor_method,start,stride)
+        results['mean_num_clusters'] = float(np.mean(cluster_results['num_clusters']))
+        results['mean_largest_cluster'] = float(np.mean(cluster_results['largest_cluster']))
+        np.savez(clusters_path,**cluster_results)
+
+    with open(results_path,'w') as f:
+        json.dump(results,f,indent=1)
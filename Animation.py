@@ -8,56 +8,46 @@
 #=======================================================================
 
 import configparser
-import numpy as np
+import os
 import sys
-from sys import argv
-import matplotlib.pyplot as plt
-from matplotlib.animation import FuncAnimation, PillowWriter
+import tempfile
+import matplotlib
 
 # Read configuration file
 config=configparser.ConfigParser()
 config.read(sys.argv[1])
 
-# Import data and parameters
-phi = np.load('./data/phi.npy')
-position = np.load('./data/position.npy')
-theta = np.load('./data/theta.npy')
-
-v0 = float(config['parameters']['vel_mod'])       # Velocity modulus
-eta = float(config['parameters']['noise_ampl'])   # Noise amplitude
-R0 = float(config['parameters']['int_radius'])    # Interaction radius
-dt = float(config['parameters']['time_step'])     # Time step
-N = int(config['parameters']['num_part'])         # Number of particles
-L = float(config['parameters']['space_dim'])      # Linear dimension of system space
-Ns = int(config['parameters']['num_steps'])       # Number of steps
+# Import animation settings
+stride = config.getint('animation','stride',fallback=1)               # Number of saved frames between two animation frames
+headless = config.getboolean('animation','headless',fallback=False)   # Only save the animation, without showing it
+output = config.get('animation','output',fallback='animation.gif')    # Path of the saved animation
+fps = config.getint('animation','fps',fallback=0)                     # Frames per second (0 to show all the frames in one second)
 
-# Create figure
-fig, (ax1,ax2) = plt.subplots(1,2, figsize=(10, 5))
-fig.suptitle("v$_0$ = {}, η = {}, R$_0$ = {}, dt = {}, N = {}".format(v0,eta,R0,dt,N))
+# Without a display the figure is only rendered to the saved file
+if headless:
+    matplotlib.use('Agg')
 
-t = np.linspace(0, Ns+1, Ns+1)
-
-# Prepare order parameter real time plot
-line, = ax2.plot(t, phi, color='r')
-ax2.set_ylim([0,1.1])
-ax2.set_ylabel("Order Parameter")
-ax2.set_xlabel("Frame")
-ax2.grid()
+import matplotlib.pyplot as plt
+from matplotlib.animation import FuncAnimation
+import Export
 
-# Create animation
-def animate(i):
+# Import parameters and paths, the data are memory mapped or decompressed from the trajectory folder only when drawn
+settings = Export.ReadSettings(config)
 
-    ax1.clear()
-    ax1.quiver(position[i][0],position[i][1],np.cos(theta[i]),np.sin(theta[i]))
-    ax1.set_xlim([0,L])
-    ax1.set_ylim([0,L])
+num_frames = len(Export.LoadFields(settings)[0])   # Number of saved frames
+frames = range(0,num_frames,stride)                # Animated frames
 
-    line.set_data(t[:i], phi[:i])
+if not headless:
 
-animation = FuncAnimation(fig, animate, frames= Ns+1, interval=50, repeat=False)
+    # Create figure, the same of the exported frames
+    fig = plt.figure(figsize=(10, 5))
+    figure = Export.FrameFigure(settings,fig)
 
-plt.show()
+    # Create animation, only the changed artists are redrawn
+    animation = FuncAnimation(fig, figure.Update, frames=frames, interval=50, repeat=False, blit=True)
+    plt.show()
 
-# Save animation
-writer = PillowWriter(fps = Ns+1)
-animation.save('animation.gif', writer = writer)
+# Save animation, the frames are rendered to PNG files one at a time and read back one at a time by the GIF writer, so that they are never all kept as RGB images
+with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(output))) as directory:
+    files = Export.RenderFrames(settings,frames,directory)
+    Export.AssembleGIF(files,output,fps or len(frames))
@@ -0,0 +1,213 @@
+#=======================================================================
+# Batch
+#
+# Aim: To run a queue of settings files of the 2D Viscek Model in a
+#      pool of worker processes started once, writing the status of
+#      each job and retrying the failed ones.
+#=======================================================================
+
+import configparser
+import json
+import multiprocessing
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+import Simulation
+
+# Folders of the queue holding the jobs in each state and their status, the pending jobs are the .ini files of the queue itself
+folders = ['running','done','failed','status']
+
+def Warm():
+
+    """
+    This function prepares a worker process, running a tiny simulation so that the modules of the model are imported and their caches are ready before the first job. The plotting libraries are never imported by the workers.
+    """
+
+    config = configparser.ConfigParser()
+    config.read_dict({'parameters': {'vel_mod': '0.1', 'noise_ampl': '0.1', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '10', 'space_dim': '2.0', 'num_steps': '1', 'seed': '0'},
+                      'paths': {'order_param': '', 'position': '', 'orientation': ''},
+                      'output': {'fields': 'phi'}})
+
+    Simulation.Run(config,use_cache=False)
+
+def RunJob(path):
+
+    """
+    This function runs the simulation of a job and saves its result to the local paths of its settings file.
+
+    Parameters
+        path: path of the settings file of the job
+
+    Returns:
+        Dictionary of the record of the job (record): process that ran it, elapsed time, whether the run was read from the cache and information of the adaptive run.
+    """
+
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        raise FileNotFoundError("Settings file not found: {}".format(path))
+
+    start = time.perf_counter()
+
+    result = Simulation.Run(config)
+    Simulation.Save(config,result)
+
+    record = {'pid': os.getpid(), 'elapsed': time.perf_counter()-start, 'cached': result['cached'], 'info': result['info']}
+
+    return record
+
+def WriteStatus(queue,name,status):
+
+    """
+    This function writes the status of a job in the status folder of the queue, first under a temporary name and then renaming it, so that it is never read partially written.
+
+    Parameters
+        queue: folder of the queue
+        name: name of the settings file of the job
+        status: dictionary of the status of the job
+    """
+
+    path = os.path.join(queue,'status',os.path.splitext(name)[0]+'.json')
+
+    with open(path+'.tmp','w') as f:
+        json.dump(status,f,indent=1)
+    os.replace(path+'.tmp',path)
+
+def ProcessQueue(queue,workers=None,retries=2,watch=False,poll=1.,run_job=RunJob):
+
+    """
+    This function runs the jobs of a queue in a pool of worker processes, started once and kept for all the jobs. The pending jobs are the .ini settings files in the queue folder: each job is moved to the running folder when claimed, and then to the done or failed folder, while its state, attempts, record or error are written in the status folder. A failed job is submitted again to the same pool up to retries times.
+    If a worker dies the whole pool breaks and all the jobs it was running fail together, so the pool is started again and these jobs are run again one at a time, without counting an attempt: a job that kills its worker while running alone is then charged an attempt like any other failure, and the other jobs are not.
+    Jobs left in the running folder by an interrupted batch are queued again.
+
+    Parameters
+        queue: folder of the queue
+        workers: number of worker processes, if None the number of cores of the machine
+        retries: maximum number of retries of a failed job
+        watch: if True new jobs are waited for until a file named STOP is created in the queue folder, otherwise the function returns when the queue is empty
+        poll: time in seconds between two scans of the queue folder
+        run_job: function running a job from the path of its settings file in a worker (see RunJob)
+
+    Returns:
+        Dictionary of the final state of each job, 'done' or 'failed', by name (summary).
+    """
+
+    for folder in folders:
+        os.makedirs(os.path.join(queue,folder),exist_ok=True)
+
+    for name in os.listdir(os.path.join(queue,'running')):
+        os.replace(os.path.join(queue,'running',name),os.path.join(queue,name))
+
+    # Start the processes with spawn, so that the workers started again after a crash are fresh interpreters, warmed up like the first ones, and not copies of this long running process
+    def Pool():
+        return ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context('spawn'),initializer=Warm)
+
+    executor = Pool()
+    futures = {}
+    summary = {}
+
+    # Jobs to submit, with their attempt, and jobs running when a pool broke, to run alone
+    ready = []
+    isolated = []
+
+    def Submit(name,attempt):
+        futures[executor.submit(run_job,os.path.join(queue,'running',name))] = (name,attempt)
+        WriteStatus(queue,name,{'state': 'running', 'attempt': attempt, 'submitted': time.time()})
+
+    def Fail(name,attempt,error,queue_again):
+        message = ''.join(traceback.format_exception(type(error),error,error.__traceback__))
+
+        if attempt <= retries:
+            queue_again.append((name,attempt+1))
+            WriteStatus(queue,name,{'state': 'retrying', 'attempt': attempt, 'error': message})
+        else:
+            os.replace(os.path.join(queue,'running',name),os.path.join(queue,'failed',name))
+            WriteStatus(queue,name,{'state': 'failed', 'attempt': attempt, 'error': message})
+            summary[name] = 'failed'
+
+    try:
+        while True:
+
+            # Claim the new jobs
+            for name in sorted(os.listdir(queue)):
+                if name.endswith('.ini') and os.path.isfile(os.path.join(queue,name)):
+                    os.replace(os.path.join(queue,name),os.path.join(queue,'running',name))
+                    ready.append((name,1))
+
+            # The jobs of a broken pool are run one at a time, the other jobs wait for them
+            if isolated:
+                if not futures:
+                    Submit(*isolated.pop(0))
+            else:
+                for name, attempt in ready:
+                    Submit(name,attempt)
+                ready = []
+
+            if not futures:
+                if not watch or os.path.exists(os.path.join(queue,'STOP')):
+                    break
+                time.sleep(poll)
+                continue
+
+            finished, pending = wait(list(futures),timeout=poll,return_when=FIRST_COMPLETED)
+
+            crashed = []
+
+            for future in finished:
+                name, attempt = futures.pop(future)
+
+                try:
+                    record = future.result()
+
+                except BrokenProcessPool as error:
+                    crashed.append((name,attempt,error))
+
+                except Exception as error:
+                    Fail(name,attempt,error,ready)
+
+                else:
+                    os.replace(os.path.join(queue,'running',name),os.path.join(queue,'done',name))
+                    WriteStatus(queue,name,dict(record,state='done',attempt=attempt,finished=time.time()))
+                    summary[name] = 'done'
+
+            if crashed:
+
+                # All the jobs still in the broken pool fail with it
+                for future in pending:
+                    name, attempt = futures.pop(future)
+                    crashed.append((name,attempt,future.exception()))
+
+                executor.shutdown(wait=True)
+                executor = Pool()
+
+                # A job that crashed alone killed its worker, otherwise the culprit is unknown and the jobs are run alone
+                if len(crashed) == 1:
+                    Fail(*crashed[0],isolated)
+                else:
+                    for name, attempt, error in crashed:
+                        isolated.append((name,attempt))
+                        WriteStatus(queue,name,{'state': 'requeued', 'attempt': attempt, 'error': str(error)})
+
+    finally:
+        executor.shutdown(wait=True,cancel_futures=True)
+
+    return summary
+
+if __name__ == "__main__":
+
+    # python Batch.py <settings file>
+
+    config=configparser.ConfigParser()
+    config.read(sys.argv[1])
+
+    queue = config.get('batch','queue',fallback='./data/queue')     # Folder of the queue of settings files
+    workers = config.getint('batch','workers',fallback=0) or None   # Number of worker processes (0 for all the cores)
+    retries = config.getint('batch','retries',fallback=2)           # Maximum number of retries of a failed job
+    watch = config.getboolean('batch','watch',fallback=False)       # Wait for new jobs until a STOP file is created in the queue
+    poll = config.getfloat('batch','poll',fallback=1.)              # Time in seconds between two scans of the queue
+
+    summary = ProcessQueue(queue,workers,retries,watch,poll)
+
+    print("{} jobs done, {} failed".format(sum(state == 'done' for state in summary.values()),sum(state == 'failed' for state in summary.values())))
@@ -0,0 +1,232 @@
+#=======================================================================
+# Benchmarks
+#
+# Aim: To time the step hot paths of the 2D Viscek Model as a function
+#      of the number of particles and of the density, and to compare
+#      the results of two versions.
+#=======================================================================
+
+import configparser
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import Vicsek_Model
+import Vicsek_Numba
+import Analysis
+import Simulation
+import Export
+
+def Timer(func,min_time=0.2,max_repeat=20):
+
+    """
+    This function calls func at least once and then repeatedly until min_time seconds have passed or max_repeat calls have been made.
+
+    Parameters
+        func: function without arguments
+        min_time: minimum total time in seconds
+        max_repeat: maximum number of calls
+
+    Returns:
+        Minimum and median time of a call in seconds (best, median) and number of calls (repeat).
+    """
+
+    times = []
+    while not times or (len(times) < max_repeat and sum(times) < min_time):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter()-start)
+
+    return min(times), float(np.median(times)), len(times)
+
+def Setup(num_part,density,int_radius,dtype=np.float64):
+
+    """
+    This function creates a random configuration with the given number of particles and density.
+
+    Parameters
+        num_part: number of particles
+        density: number of particles per int_radius^2
+        int_radius: interaction radius
+        dtype: floating point type of the configuration
+
+    Returns:
+        Initial configuration (config), velocity (vel) and linear dimension of space (space_dim).
+    """
+
+    space_dim = int_radius*np.sqrt(num_part/density)
+
+    np.random.seed(1234)
+    config = Vicsek_Model.InitialConfiguration(num_part,space_dim,dtype=dtype)
+    vel = Vicsek_Model.VelocityCalculation(0.2,config[2])
+
+    return config, vel, space_dim
+
+def Benchmarks(num_part,density,directory,int_radius=1.,num_steps=5):
+
+    """
+    This function prepares the benchmarks of a system with the given number of particles and density.
+
+    Parameters
+        num_part: number of particles
+        density: number of particles per int_radius^2
+        directory: directory of the files of the save and load benchmarks
+        int_radius: interaction radius
+        num_steps: number of steps of the Simulate benchmarks
+
+    Returns:
+        Dictionary of the benchmark functions without arguments, by name (benchmarks).
+    """
+
+    config, vel, space_dim = Setup(num_part,density,int_radius)
+    positions = np.array([config[0],config[1]]).T
+
+    benchmarks = {}
+
+    # Single particle query, the original per-particle path
+    benchmarks['FindNeighbors'] = lambda: Vicsek_Model.FindNeighbors(positions,int_radius,[positions[0]],space_dim)
+
+    for method in ['kdtree','cells']:
+        benchmarks['NeighborPairs[{}]'.format(method)] = lambda method=method: Vicsek_Model.NeighborPairs(positions,int_radius,space_dim,method)
+        benchmarks['NeighborsMeanAngle[{}]'.format(method)] = lambda method=method: Vicsek_Model.NeighborsMeanAngle(config,int_radius,space_dim,method)
+        benchmarks['ConfigurationUpdate[{}]'.format(method)] = lambda method=method: Vicsek_Model.ConfigurationUpdate(config,vel,int_radius,0.1,space_dim,1.,method)
+        benchmarks['Simulate[{}]'.format(method)] = lambda method=method: Vicsek_Model.Simulate(config,vel,int_radius,0.1,space_dim,1.,num_steps,0.2,method)
+
+    # Threaded neighbor search and averaging on all the cores
+    num_threads = max(os.cpu_count(),2)
+    benchmarks['NeighborsMeanAngle[threads]'] = lambda: Vicsek_Model.NeighborsMeanAngle(config,int_radius,space_dim,num_threads=num_threads)
+    benchmarks['Simulate[threads]'] = lambda: Vicsek_Model.Simulate(config,vel,int_radius,0.1,space_dim,1.,num_steps,0.2,num_threads=num_threads)
+
+    # Batched engine, 16 replicas of the system at once
+    rngs = [np.random.default_rng(seed_seq) for seed_seq in np.random.SeedSequence(1234).spawn(16)]
+    batch_config = Vicsek_Model.BatchInitialConfiguration(16,num_part,space_dim,rngs)
+    batch_vel = Vicsek_Model.VelocityCalculation(0.2,batch_config[:,2])
+    benchmarks['BatchSimulate[16]'] = lambda: Vicsek_Model.BatchSimulate(batch_config,batch_vel,int_radius,0.1,space_dim,1.,num_steps,0.2,rngs=rngs)
+
+    # Clusters of a saved frame, from the neighbor search to the labels
+    benchmarks['Clusters'] = lambda: Analysis.Clusters(Analysis.InteractionGraph(positions,int_radius,space_dim),config[2])
+
+    benchmarks['Simulate[verlet]'] = lambda: Vicsek_Model.Simulate(config,vel,int_radius,0.1,space_dim,1.,num_steps,0.2,'kdtree',0.5)
+
+    config32, vel32, space_dim = Setup(num_part,density,int_radius,np.float32)
+    benchmarks['Simulate[float32]'] = lambda: Vicsek_Model.Simulate(config32,vel32,int_radius,0.1,space_dim,1.,num_steps,0.2)
+
+    if Vicsek_Numba.numba is not None:
+        benchmarks['Simulate[numba]'] = lambda: Vicsek_Numba.Simulate(config,vel,int_radius,0.1,space_dim,1.,num_steps,0.2)
+
+    # Save path of Simulation.py, to .npy files and to a trajectory folder, and frames loading of Animation.py and Export.py
+    out = Vicsek_Model.TrajectoryArrays(num_steps+1,num_part,['position','theta','phi'])
+    Vicsek_Model.Simulate(config,vel,int_radius,0.1,space_dim,1.,num_steps,0.2,out=out)
+    result = {'out': out, 'info': None, 'stats': None, 'cached': False}
+
+    for container in [False,True]:
+
+        settings = configparser.ConfigParser()
+        settings.read_dict({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.1', 'int_radius': str(int_radius), 'time_step': '1.0',
+                                           'num_part': str(num_part), 'space_dim': str(space_dim), 'num_steps': str(num_steps), 'seed': '1234'},
+                            'paths': {'order_param': os.path.join(directory,'phi.npy'), 'position': os.path.join(directory,'position.npy'),
+                                      'orientation': os.path.join(directory,'theta.npy'), 'trajectory': os.path.join(directory,'trajectory')},
+                            'output': {'container': 'yes' if container else 'no'}})
+
+        def Load(settings=settings):
+            phi, position, theta = Export.LoadFields(Export.ReadSettings(settings))
+            np.array(position[-1]), np.array(theta[-1])
+
+        name = 'container' if container else 'npy'
+        benchmarks['Save[{}]'.format(name)] = lambda settings=settings: Simulation.Save(settings,result)
+        Simulation.Save(settings,result)
+        benchmarks['Load[{}]'.format(name)] = Load
+
+    return benchmarks
+
+def Run(sizes,densities,int_radius=1.,num_steps=5,min_time=0.2):
+
+    """
+    This function runs the benchmarks for each number of particles and density.
+
+    Parameters
+        sizes: numbers of particles
+        densities: numbers of particles per int_radius^2
+        int_radius: interaction radius
+        num_steps: number of steps of the Simulate benchmarks
+        min_time: minimum total time in seconds of each benchmark
+
+    Returns:
+        Dictionary with the machine information and a record for each benchmark (results).
+    """
+
+    try:
+        commit = subprocess.run(['git','rev-parse','HEAD'],capture_output=True,text=True,cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+
+    results = {'machine': {'platform': platform.platform(), 'python': platform.python_version(), 'numpy': np.__version__, 'cpu_count': os.cpu_count()},
+               'commit': commit,
+               'records': []}
+
+    for num_part in sizes:
+        for density in densities:
+            with tempfile.TemporaryDirectory() as directory:
+                for name, func in Benchmarks(num_part,density,directory,int_radius,num_steps).items():
+
+                    # A first call, not timed, so that caches and compiled kernels are ready
+                    func()
+                    best, median, repeat = Timer(func,min_time)
+
+                    results['records'].append({'name': name, 'num_part': num_part, 'density': density, 'int_radius': int_radius,
+                                               'num_steps': num_steps, 'best': best, 'median': median, 'repeat': repeat})
+
+    return results
+
+def Compare(old,new):
+
+    """
+    This function compares the best times of two benchmark results.
+
+    Parameters
+        old: results of the reference version
+        new: results of the new version
+
+    Returns:
+        List of (name, num_part, density, old time, new time, ratio new/old) for the benchmarks present in both (comparison).
+    """
+
+    key = lambda r: (r['name'],r['num_part'],r['density'])
+    old_records = {key(r): r for r in old['records']}
+
+    comparison = []
+    for r in new['records']:
+        if key(r) in old_records:
+            best = old_records[key(r)]['best']
+            comparison.append(key(r)+(best,r['best'],r['best']/best))
+
+    return comparison
+
+if __name__ == "__main__":
+
+    # python Benchmarks.py <results.json> [--full]
+    # python Benchmarks.py --compare <old.json> <new.json>
+
+    if sys.argv[1] == '--compare':
+
+        with open(sys.argv[2]) as f:
+            old = json.load(f)
+        with open(sys.argv[3]) as f:
+            new = json.load(f)
+
+        for name, num_part, density, old_time, new_time, ratio in Compare(old,new):
+            print("{:32s} N={:<7d} density={:<5g} {:10.6f} s -> {:10.6f} s  x{:.2f}".format(name,num_part,density,old_time,new_time,ratio))
+
+    else:
+
+        sizes = [100,1000,10000,100000] if '--full' in sys.argv else [100,1000,10000]
+        densities = [1,4]
+
+        results = Run(sizes,densities)
+
+        with open(sys.argv[1],'w') as f:
+            json.dump(results,f,indent=1)
@@ -0,0 +1,228 @@
+#=======================================================================
+# Cache
+#
+# Aim: To store the results of the completed simulations of the 2D
+#      Viscek Model in a local folder, indexed by a SQLite database and
+#      keyed by a hash of the settings and of the code version, so that
+#      a repeated run is read back instead of simulated again.
+#=======================================================================
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import closing
+import numpy as np
+import Trajectory
+
+# Source files whose content determines the results of a simulation
+source_files = ['Vicsek_Model.py','Vicsek_Numba.py','Vicsek_Domain.py','Analysis.py','Simulation.py','Trajectory.py']
+
+def CodeVersion():
+
+    """
+    This function calculates the version of the code as the hash of the source files that determine the results of a simulation, so that any change of the model invalidates the cached results.
+
+    Returns:
+        Hexadecimal SHA-256 hash of the source files (version).
+    """
+
+    digest = hashlib.sha256()
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    for name in source_files:
+        path = os.path.join(directory,name)
+        if os.path.exists(path):
+            with open(path,'rb') as f:
+                digest.update(name.encode()+b'\0'+f.read())
+
+    version = digest.hexdigest()
+
+    return version
+
+def Key(config,version=None):
+
+    """
+    This function calculates the key of a run from all the model parameters, the seed included, the numerical and output settings that change its results and the code version. The parameters and the numerical settings are read with their types and defaults, as in Simulation.ReadSettings, so that for example 0.1 and 0.10, or a missing verlet_skin and 0, give the same key. The number of threads and the number of processes of the domain engine are left out, since the results do not depend on them.
+
+    Parameters
+        config: ConfigParser of the settings file
+        version: code version, if None the one of CodeVersion
+
+    Returns:
+        Hexadecimal SHA-256 hash of the settings and of the code version (key).
+    """
+
+    if version is None:
+        version = CodeVersion()
+
+    numerics = {'neighbor_method': config.get('numerics','neighbor_method',fallback='kdtree'),
+                'verlet_skin': config.getfloat('numerics','verlet_skin',fallback=0.),
+                'engine': config.get('numerics','engine',fallback='numpy'),
+                'dtype': np.dtype(config.get('numerics','dtype',fallback='float64')).name}
+
+    # The transient is also the one after which the end of the transient of an adaptive run is searched
+    adaptive = {'num_samples': config.getint('adaptive','num_samples',fallback=100),
+                'check_every': config.getint('adaptive','check_every',fallback=1000)} if config.getboolean('adaptive','enabled',fallback=False) else None
+
+    description = {'parameters': {option: float(value) for option, value in config['parameters'].items()},
+                   'numerics': numerics,
+                   'fields': sorted(f.strip() for f in config.get('output','fields',fallback='position,theta,phi').split(',')),
+                   'save_every': config.getint('output','save_every',fallback=1),
+                   'transient': config.getint('output','transient',fallback=0),
+                   'adaptive': adaptive,
+                   'version': version}
+
+    key = hashlib.sha256(json.dumps(description,sort_keys=True).encode()).hexdigest()
+
+    return key
+
+class ResultCache:
+
+    """
+    This class stores the results of completed runs in a folder: the saved fields of each run are a trajectory folder (see Trajectory.WriteTrajectory) named after its key, and a SQLite database indexes the runs with their size and time of last access. When the total size exceeds max_size the least recently used runs are evicted.
+    Each operation opens its own connection, so that the cache can be shared by many processes.
+
+    Parameters:
+        path: folder of the cache
+        max_size: maximum total size of the cached runs in bytes
+    """
+
+    def __init__(self,path,max_size):
+
+        self.path=path
+        self.max_size=max_size
+        self.index=os.path.join(path,'index.sqlite')
+
+        os.makedirs(path,exist_ok=True)
+
+        with closing(self.Connect()) as connection, connection:
+            connection.execute('CREATE TABLE IF NOT EXISTS runs (key TEXT PRIMARY KEY, size INTEGER, created REAL, last_access REAL, info TEXT)')
+
+    def Connect(self):
+
+        """
+        This method opens a connection to the index, waiting for the other processes writing it.
+
+        Returns:
+            Connection to the SQLite database (connection).
+        """
+
+        connection=sqlite3.connect(self.index,timeout=60)
+
+        return connection
+
+    def Get(self,key):
+
+        """
+        This method reads the results of a run, updating its time of last access.
+
+        Parameters:
+            key: key of the run (see Key)
+
+        Returns:
+            Dictionary of the arrays of the saved fields (out) and information of the run (info), or None if the run is not in the cache.
+        """
+
+        folder=os.path.join(self.path,key)
+
+        with closing(self.Connect()) as connection, connection:
+            row=connection.execute('SELECT info FROM runs WHERE key = ?',(key,)).fetchone()
+
+            if row is None:
+                return None
+
+            # The folder may have been removed by hand, the run is then dropped from the index
+            if not os.path.exists(os.path.join(folder,'metadata.json')):
+                connection.execute('DELETE FROM runs WHERE key = ?',(key,))
+                return None
+
+            connection.execute('UPDATE runs SET last_access = ? WHERE key = ?',(time.time(),key))
+
+        # Another process may evict the run while it is read, it is then a miss and what is left of it is removed
+        try:
+            reader=Trajectory.TrajectoryReader(folder)
+            out={field: reader[field][:] for field in reader.fields}
+            if reader.moments is not None:
+                out['moments']=reader.moments
+        except OSError:
+            with closing(self.Connect()) as connection, connection:
+                connection.execute('DELETE FROM runs WHERE key = ?',(key,))
+            shutil.rmtree(folder,ignore_errors=True)
+            return None
+
+        info=json.loads(row[0]) if row[0] is not None else None
+
+        return out, info
+
+    def Put(self,key,out,settings=None,info=None):
+
+        """
+        This method stores the results of a run, then evicts the least recently used runs until the total size is at most max_size. The trajectory is written under a temporary name and then renamed, so that a run is never read partially written.
+
+        Parameters:
+            key: key of the run (see Key)
+            out: dictionary of the arrays of the saved fields (see Vicsek_Model.TrajectoryArrays)
+            settings: ConfigParser of the settings file of the run, embedded in the trajectory
+            info: JSON serializable information of the run, such as the one of an adaptive run
+        """
+
+        folder=os.path.join(self.path,key)
+        temporary=folder+'.tmp{}'.format(os.getpid())
+
+        Trajectory.WriteTrajectory(temporary,out,settings)
+        size=sum(os.path.getsize(os.path.join(temporary,name)) for name in os.listdir(temporary))
+
+        # Another process may have stored the same run in the meantime, then the rename fails and its copy is kept
+        try:
+            os.replace(temporary,folder)
+        except OSError:
+            shutil.rmtree(temporary,ignore_errors=True)
+
+        now=time.time()
+        with closing(self.Connect()) as connection, connection:
+            connection.execute('INSERT OR REPLACE INTO runs VALUES (?, ?, ?, ?, ?)',(key,size,now,now,json.dumps(info) if info is not None else None))
+
+        self.Evict()
+
+    def Evict(self):
+
+        """
+        This method removes the least recently used runs until the total size of the cache is at most max_size.
+
+        Returns:
+            List of the keys of the removed runs (evicted).
+        """
+
+        evicted=[]
+
+        with closing(self.Connect()) as connection, connection:
+            rows=connection.execute('SELECT key, size FROM runs ORDER BY last_access').fetchall()
+            total=sum(size for key, size in rows)
+
+            for key, size in rows:
+                if total <= self.max_size:
+                    break
+
+                connection.execute('DELETE FROM runs WHERE key = ?',(key,))
+                shutil.rmtree(os.path.join(self.path,key),ignore_errors=True)
+                total-=size
+                evicted.append(key)
+
+        return evicted
+
+    def Size(self):
+
+        """
+        This method returns the total size of the cached runs.
+
+        Returns:
+            Total size in bytes (size).
+        """
+
+        with closing(self.Connect()) as connection, connection:
+            size=connection.execute('SELECT COALESCE(SUM(size), 0) FROM runs').fetchone()[0]
+
+        return size
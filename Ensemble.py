@@ -0,0 +1,117 @@
+#=======================================================================
+# Ensemble
+#
+# Aim: To simulate independent replicas of the 2D Viscek Model in
+#      parallel and average the order parameter evolution.
+#=======================================================================
+
+import configparser
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import Vicsek_Model
+import Vicsek_Numba
+from Sweep import ReadParameters
+
+def RunReplica(params,seed_seq):
+
+    """
+    This function simulates a replica of the model with its own random number generator.
+
+    Parameters
+        params: dictionary of the parameters of the run
+        seed_seq: seed sequence of the replica (numpy.random.SeedSequence)
+
+    Returns:
+        Order parameter at each saved frame of the replica (phi).
+    """
+
+    rng = np.random.default_rng(seed_seq)
+
+    config = Vicsek_Model.InitialConfiguration(params['num_part'],params['space_dim'],rng,np.dtype(params.get('dtype','float64')))
+    vel = Vicsek_Model.VelocityCalculation(params['vel_mod'],config[2])
+
+    out = Vicsek_Model.TrajectoryArrays(params['num_steps']//params['save_every']+1,params['num_part'],['phi'])
+    if params.get('engine') == 'numba':
+        Vicsek_Numba.Simulate(config,vel,params['int_radius'],params['noise_ampl'],params['space_dim'],params['time_step'],params['num_steps'],params['vel_mod'],
+                              params['save_every'],out,rng=rng)
+    else:
+        Vicsek_Model.Simulate(config,vel,params['int_radius'],params['noise_ampl'],params['space_dim'],params['time_step'],params['num_steps'],params['vel_mod'],
+                              params['neighbor_method'],params['verlet_skin'],params['save_every'],out,rng=rng,num_threads=params.get('num_threads',1))
+
+    return out['phi']
+
+def RunBatch(params,seed_seqs):
+
+    """
+    This function simulates some replicas of the model at once with the batched engine, each with its own random number generator. Each replica is equal to the one simulated by RunReplica with the numpy engine.
+
+    Parameters
+        params: dictionary of the parameters of the run
+        seed_seqs: seed sequence of each replica (numpy.random.SeedSequence)
+
+    Returns:
+        Order parameter of each replica at each saved frame (phi).
+    """
+
+    rngs = [np.random.default_rng(seed_seq) for seed_seq in seed_seqs]
+
+    config = Vicsek_Model.BatchInitialConfiguration(len(rngs),params['num_part'],params['space_dim'],rngs,np.dtype(params.get('dtype','float64')))
+    vel = Vicsek_Model.VelocityCalculation(params['vel_mod'],config[:,2])
+
+    out = Vicsek_Model.TrajectoryArrays(params['num_steps']//params['save_every']+1,params['num_part'],['phi'],num_replicas=len(rngs))
+    Vicsek_Model.BatchSimulate(config,vel,params['int_radius'],params['noise_ampl'],params['space_dim'],params['time_step'],params['num_steps'],params['vel_mod'],
+                               params['neighbor_method'],params['save_every'],out,rngs=rngs)
+
+    return out['phi']
+
+def Ensemble(params,num_replicas,workers=None):
+
+    """
+    This function simulates num_replicas independent replicas of the model in parallel processes. The random number generator of each replica is derived from the seed of the parameters, so that the results do not depend on the number of processes.
+
+    Parameters
+        params: dictionary of the parameters of the run
+        num_replicas: number of replicas
+        workers: number of processes, if None the number of cores of the machine
+
+    Returns:
+        Order parameter of each replica at each saved frame (phi, num_replicas X num_frames array), ensemble mean (mean_phi) and standard error (err_phi) of the order parameter at each saved frame.
+    """
+
+    seed_seqs = np.random.SeedSequence(params['seed']).spawn(num_replicas)
+
+    # Start the processes with spawn, forking after the compiled kernel has started its threads can deadlock
+    with ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context('spawn')) as executor:
+
+        # The batched engine simulates a group of replicas in each process
+        if params.get('engine') == 'batch':
+            groups = [list(group) for group in np.array_split(np.arange(num_replicas),min(num_replicas,workers or os.cpu_count()))]
+            phi = np.concatenate(list(executor.map(RunBatch,[params]*len(groups),[[seed_seqs[i] for i in group] for group in groups])))
+        else:
+            phi = np.array(list(executor.map(RunReplica,[params]*num_replicas,seed_seqs)))
+
+    mean_phi = np.mean(phi,axis=0)
+    err_phi = np.std(phi,axis=0,ddof=1)/np.sqrt(num_replicas) if num_replicas > 1 else np.zeros_like(mean_phi)
+
+    return phi, mean_phi, err_phi
+
+if __name__ == "__main__":
+
+    # Read configuration file
+    config=configparser.ConfigParser()
+    config.read(sys.argv[1])
+
+    params = ReadParameters(config)
+    params['save_every'] = config.getint('output','save_every',fallback=1)
+
+    num_replicas = config.getint('ensemble','replicas',fallback=8)                # Number of replicas
+    workers = config.getint('ensemble','workers',fallback=0) or os.cpu_count()      # Number of processes (0 for all the cores)
+    results_path = config.get('ensemble','results',fallback='./data/ensemble.npz')  # Path of the results
+
+    phi, mean_phi, err_phi = Ensemble(params,num_replicas,workers)
+
+    # Save the order parameter of each replica and its ensemble average
+    np.savez(results_path,phi=phi,mean_phi=mean_phi,err_phi=err_phi)
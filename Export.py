@@ -0,0 +1,240 @@
+#=======================================================================
+# Export
+#
+# Aim: To render the frames of a saved simulation of the 2D Viscek
+#      Model in parallel processes and assemble them into a GIF or a
+#      numbered PNG sequence.
+#=======================================================================
+
+import configparser
+import multiprocessing
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from PIL import Image
+import Trajectory
+
+def ReadSettings(config):
+
+    """
+    This function reads the parameters and the paths needed to render the frames of a settings file.
+
+    Parameters
+        config: ConfigParser of the settings file
+
+    Returns:
+        Dictionary of the settings (settings).
+    """
+
+    settings = {'vel_mod': float(config['parameters']['vel_mod']),
+                'noise_ampl': float(config['parameters']['noise_ampl']),
+                'int_radius': float(config['parameters']['int_radius']),
+                'time_step': float(config['parameters']['time_step']),
+                'num_part': int(config['parameters']['num_part']),
+                'space_dim': float(config['parameters']['space_dim']),
+                'save_every': config.getint('output','save_every',fallback=1),
+                'order_param': config['paths']['order_param'],
+                'position': config['paths']['position'],
+                'orientation': config['paths']['orientation'],
+                'trajectory': config.get('paths','trajectory',fallback='./data/trajectory') if config.getboolean('output','container',fallback=False) else None}
+
+    return settings
+
+def LoadFields(settings):
+
+    """
+    This function opens the order parameter, positions and orientations of a saved simulation, memory mapped from the .npy files or read lazily from the trajectory folder, so that only the frames drawn are read.
+
+    Parameters
+        settings: dictionary of the settings (see ReadSettings)
+
+    Returns:
+        Order parameter at each saved frame (phi), positions (position) and orientations (theta) of the particles, indexed by frame.
+    """
+
+    if settings.get('trajectory'):
+        reader = Trajectory.TrajectoryReader(settings['trajectory'])
+        phi = reader['phi'][:]
+        position = reader['position']
+        theta = reader['theta']
+    else:
+        phi = np.load(settings['order_param'],mmap_mode='r')
+        position = np.load(settings['position'],mmap_mode='r')
+        theta = np.load(settings['orientation'],mmap_mode='r')
+
+    return phi, position, theta
+
+class FrameFigure:
+
+    """
+    This class draws the figure of a saved simulation, shared by the Animation and Export files: the particles arrows on the left and the order parameter evolution on the right. The arrows are created once and then moved to each frame.
+
+    Parameters:
+        settings: dictionary of the settings (see ReadSettings)
+        fig: matplotlib figure of size 10 X 5 where the figure is drawn
+    """
+
+    def __init__(self,settings,fig):
+
+        self.phi,self.position,self.theta=LoadFields(settings)
+        self.t=np.arange(len(self.phi))*settings['save_every']
+        L=settings['space_dim']
+
+        ax1,ax2=fig.subplots(1,2)
+        fig.suptitle("v$_0$ = {}, η = {}, R$_0$ = {}, dt = {}, N = {}".format(settings['vel_mod'],settings['noise_ampl'],settings['int_radius'],settings['time_step'],settings['num_part']))
+
+        # Order parameter plot
+        self.line,=ax2.plot(self.t,self.phi,color='r')
+        ax2.set_ylim([0,1.1])
+        ax2.set_ylabel("Order Parameter")
+        ax2.set_xlabel("Step")
+        ax2.grid()
+
+        # Particles motion plot
+        self.arrows=ax1.quiver(self.position[0][0],self.position[0][1],np.cos(self.theta[0]),np.sin(self.theta[0]))
+        ax1.set_xlim([0,L])
+        ax1.set_ylim([0,L])
+
+        self.fig=fig
+        self.axes=(ax1,ax2)
+
+    def Update(self,i):
+
+        """
+        This method moves the arrows and the order parameter line to a saved frame.
+
+        Parameters:
+            i: index of the saved frame
+
+        Returns:
+            The changed artists, the arrows and the line (artists).
+        """
+
+        self.arrows.set_offsets(np.column_stack((self.position[i][0],self.position[i][1])))
+        self.arrows.set_UVC(np.cos(self.theta[i]),np.sin(self.theta[i]))
+        self.line.set_data(self.t[:i],self.phi[:i])
+
+        return self.arrows, self.line
+
+def RenderFrames(settings,frames,directory,palette=True):
+
+    """
+    This function renders the given frames of a saved simulation to PNG files. The static part of the figure is drawn once and only the particles arrows and the order parameter line are drawn at each frame.
+
+    Parameters
+        settings: dictionary of the settings (see ReadSettings)
+        frames: indices of the saved frames to render
+        directory: directory of the PNG files, named frame_<index>.png
+        palette: if True the frames are converted to 256 colors, as needed by the GIF format
+
+    Returns:
+        List of the paths of the PNG files (files).
+    """
+
+    # Headless figure, without pyplot; each process reads only the frames it renders
+    fig = Figure(figsize=(10, 5))
+    canvas = FigureCanvasAgg(fig)
+    figure = FrameFigure(settings,fig)
+    ax1, ax2 = figure.axes
+
+    figure.arrows.set_animated(True)
+    figure.line.set_animated(True)
+
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+
+    files = []
+    for i in frames:
+
+        canvas.restore_region(background)
+
+        arrows, line = figure.Update(i)
+        ax1.draw_artist(arrows)
+        ax2.draw_artist(line)
+
+        image = Image.fromarray(np.asarray(canvas.buffer_rgba())).convert('RGB')
+        if palette:
+            image = image.convert('P',palette=Image.ADAPTIVE)
+
+        files.append(os.path.join(directory,'frame_{:06d}.png'.format(i)))
+        image.save(files[-1])
+
+    return files
+
+def ExportFrames(settings,frames,directory,workers=None,palette=True):
+
+    """
+    This function splits the frames in contiguous chunks and renders them to PNG files in parallel processes.
+
+    Parameters
+        settings: dictionary of the settings (see ReadSettings)
+        frames: indices of the saved frames to render
+        directory: directory of the PNG files
+        workers: number of processes, if None the number of cores of the machine
+        palette: if True the frames are converted to 256 colors, as needed by the GIF format
+
+    Returns:
+        List of the paths of the PNG files, in the order of the frames (files).
+    """
+
+    os.makedirs(directory,exist_ok=True)
+
+    workers = workers or os.cpu_count()
+
+    # A few chunks per process, so that the processes end at about the same time
+    chunks = [chunk for chunk in np.array_split(np.asarray(frames),4*workers) if len(chunk) > 0]
+
+    # Start the processes with spawn, so that the workers do not inherit the matplotlib state of the parent, e.g. the interactive backend of the Animation file
+    with ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = executor.map(RenderFrames,[settings]*len(chunks),chunks,[directory]*len(chunks),[palette]*len(chunks))
+        files = [f for chunk_files in results for f in chunk_files]
+
+    return files
+
+def AssembleGIF(files,output,fps):
+
+    """
+    This function assembles the PNG frames into a GIF animation.
+
+    Parameters
+        files: paths of the PNG files, in the order of the frames
+        output: path of the GIF file
+        fps: frames per second
+    """
+
+    # Each frame is loaded and its file closed before the next one, so that thousands of frames do not exhaust the open files limit
+    def Load(path):
+        with Image.open(path) as image:
+            return image.copy()
+
+    Load(files[0]).save(output, save_all=True, append_images=(Load(f) for f in files[1:]), duration=1000/fps, loop=0)
+
+if __name__ == "__main__":
+
+    # Read configuration file
+    config=configparser.ConfigParser()
+    config.read(sys.argv[1])
+
+    settings = ReadSettings(config)
+
+    stride = config.getint('animation','stride',fallback=1)                 # Number of saved frames between two exported frames
+    fps = config.getint('animation','fps',fallback=0)                       # Frames per second (0 to show all the frames in one second)
+    output = config.get('animation','output',fallback='animation.gif')      # Path of the GIF animation
+    directory = config.get('export','directory',fallback='./data/frames')   # Directory of the PNG frames
+    fmt = config.get('export','format',fallback='gif')                      # Export format (gif or png)
+    workers = config.getint('export','workers',fallback=0) or os.cpu_count()  # Number of processes (0 for all the cores)
+
+    if settings['trajectory']:
+        num_frames = Trajectory.TrajectoryReader(settings['trajectory']).num_frames
+    else:
+        num_frames = len(np.load(settings['order_param'],mmap_mode='r'))
+    frames = range(0,num_frames,stride)
+
+    # The PNG sequence keeps all the colors, the GIF frames are reduced to 256 colors by the processes
+    files = ExportFrames(settings,frames,directory,workers,palette=(fmt == 'gif'))
+
+    if fmt == 'gif':
+        AssembleGIF(files,output,fps or len(frames))
@@ -8,50 +8,232 @@
 #=======================================================================
 
 import configparser
+import json
 import numpy as np
 import sys
-from sys import argv
-import matplotlib.pyplot as plt
 import Vicsek_Model
+import Trajectory
 
-# Read configuration file
-config=configparser.ConfigParser()
-config.read(sys.argv[1])
-
-# Import model parameters
-v0 = float(config['parameters']['vel_mod'])       # Velocity modulus
-eta = float(config['parameters']['noise_ampl'])   # Noise amplitude
-R0 = float(config['parameters']['int_radius'])    # Interaction radius
-dt = float(config['parameters']['time_step'])     # Time step
-N = int(config['parameters']['num_part'])         # Number of particles
-L = float(config['parameters']['space_dim'])      # Linear dimension of system space
-Ns = int(config['parameters']['num_steps'])       # Number of steps
-seed = int(config['parameters']['seed'])          # Random seed
-
-# Import local paths
-phi_path = config['paths']['order_param']
-position_path = config['paths']['position']
-theta_path = config['paths']['orientation']
-
-# Initialization
-np.random.seed(seed)
-
-# Calculate initial configuration (position and orientation)
-config = Vicsek_Model.InitialConfiguration(N,L)
-
-# Calculate initial velocity
-vel = Vicsek_Model.VelocityCalculation(v0,config[2])
-
-# Update particles configuration Ns times
-position_data, theta_data = Vicsek_Model.Simulate(config,vel,R0,eta,L,dt,Ns,v0)
-
-# Calculate the order parameter for each configuration
-phi_data=np.empty(Ns+1)
-for i in range(0,len(theta_data)):
-    phi = Vicsek_Model.OrderParameter(theta_data[i])
-    phi_data[i]=phi
-
-# Save particles configuration and order parameter evolution
-np.save(position_path,position_data)
-np.save(theta_path,theta_data)
-np.save(phi_path,phi_data)
+# The other engines, the analysis functions and the cache are imported by Run only when the settings need them, so that a simple run does not import them
+
+def ReadSettings(config):
+
+    """
+    This function reads the model parameters, the numerical and output settings and the local paths of a settings file.
+
+    Parameters
+        config: ConfigParser of the settings file
+
+    Returns:
+        Dictionary of the settings (settings).
+    """
+
+    settings = {}
+
+    # Import model parameters
+    settings['v0'] = float(config['parameters']['vel_mod'])       # Velocity modulus
+    settings['eta'] = float(config['parameters']['noise_ampl'])   # Noise amplitude
+    settings['R0'] = float(config['parameters']['int_radius'])    # Interaction radius
+    settings['dt'] = float(config['parameters']['time_step'])     # Time step
+    settings['N'] = int(config['parameters']['num_part'])         # Number of particles
+    settings['L'] = float(config['parameters']['space_dim'])      # Linear dimension of system space
+    settings['Ns'] = int(config['parameters']['num_steps'])       # Number of steps
+    settings['seed'] = int(config['parameters']['seed'])          # Random seed
+
+    # Import numerical settings
+    settings['method'] = config.get('numerics','neighbor_method',fallback='kdtree')   # Neighbor search method (kdtree or cells)
+    settings['skin'] = config.getfloat('numerics','verlet_skin',fallback=0.)          # Verlet list skin (0 to disable)
+    settings['engine'] = config.get('numerics','engine',fallback='numpy')             # Simulation engine (numpy, numba or domain)
+    settings['dtype'] = np.dtype(config.get('numerics','dtype',fallback='float64'))     # Floating point type of the state and of the saved trajectory
+    settings['num_threads'] = config.getint('numerics','num_threads',fallback=1)      # Number of threads of the neighbors averaging
+    settings['num_workers'] = config.getint('numerics','num_workers',fallback=0)      # Number of processes of the domain engine (0 for all the cores)
+
+    # Import output settings
+    settings['fields'] = [f.strip() for f in config.get('output','fields',fallback='position,theta,phi').split(',')]   # Saved fields
+    settings['save_every'] = config.getint('output','save_every',fallback=1)   # Number of steps between saved frames
+    settings['stream'] = config.getboolean('output','stream',fallback=False)   # Write the frames to disk while simulating
+    settings['transient'] = config.getint('output','transient',fallback=0)     # Number of steps excluded from the order parameter moments
+    settings['profile'] = config.getboolean('output','profile',fallback=False)                # Record the time of each phase of the simulation
+    settings['profile_memory'] = config.getboolean('output','profile_memory',fallback=False)  # Also record the peak memory (slower)
+    settings['checkpoint_every'] = config.getint('output','checkpoint_every',fallback=0)      # Number of steps between checkpoints (0 to disable)
+    settings['container'] = config.getboolean('output','container',fallback=False)            # Save the fields in a single compressed trajectory folder
+    settings['chunk_frames'] = config.getint('output','chunk_frames',fallback=0)              # Number of frames of each compressed chunk (0 for chunks of about 8 MB)
+
+    # Import adaptive run length settings
+    settings['adaptive'] = config.getboolean('adaptive','enabled',fallback=False)        # Stop when enough independent samples of the steady state are collected (num_steps is then the maximum)
+    settings['num_samples'] = config.getint('adaptive','num_samples',fallback=100)       # Number of effectively independent samples of the order parameter after the transient
+    settings['check_every'] = config.getint('adaptive','check_every',fallback=1000)      # Minimum number of steps between two checks of the order parameter
+
+    # Import result cache settings
+    settings['cache'] = config.getboolean('cache','enabled',fallback=False)              # Read the runs already simulated from the cache
+    settings['cache_path'] = config.get('cache','path',fallback='./data/cache')          # Folder of the cache
+    settings['cache_size'] = config.getfloat('cache','max_size',fallback=1024.)*2**20    # Maximum size of the cache in MB, the least recently used runs are evicted
+
+    # Import local paths
+    settings['paths'] = {'phi': config['paths']['order_param'],
+                         'position': config['paths']['position'],
+                         'theta': config['paths']['orientation'],
+                         'heading': config.get('paths','heading',fallback='./data/heading.npy'),
+                         'moments': config.get('paths','moments',fallback='./data/moments.npy')}
+    settings['stats_path'] = config.get('paths','stats',fallback='./data/stats.json')
+    settings['checkpoint_path'] = config.get('paths','checkpoint',fallback='./data/checkpoint.pkl')
+    settings['trajectory_path'] = config.get('paths','trajectory',fallback='./data/trajectory')
+    settings['adaptive_path'] = config.get('paths','adaptive',fallback='./data/adaptive.json')
+
+    # The adaptive runs check the order parameter of each step, which only the numpy engine returns to Python
+    if settings['adaptive'] and settings['engine'] != 'numpy':
+        raise ValueError("The adaptive runs need the numpy engine, not {}".format(settings['engine']))
+
+    return settings
+
+def Run(config,resume=False,use_cache=True):
+
+    """
+    This function simulates the model with the settings of config, saving the selected fields every save_every steps and accumulating the order parameter moments. If the cache is enabled in the settings, a run with the same parameters, seed included, the same settings affecting its results and the same code version is read from the cache instead of simulated, and a simulated run is stored in it.
+
+    Parameters
+        config: ConfigParser of the settings file, or dictionary of its sections
+        resume: if True the simulation continues from the last checkpoint
+        use_cache: if False the cache is neither read nor written, even if enabled in the settings
+
+    Returns:
+        Dictionary of the result (result): arrays of the saved fields (out), information of the adaptive run or None (info), statistics of the simulation phases or None (stats) and whether the run was read from the cache (cached).
+    """
+
+    if not isinstance(config,configparser.ConfigParser):
+        parser = configparser.ConfigParser()
+        parser.read_dict(config)
+        config = parser
+
+    s = ReadSettings(config)
+    fields, save_every, stream, checkpoint_every = s['fields'], s['save_every'], s['stream'], s['checkpoint_every']
+
+    cache = None
+
+    if s['cache'] and use_cache:
+        import Cache
+        cache = Cache.ResultCache(s['cache_path'],s['cache_size'])
+        key = Cache.Key(config)
+        cached = cache.Get(key)
+        if cached is not None:
+            out, info = cached
+            return {'out': out, 'info': info, 'stats': None, 'cached': True}
+
+    # The checkpoints can only be resumed if the frames are written to disk while simulating
+    if checkpoint_every > 0 or resume:
+        stream = True
+
+    if resume:
+
+        # Continue from the configuration, random state, step and order parameter moments of the last checkpoint
+        checkpoint = Vicsek_Model.LoadCheckpoint(s['checkpoint_path'])
+        state = checkpoint['config']
+        start_step = checkpoint['step']
+        np.random.set_state(checkpoint['rng_state'])
+
+        # The stopping criterion of an adaptive run continues from its state at the checkpoint
+        stop = checkpoint.get('stop') if s['adaptive'] else None
+        if s['adaptive'] and stop is None:
+            raise ValueError("The checkpoint {} is not the one of an adaptive run".format(s['checkpoint_path']))
+
+        # Reopen the saved fields to continue writing them after the checkpoint step
+        out = Vicsek_Model.TrajectoryArrays(s['Ns']//save_every+1,s['N'],fields,s['paths'],s['dtype'],resume)
+        if 'moments' in out:
+            out['moments'][:] = checkpoint['moments']
+
+    else:
+
+        # Initialization
+        np.random.seed(s['seed'])
+
+        # Calculate initial configuration (position and orientation)
+        state = Vicsek_Model.InitialConfiguration(s['N'],s['L'],dtype=s['dtype'])
+        start_step = 0
+
+        # The adaptive runs stop when enough independent samples are collected, with Ns as the maximum number of steps
+        stop = None
+        if s['adaptive']:
+            import Analysis
+            stop = Analysis.AdaptiveStop(s['num_samples'],s['Ns'],s['check_every'],s['transient'])
+
+        # Prepare the arrays of the saved fields, memory mapped to their files when streaming
+        out = Vicsek_Model.TrajectoryArrays(s['Ns']//save_every+1,s['N'],fields,s['paths'] if stream else None,s['dtype'])
+
+    # Calculate initial velocity
+    vel = Vicsek_Model.VelocityCalculation(s['v0'],state[2])
+
+    # Statistics of the simulation phases, None when not profiling
+    stats = Vicsek_Model.SimulationStats(s['profile_memory']) if s['profile'] else None
+
+    # Update particles configuration Ns times, saving the selected fields every save_every steps and accumulating the order parameter moments
+    if s['engine'] == 'numba':
+        import Vicsek_Numba
+        Vicsek_Numba.Simulate(state,vel,s['R0'],s['eta'],s['L'],s['dt'],s['Ns'],s['v0'],save_every,out,s['transient'],stats=stats,
+                              start_step=start_step,checkpoint_path=s['checkpoint_path'],checkpoint_every=checkpoint_every)
+    elif s['engine'] == 'domain':
+        import Vicsek_Domain
+        Vicsek_Domain.Simulate(state,vel,s['R0'],s['eta'],s['L'],s['dt'],s['Ns'],s['v0'],save_every,out,s['transient'],stats=stats,
+                               start_step=start_step,checkpoint_path=s['checkpoint_path'],checkpoint_every=checkpoint_every,num_workers=s['num_workers'] or None)
+    else:
+        Vicsek_Model.Simulate(state,vel,s['R0'],s['eta'],s['L'],s['dt'],s['Ns'],s['v0'],s['method'],s['skin'],save_every,out,s['transient'],stats=stats,
+                              start_step=start_step,checkpoint_path=s['checkpoint_path'],checkpoint_every=checkpoint_every,num_threads=s['num_threads'],stop=stop)
+
+    # The moments of an adaptive run are the ones of the steps after the detected transient
+    info = None
+    if s['adaptive']:
+        info = stop.Info()
+        if 'moments' in out:
+            out['moments'][:] = stop.Moments()
+
+    if cache is not None:
+        cache.Put(key,out,config,info)
+
+    return {'out': out, 'info': info, 'stats': stats, 'cached': False}
+
+def Save(config,result):
+
+    """
+    This function saves the result of a run to the local paths of the settings file: the particles configuration and order parameter evolution in separate .npy files or in a single trajectory folder, the information of the adaptive run and the statistics of the simulation phases.
+
+    Parameters
+        config: ConfigParser of the settings file
+        result: dictionary of the result of the run (see Run)
+    """
+
+    s = ReadSettings(config)
+    out, info, stats = result['out'], result['info'], result['stats']
+
+    if stats is not None:
+        stats.Tic()
+
+    # The fields written to disk while simulating are only flushed
+    for field in s['fields']:
+        if isinstance(out[field],np.memmap):
+            out[field].flush()
+        elif not s['container']:
+            np.save(s['paths'][field],out[field])
+
+    if s['container']:
+        Trajectory.WriteTrajectory(s['trajectory_path'],out,config,s['chunk_frames'])
+
+    # Save the number of steps, the detected equilibration step and the autocorrelation time of the adaptive run
+    if info is not None:
+        with open(s['adaptive_path'],'w') as f:
+            json.dump(info,f,indent=1)
+
+    # Save the time of each phase, the steps per second and the peak memory
+    if stats is not None:
+        stats.Lap('save')
+        stats.Dump(s['stats_path'])
+
+if __name__ == "__main__":
+
+    # python Simulation.py <settings file> [--resume]
+
+    # Read configuration file
+    config=configparser.ConfigParser()
+    config.read(sys.argv[1])
+
+    result = Run(config,'--resume' in sys.argv[2:])
+
+    Save(config,result)
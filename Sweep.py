@@ -0,0 +1,237 @@
+#=======================================================================
+# Sweep
+#
+# Aim: To simulate the 2D Viscek Model over a grid of parameters in
+#      parallel and collect the order parameter statistics.
+#=======================================================================
+
+import configparser
+import multiprocessing
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import Vicsek_Model
+import Vicsek_Numba
+import Analysis
+
+def ParseValues(text,kind=float):
+
+    """
+    This function reads the values of a swept parameter, given either as a comma separated list (e.g. 0.1,0.2,0.5) or as a range start:stop:num of num equally spaced values.
+
+    Parameters
+        text: values of the parameter
+        kind: type of the parameter (float or int)
+
+    Returns:
+        List of the values of the parameter (values).
+    """
+
+    if ':' in text:
+        start, stop, num = text.split(':')
+        values = np.linspace(float(start),float(stop),int(num))
+    else:
+        values = [float(i) for i in text.split(',')]
+
+    values = [kind(i) for i in values]
+
+    return values
+
+def ReadParameters(config):
+
+    """
+    This function reads the model parameters and the numerical settings of a settings file.
+
+    Parameters
+        config: ConfigParser of the settings file
+
+    Returns:
+        Dictionary of the parameters (params).
+    """
+
+    engine = config.get('numerics','engine',fallback='numpy')
+
+    params = {'vel_mod': float(config['parameters']['vel_mod']),
+              'noise_ampl': float(config['parameters']['noise_ampl']),
+              'int_radius': float(config['parameters']['int_radius']),
+              'time_step': float(config['parameters']['time_step']),
+              'num_part': int(config['parameters']['num_part']),
+              'space_dim': float(config['parameters']['space_dim']),
+              'num_steps': int(config['parameters']['num_steps']),
+              'seed': int(config['parameters']['seed']),
+              'neighbor_method': config.get('numerics','neighbor_method',fallback='cells' if engine == 'batch' else 'kdtree'),
+              'verlet_skin': config.getfloat('numerics','verlet_skin',fallback=0.),
+              'engine': engine,
+              'dtype': config.get('numerics','dtype',fallback='float64'),
+              'num_threads': config.getint('numerics','num_threads',fallback=1),
+              'adaptive': config.getboolean('adaptive','enabled',fallback=False),
+              'num_samples': config.getint('adaptive','num_samples',fallback=100),
+              'check_every': config.getint('adaptive','check_every',fallback=1000)}
+
+    return params
+
+def ParameterGrid(config):
+
+    """
+    This function creates the grid of parameters to simulate, combining the swept values of the [sweep] section with the fixed ones of the [parameters] section. Each run gets its own seed sequence (seed_seq), spawned from the seed of the [parameters] section.
+
+    Parameters
+        config: ConfigParser of the sweep settings file
+
+    Returns:
+        List of dictionaries with the parameters of each run (grid).
+    """
+
+    base = ReadParameters(config)
+    base['transient'] = config.getint('sweep','transient',fallback=0)
+
+    # Swept parameters, a parameter missing from the [sweep] section keeps its fixed value
+    kinds = {'noise_ampl': float, 'num_part': int, 'space_dim': float, 'int_radius': float}
+    swept = {name: ParseValues(config['sweep'][name],kind) if name in config['sweep'] else [base[name]] for name, kind in kinds.items()}
+
+    grid = []
+    for values in itertools.product(*swept.values()):
+        params = dict(base)
+        params.update(zip(swept.keys(),values))
+        grid.append(params)
+
+    # An independent random number generator for each run, derived from the seed as the replicas of the Ensemble file, so that the errors of the runs are not correlated
+    for params, seed_seq in zip(grid,np.random.SeedSequence(base['seed']).spawn(len(grid))):
+        params['seed_seq'] = seed_seq
+
+    return grid
+
+def RunPoint(params):
+
+    """
+    This function simulates the model for a set of parameters and calculates the order parameter statistics after the transient steps. In an adaptive run the transient is detected after the given one and the run stops when enough independent samples are collected (see Analysis.AdaptiveStop), with num_steps as the maximum number of steps.
+
+    Parameters
+        params: dictionary of the parameters of the run
+
+    Returns:
+        Mean order parameter, standard deviation of the order parameter, susceptibility, Binder cumulant, number of steps and number of transient steps (stats).
+    """
+
+    rng = np.random.default_rng(params.get('seed_seq',params['seed']))
+
+    config = Vicsek_Model.InitialConfiguration(params['num_part'],params['space_dim'],rng,np.dtype(params.get('dtype','float64')))
+    vel = Vicsek_Model.VelocityCalculation(params['vel_mod'],config[2])
+
+    num_steps, transient = params['num_steps'], params['transient']
+
+    # Only the order parameter moments are needed, no frame is saved
+    out = Vicsek_Model.TrajectoryArrays(1,params['num_part'],['moments'])
+    if params.get('adaptive'):
+        if params.get('engine') == 'numba':
+            raise ValueError("The adaptive runs need the numpy engine, not numba")
+
+        stop = Analysis.AdaptiveStop(params['num_samples'],num_steps,params['check_every'],transient)
+        Vicsek_Model.Simulate(config,vel,params['int_radius'],params['noise_ampl'],params['space_dim'],params['time_step'],params['num_steps'],params['vel_mod'],
+                              params['neighbor_method'],params['verlet_skin'],params['num_steps']+1,out,params['transient'],rng,num_threads=params.get('num_threads',1),stop=stop)
+
+        # The moments and the transient are the ones after the detected transient
+        out['moments'][:] = stop.Moments()
+        num_steps, transient = stop.step, stop.start if stop.start is not None else transient
+    elif params.get('engine') == 'numba':
+        Vicsek_Numba.Simulate(config,vel,params['int_radius'],params['noise_ampl'],params['space_dim'],params['time_step'],params['num_steps'],params['vel_mod'],
+                              params['num_steps']+1,out,params['transient'],rng)
+    else:
+        Vicsek_Model.Simulate(config,vel,params['int_radius'],params['noise_ampl'],params['space_dim'],params['time_step'],params['num_steps'],params['vel_mod'],
+                              params['neighbor_method'],params['verlet_skin'],params['num_steps']+1,out,params['transient'],rng,num_threads=params.get('num_threads',1))
+
+    mean_phi, chi, binder = Vicsek_Model.OrderParameterStatistics(out['moments'],params['num_part'])
+    std_phi = np.sqrt(max(chi/params['num_part'],0.))
+
+    return mean_phi, std_phi, chi, binder, num_steps, transient
+
+def RunBatch(grid):
+
+    """
+    This function simulates at once, with the batched engine, a group of runs that differ only in the noise amplitude, and calculates the order parameter statistics of each run after the transient steps. Each run is equal to the one simulated by RunPoint.
+
+    Parameters
+        grid: list of dictionaries with the parameters of each run
+
+    Returns:
+        List of the mean order parameter, standard deviation of the order parameter, susceptibility, Binder cumulant, number of steps and number of transient steps of each run (stats).
+    """
+
+    params = grid[0]
+
+    # A random number generator for each run, equal to the one of RunPoint
+    rngs = [np.random.default_rng(p.get('seed_seq',p['seed'])) for p in grid]
+
+    config = Vicsek_Model.BatchInitialConfiguration(len(grid),params['num_part'],params['space_dim'],rngs,np.dtype(params.get('dtype','float64')))
+    vel = Vicsek_Model.VelocityCalculation(params['vel_mod'],config[:,2])
+
+    # Only the order parameter moments are needed, no frame is saved
+    out = Vicsek_Model.TrajectoryArrays(1,params['num_part'],['moments'],num_replicas=len(grid))
+    Vicsek_Model.BatchSimulate(config,vel,params['int_radius'],np.array([p['noise_ampl'] for p in grid]),params['space_dim'],params['time_step'],params['num_steps'],params['vel_mod'],
+                               params['neighbor_method'],params['num_steps']+1,out,params['transient'],rngs)
+
+    stats = []
+    for moments in out['moments']:
+        mean_phi, chi, binder = Vicsek_Model.OrderParameterStatistics(moments,params['num_part'])
+        stats.append((mean_phi, np.sqrt(max(chi/params['num_part'],0.)), chi, binder, params['num_steps'], params['transient']))
+
+    return stats
+
+def Sweep(grid,workers=None):
+
+    """
+    This function runs the simulations of the parameter grid in parallel processes.
+
+    Parameters
+        grid: list of dictionaries with the parameters of each run
+        workers: number of processes, if None the number of cores of the machine
+
+    Returns:
+        Table with a row for each run (results), with columns noise_ampl, num_part, space_dim, int_radius, density, mean_phi, std_phi, chi, binder, num_steps, transient.
+    """
+
+    # Start the processes with spawn, forking after the compiled kernel has started its threads can deadlock
+    with ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context('spawn')) as executor:
+
+        # The adaptive runs stop at different steps and are simulated one at a time
+        if all(p.get('engine') == 'batch' and not p.get('adaptive') for p in grid):
+
+            # The runs that differ only in the noise amplitude are simulated at once, split among the processes
+            groups = {}
+            for index, p in enumerate(grid):
+                groups.setdefault((p['num_part'],p['space_dim'],p['int_radius']),[]).append(index)
+            tasks = [list(task) for group in groups.values() for task in np.array_split(group,min(len(group),workers or os.cpu_count()))]
+
+            stats = [None]*len(grid)
+            for task, task_stats in zip(tasks,executor.map(RunBatch,[[grid[i] for i in task] for task in tasks])):
+                for i, s in zip(task,task_stats):
+                    stats[i] = s
+        else:
+            stats = list(executor.map(RunPoint,grid))
+
+    results = np.array([[p['noise_ampl'],p['num_part'],p['space_dim'],p['int_radius'],p['num_part']/p['space_dim']**2]+list(s) for p,s in zip(grid,stats)])
+
+    return results
+
+columns = ['noise_ampl','num_part','space_dim','int_radius','density','mean_phi','std_phi','chi','binder','num_steps','transient']
+
+if __name__ == "__main__":
+
+    # Read configuration file
+    config=configparser.ConfigParser()
+    config.read(sys.argv[1])
+
+    grid = ParameterGrid(config)
+
+    workers = config.getint('sweep','workers',fallback=0) or os.cpu_count()   # Number of processes (0 for all the cores)
+    results_path = config['sweep']['results']                                  # Path of the results table (.npz or .csv)
+
+    results = Sweep(grid,workers)
+
+    # Save the results table
+    if results_path.endswith('.csv'):
+        np.savetxt(results_path,results,delimiter=',',header=','.join(columns),comments='')
+    else:
+        np.savez(results_path,**{name: results[:,i] for i,name in enumerate(columns)})
@@ -8,7 +8,26 @@
 #==============================================================
 
 import Vicsek_Model
+import Vicsek_Numba
+import Vicsek_Domain
+import Simulation
+import Batch
+import Cache
+import Sweep
+import Ensemble
+import Benchmarks
+import Export
+import Trajectory
+import Analysis
+import configparser
+import json
+import os
+import subprocess
+import sys
+import time
 import numpy as np
+import pytest
+from PIL import Image
 import hypothesis
 from hypothesis import strategies as st
 from hypothesis import given, settings
@@ -239,6 +258,133 @@ def test_FindNeighbors_AllNeighbors():
     assert Vicsek_Model.FindNeighbors(positions,int_radius,[positions[9]],space_dim) == [0,1,2,3,4,5,6,7,8,9]
 
 
+@given(int_radius=st.floats(0,0.5),num_part=st.integers(10,500), space_dim = st.floats(1,50))
+def test_CellListPairs_EqualKDTreePairs(num_part,space_dim,int_radius):
+
+    """
+    Procedure:
+    1. Initialize random seed
+    2. Generate initial configuration given a certain number of particles (num_part) and linear dimension of space (space_dim)
+    3. Set that the interaction radius is a given float in [0, space_dim/2]
+    4. Find the neighbor pairs with the KDTree and with the cell list
+    ---------
+    Verification:
+    5. The two methods find the same neighbor pairs
+    """
+
+    np.random.seed(3)
+
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+
+    int_radius = int_radius*space_dim
+
+    positions=np.array([config[0],config[1]]).T
+
+    kdtree_pairs = Vicsek_Model.NeighborPairs(positions,int_radius,space_dim,'kdtree')
+    cell_pairs = Vicsek_Model.NeighborPairs(positions,int_radius,space_dim,'cells')
+
+    assert np.array_equal(kdtree_pairs,cell_pairs)
+
+
+def test_CellListPairs_BoundaryConditions():
+
+    """
+    Procedure:
+    1. Set the space linear dimension
+    2. Set the interaction radius so that there are 5 cells per side
+    3. Create a vector of the positions of 4 particles inside the system space and close to the borders
+    ---------
+    Verification:
+    4. The neighbor pairs are identified by satisfying the periodic boundary conditions
+    """
+
+    space_dim=10
+
+    int_radius=2
+
+    positions=np.array([[1,5],[5,9],[9,5],[5,1]])
+
+    pairs = Vicsek_Model.CellListPairs(positions,int_radius,space_dim)
+
+    assert np.array_equal(pairs,[[0,2],[1,3]])
+
+
+def test_VerletList_RebuildOnlyWhenNeeded():
+
+    """
+    Procedure:
+    1. Set the space linear dimension, the interaction radius and the skin
+    2. Create a vector of positions of 3 particles inside the system space
+    3. Find the neighbor pairs, move the particles by less than skin/2 and find them again
+    4. Move one particle across the border by more than skin/2 and find the neighbor pairs again
+    ---------
+    Verification:
+    5. The list is built only once while the particles move by less than skin/2
+    6. The list is rebuilt when a particle moves by more than skin/2
+    7. The neighbor pairs are always equal to the ones found with the KDTree
+    """
+
+    space_dim=10
+
+    int_radius=1.
+
+    skin=0.6
+
+    positions=np.array([[9.6,5.],[0.4,5.],[5.,5.]])
+
+    verlet = Vicsek_Model.VerletList(int_radius,space_dim,skin)
+
+    assert np.array_equal(verlet.Pairs(positions),[[0,1]])
+
+    positions=np.array([[9.7,5.],[0.5,5.],[5.,5.]])
+
+    assert np.array_equal(verlet.Pairs(positions),Vicsek_Model.KDTreePairs(positions,int_radius,space_dim))
+    assert verlet.num_builds == 1
+
+    positions=np.array([[0.2,5.],[0.5,5.],[5.,5.]])
+
+    assert np.array_equal(verlet.Pairs(positions),Vicsek_Model.KDTreePairs(positions,int_radius,space_dim))
+    assert verlet.num_builds == 2
+
+
+@given(num_part=st.integers(10,300),noise_ampl=st.floats(0,1),skin=st.floats(0,1,exclude_min=True))
+@settings(max_examples=10,deadline=None)
+def test_Simulate_VerletListEqualSearch(num_part,noise_ampl,skin):
+
+    """
+    Procedure:
+    1. Set the space linear dimension, the interaction radius, the velocity modulus, the time step and the number of steps
+    2. Initialize random seed and simulate the model finding the neighbors at each step
+    3. Initialize the same random seed and simulate the model with a Verlet list with a certain skin (skin)
+    ---------
+    Verification:
+    4. The two simulations give identical positions and orientations
+    """
+
+    space_dim=10
+
+    int_radius=1.
+
+    vel_mod=0.2
+
+    time_step=1.
+
+    num_steps=30
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    position, theta = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    verlet_position, verlet_theta = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,'kdtree',skin)
+
+    assert np.array_equal(position,verlet_position)
+    assert np.array_equal(theta,verlet_theta)
+
+
 @given(int_radius=st.floats(0,1,exclude_min=True),num_part=st.integers(10,500), space_dim = st.floats(1,50))
 def test_NeighborsMeanAngle_OutputLenghtandRange(num_part,space_dim,int_radius):
 
@@ -340,6 +486,94 @@ def test_NeighborsMeanAngle_AllNeighbors():
     assert np.allclose(mean_theta,mean_theta[0])
 
 
+@given(int_radius=st.floats(0,1),num_part=st.integers(10,300), space_dim = st.floats(1,50))
+def test_NeighborsMeanAngle_SingleParticleQueries(num_part,space_dim,int_radius):
+
+    """
+    Procedure:
+    1. Initialize random seed
+    2. Generate initial configuration given a certain number of particles (num_part) and linear dimension of space (space_dim)
+    3. Set that the interaction radius is a given float in [0, √2*space_dim]
+    4. Calculate the mean angle of neighbors of each particle
+    5. Calculate the mean angle of neighbors of each particle finding its neighbors one particle at a time
+    ---------
+    Verification:
+    6. The two mean angles are equal for each particle
+    """
+
+    np.random.seed(3)
+
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+
+    int_radius = int_radius*space_dim*np.sqrt(2)
+
+    mean_theta = Vicsek_Model.NeighborsMeanAngle(config,int_radius,space_dim)
+
+    pos=np.array([config[0],config[1]]).T
+
+    for i in range(num_part):
+        neighbors = Vicsek_Model.FindNeighbors(pos,int_radius,[pos[i]],space_dim)
+        expected = np.arctan2(np.mean(np.sin(config[2][neighbors])),np.mean(np.cos(config[2][neighbors])))
+        assert np.isclose(np.cos(mean_theta[i]),np.cos(expected))
+        assert np.isclose(np.sin(mean_theta[i]),np.sin(expected))
+
+
+@given(int_radius=st.floats(0,1),num_part=st.integers(10,300),space_dim=st.floats(1,50),num_threads=st.integers(2,8),neighbor_method=st.sampled_from(['kdtree','cells']))
+@settings(deadline=None)
+def test_NeighborsMeanAngle_Threaded(num_part,space_dim,int_radius,num_threads,neighbor_method):
+
+    """
+    Procedure:
+    1. Initialize random seed
+    2. Generate initial configuration given a certain number of particles (num_part) and linear dimension of space (space_dim)
+    3. Set that the interaction radius is a given float in [0, √2*space_dim]
+    4. Calculate the mean angle of neighbors of each particle with a given neighbor method
+    5. Calculate the mean angle of neighbors of each particle with the same neighbor method and a pool of num_threads threads
+    ---------
+    Verification:
+    6. The two mean angles are equal for each particle
+    """
+
+    np.random.seed(3)
+
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+
+    int_radius = int_radius*space_dim*np.sqrt(2)
+
+    mean_theta = Vicsek_Model.NeighborsMeanAngle(config,int_radius,space_dim,neighbor_method)
+
+    mean_theta_threads = Vicsek_Model.NeighborsMeanAngle(config,int_radius,space_dim,neighbor_method,num_threads=num_threads)
+
+    assert np.array_equal(mean_theta,mean_theta_threads)
+
+
+@pytest.mark.parametrize('neighbor_method,skin',[('kdtree',0.),('cells',0.),('kdtree',0.5),('cells',0.5)])
+def test_Simulate_ThreadedEqualSerial(neighbor_method,skin):
+
+    """
+    Procedure:
+    1. Generate the initial configuration of a dense system
+    2. Simulate it with a given neighbor method and Verlet skin
+    3. Simulate it again from the same random state with 2 threads
+    ---------
+    Verification:
+    4. The positions and orientations at each saved frame are equal
+    """
+
+    np.random.seed(5)
+    config=Vicsek_Model.InitialConfiguration(400,10.)
+    vel=Vicsek_Model.VelocityCalculation(0.3,config[2])
+
+    np.random.seed(6)
+    position,theta=Vicsek_Model.Simulate(config,vel,1.,0.3,10.,1.,20,0.3,neighbor_method,skin)
+
+    np.random.seed(6)
+    position_threads,theta_threads=Vicsek_Model.Simulate(config,vel,1.,0.3,10.,1.,20,0.3,neighbor_method,skin,num_threads=2)
+
+    assert np.array_equal(position,position_threads)
+    assert np.array_equal(theta,theta_threads)
+
+
 @given(int_radius=st.floats(0,10,exclude_min=True),num_part=st.integers(10,500), space_dim=st.floats(1,50),vel_mod=st.floats(0,10,exclude_min=True),noise_ampl=st.floats(0,1),time_step=st.floats(0,1,exclude_min=True))
 def test_ConfigurationUpdate_OutputLenght(num_part,int_radius,noise_ampl,space_dim,time_step,vel_mod):
 
@@ -442,87 +676,1612 @@ def test_ConfigurationUpdate_BoundaryConditions():
     assert np.allclose(config[1],[[5, 1, 5, 9]])
 
 
-@given(int_radius=st.floats(0,10,exclude_min=True),num_part=st.integers(10,500),space_dim=st.floats(1,50),vel_mod=st.floats(0,10,exclude_min=True),noise_ampl=st.floats(0,1),time_step=st.floats(0,1,exclude_min=True),num_steps=st.integers(100,500))
-@settings(max_examples=1)
-def test_PhaseTransition(int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,num_part):
+def test_PeriodicBoundary_SinglePrecision():
+
+    """
+    Procedure:
+    1. Set a space linear dimension that is not representable in single precision
+    2. Create single precision coordinates slightly below 0 and slightly below the space linear dimension
+    3. Impose the periodic boundary conditions
+    ---------
+    Verification:
+    4. The coordinates keep the single precision type
+    5. All the coordinates are in [0, space_dim)
+    """
+
+    space_dim=np.sqrt(1000.)
+
+    x=np.array([-1e-9,-1e-7,0.,space_dim-1e-7,space_dim],dtype=np.float32)
+
+    x=Vicsek_Model.PeriodicBoundary(x,space_dim)
+
+    assert x.dtype == np.float32
+
+    assert np.all((x >= 0) & (x < space_dim))
+
+
+@given(num_part=st.integers(10,300),num_steps=st.integers(0,20))
+@settings(deadline=None)
+def test_Simulate_OutputShape(num_part,num_steps):
 
     """
     Procedure:
     1. Initialize random seed
-    2. Set that the interaction radius is a given float in [0, √2*space_dim]
-    3. Generate initial configuration given a certain number of particles (num_part) and linear dimension of space (space_dim)
-    4. Calculate the velocity of the particles given a certain velocity modulus (vel_mod)
-    5. Update a certain number of steps (num_steps) the particles configuration given a certain noise amplitude (noise_ampl) and time step (time_step)
+    2. Set the space linear dimension, the interaction radius, the noise amplitude, the velocity modulus and the time step
+    3. Generate initial configuration given a certain number of particles (num_part)
+    4. Simulate the model for a certain number of steps (num_steps)
     ---------
     Verification:
-    6. The final order parameter is greater or equal than the initial one
+    5. The positions are a (num_steps+1) X 2 X num_part array and the orientations a (num_steps+1) X num_part array
+    6. The first positions and orientations are the initial ones
     """
 
     np.random.seed(3)
 
-    int_radius = int_radius*space_dim*np.sqrt(2)
+    space_dim=10
 
-    initconfig = Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    int_radius=1.
 
-    initvel = Vicsek_Model.VelocityCalculation(vel_mod,initconfig[2])
+    noise_ampl=0.1
 
-    position, theta = Vicsek_Model.Simulate(initconfig,initvel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+    vel_mod=0.2
 
-    assert Vicsek_Model.OrderParameter(theta[num_steps]) >= Vicsek_Model.OrderParameter(theta[0])
+    time_step=1.
+
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
 
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
 
-def test_OrderParameter_EqualOrientations():
+    position, theta = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+
+    assert position.shape == (num_steps+1,2,num_part)
+    assert theta.shape == (num_steps+1,num_part)
+
+    assert np.array_equal(position[0],config[:2])
+    assert np.array_equal(theta[0],config[2])
+
+
+def test_Simulate_StreamingOutput(tmp_path):
 
     """
     Procedure:
-    1. Create vector of 100 equal orientations
-    2. Calculate the order parameter
+    1. Set the model parameters, the number of steps and the number of steps between saved frames
+    2. Initialize random seed and simulate the model saving every step in memory
+    3. Initialize the same random seed and simulate the model writing positions, orientations and order parameter every save_every steps to memory mapped .npy files
     ---------
     Verification:
-    3. The order parameter is close to 1
+    4. The saved files contain num_steps//save_every+1 frames
+    5. The saved frames are equal to the corresponding steps of the simulation saved in memory
+    6. The saved order parameter is the order parameter of the saved orientations
     """
 
-    theta=np.repeat(1.,100)
+    space_dim=10
 
-    phi = Vicsek_Model.OrderParameter(theta)
+    int_radius=1.
 
-    assert np.isclose(phi,1)
+    noise_ampl=0.1
 
+    vel_mod=0.2
 
-def test_OrderParameter_RandomOrientations():
+    time_step=1.
+
+    num_part=100
+
+    num_steps=25
+
+    save_every=4
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    position, theta = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+
+    paths={field: str(tmp_path/(field+'.npy')) for field in ['position','theta','phi']}
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    out=Vicsek_Model.TrajectoryArrays(num_steps//save_every+1,num_part,['position','theta','phi'],paths)
+    Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,save_every=save_every,out=out)
+    del out
+
+    saved_position=np.load(paths['position'])
+    saved_theta=np.load(paths['theta'])
+    saved_phi=np.load(paths['phi'])
+
+    assert len(saved_position) == len(saved_theta) == len(saved_phi) == num_steps//save_every+1
+
+    assert np.array_equal(saved_position,position[::save_every])
+    assert np.array_equal(saved_theta,theta[::save_every])
+
+    assert all(saved_phi[i] == Vicsek_Model.OrderParameter(saved_theta[i]) for i in range(len(saved_phi)))
+
+
+@given(num_steps=st.integers(1,40),transient=st.integers(0,20))
+@settings(max_examples=10,deadline=None)
+def test_Simulate_ObservablesOnly(num_steps,transient):
 
     """
     Procedure:
-    1. Create vector of 10 different orientations
-    2. Calculate the order parameter
+    1. Set the model parameters
+    2. Initialize random seed and simulate the model saving the orientations at each step
+    3. Initialize the same random seed and simulate the model saving only the order parameter, the mean heading and the order parameter moments after a certain number of transient steps (transient)
     ---------
     Verification:
-    3. The order parameter is close a certain number between in [0,1]
+    4. The saved order parameter and mean heading are the ones of the saved orientations
+    5. The moments are the sums of the powers of the order parameter after the transient steps
     """
 
-    theta = np.array([-0.5,1.5,1.8,2.2,-1.,0.7,2.3,2.1,-0.7,2.5])
+    space_dim=10
 
-    phi = Vicsek_Model.OrderParameter(theta)
+    int_radius=1.
 
-    assert np.isclose(phi,0.3673557583)
+    noise_ampl=0.3
 
+    vel_mod=0.2
 
-def test_OrderParameter_OppositeOrientations():
+    time_step=1.
+
+    num_part=100
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    position, theta = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    out=Vicsek_Model.TrajectoryArrays(num_steps+1,num_part,['phi','heading','moments'])
+    Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,out=out,transient=transient)
+
+    phi=np.array([Vicsek_Model.OrderParameter(i) for i in theta])
+    heading=np.array([np.arctan2(np.mean(np.sin(i)),np.mean(np.cos(i))) for i in theta])
+
+    assert np.array_equal(out['phi'],phi)
+    assert np.allclose(out['heading'],heading)
+
+    assert out['moments'][0] == max(num_steps+1-transient,0)
+    assert np.isclose(out['moments'][1],np.sum(phi[transient:]))
+    assert np.isclose(out['moments'][2],np.sum(phi[transient:]**2))
+    assert np.isclose(out['moments'][3],np.sum(phi[transient:]**4))
+
+
+def test_OrderParameterStatistics():
 
     """
     Procedure:
-    1. Create vector of 10 orientations that cancel out each other
-    2. Calculate the order parameter
+    1. Create the running sums of the moments of an order parameter that takes the values 0.5 and 1 the same number of times
+    2. Calculate the mean order parameter, the susceptibility and the Binder cumulant for 10 particles
     ---------
     Verification:
-    3. The order parameter is close to 0
+    3. The mean order parameter is 0.75
+    4. The susceptibility is 10 times the variance 0.0625
+    5. The Binder cumulant is 1-<phi^4>/(3<phi^2>^2)
     """
 
-    theta = np.array([-0.5,np.pi-0.5,-1.8,np.pi-1.8,-3.,np.pi-3.,-2.3,np.pi-2.3,-0.7,np.pi-0.7])
+    moments=np.array([2,1.5,1.25,1.0625])
 
-    phi = Vicsek_Model.OrderParameter(theta)
+    mean_phi, chi, binder = Vicsek_Model.OrderParameterStatistics(moments,10)
 
-    assert np.isclose(phi,0)
+    assert np.isclose(mean_phi,0.75)
+    assert np.isclose(chi,0.625)
+    assert np.isclose(binder,1-0.53125/(3*0.625**2))
+
+
+def test_Simulate_CheckpointResume(tmp_path):
+
+    """
+    Procedure:
+    1. Set the parameters of a small system and the checkpoint interval
+    2. Simulate the model with its own random number generator, saving checkpoints
+    3. Erase the frames and the order parameter moments after the last checkpoint
+    4. Load the last checkpoint and resume the simulation from its step, configuration, random state and moments
+    ---------
+    Verification:
+    5. The last checkpoint is at the last multiple of the checkpoint interval
+    6. The resumed simulation is equal to the uninterrupted one
+    """
+
+    num_part=80
+
+    space_dim=6.
+
+    int_radius=1.
+
+    noise_ampl=0.4
+
+    vel_mod=0.2
+
+    time_step=1.
+
+    num_steps=20
+
+    checkpoint_every=7
+
+    path=str(tmp_path/'checkpoint.pkl')
+
+    rng=np.random.default_rng(5)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim,rng)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    out=Vicsek_Model.TrajectoryArrays(num_steps+1,num_part,['position','theta','phi','moments'])
+    Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,out=out,transient=3,rng=rng,
+                          checkpoint_path=path,checkpoint_every=checkpoint_every)
+
+    checkpoint=Vicsek_Model.LoadCheckpoint(path)
+
+    assert checkpoint['step'] == 14
+
+    resumed={field: out[field].copy() for field in out}
+    for field in ['position','theta','phi']:
+        resumed[field][checkpoint['step']+1:]=0
+    resumed['moments'][:]=checkpoint['moments']
+
+    rng=np.random.default_rng()
+    Vicsek_Model.SetRandomState(checkpoint['rng_state'],rng)
+    config=checkpoint['config']
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,out=resumed,transient=3,rng=rng,
+                          start_step=checkpoint['step'])
+
+    for field in out:
+        assert np.array_equal(out[field],resumed[field])
+
+
+def test_Simulate_Stats():
+
+    """
+    Procedure:
+    1. Set the parameters of a small system
+    2. Initialize random seed and simulate the model without statistics
+    3. Initialize the same random seed and simulate the model recording the statistics and the peak memory
+    ---------
+    Verification:
+    4. The trajectories are equal with and without statistics
+    5. The phases of the step are recorded and their total time does not exceed the simulation time
+    6. The number of steps, the steps per second and the peak memory are recorded
+    """
+
+    num_part=100
+
+    space_dim=10.
+
+    int_radius=1.
+
+    noise_ampl=0.3
+
+    vel_mod=0.2
+
+    time_step=1.
+
+    num_steps=10
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    position, theta = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    stats=Vicsek_Model.SimulationStats(memory=True)
+    position_stats, theta_stats = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,stats=stats)
+
+    assert np.array_equal(position,position_stats)
+    assert np.array_equal(theta,theta_stats)
+
+    stats=stats.ToDict()
+
+    assert set(stats['phases']) == {'positions','neighbors','averaging','noise','velocity','storage'}
+    assert sum(stats['phases'].values()) <= stats['total_time']
+
+    assert stats['num_steps'] == num_steps
+    assert np.isclose(stats['steps_per_second'],num_steps/stats['total_time'])
+    assert stats['peak_memory'] > 0
+
+
+@given(num_part=st.integers(10,300),space_dim=st.floats(1,50),noise_ampl=st.floats(0,1))
+@settings(max_examples=20,deadline=None)
+def test_Simulate_SinglePrecision(num_part,space_dim,noise_ampl):
+
+    """
+    Procedure:
+    1. Set the interaction radius, the velocity modulus, the time step and the number of steps
+    2. Initialize random seed and simulate the model in double precision
+    3. Initialize the same random seed and simulate the model in single precision
+    ---------
+    Verification:
+    4. The single precision positions and orientations are saved as float32 and the order parameter as float64
+    5. All the single precision positions are in [0, space_dim)
+    6. The initial configurations are equal up to single precision
+    """
+
+    int_radius=1.
+
+    vel_mod=0.2
+
+    time_step=1.
+
+    num_steps=5
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    position, theta = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim,dtype=np.float32)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    out=Vicsek_Model.TrajectoryArrays(num_steps+1,num_part,['position','theta','phi'],dtype=np.float32)
+    Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,out=out)
+
+    assert out['position'].dtype == np.float32
+    assert out['theta'].dtype == np.float32
+    assert out['phi'].dtype == np.float64
+
+    assert np.all((out['position'] >= 0) & (out['position'] < space_dim))
+
+    assert np.allclose(out['position'][0],position[0],rtol=1e-6,atol=1e-6*space_dim)
+    assert np.allclose(out['theta'][0],theta[0],rtol=1e-6,atol=1e-6)
+
+
+@given(num_replicas=st.integers(1,6),num_part=st.integers(10,100),space_dim=st.floats(2,10),neighbor_method=st.sampled_from(['kdtree','cells']))
+@settings(deadline=None,max_examples=20)
+def test_BatchSimulate_EqualSimulate(num_replicas,num_part,space_dim,neighbor_method):
+
+    """
+    Procedure:
+    1. Set the parameters of the system, a different noise amplitude for each replica and a random number generator for each replica
+    2. Simulate all the replicas at once with the batched engine
+    3. Simulate each replica with its own random number generator
+    ---------
+    Verification:
+    4. Each replica of the batched engine is equal to the one simulated alone, for all the saved fields
+    """
+
+    int_radius=1.
+
+    vel_mod=0.2
+
+    time_step=1.
+
+    num_steps=12
+
+    noise_ampl=np.linspace(0.1,0.9,num_replicas)
+
+    fields=['position','theta','phi','heading','moments']
+
+    seed_seqs=np.random.SeedSequence(11).spawn(num_replicas)
+
+    rngs=[np.random.default_rng(seed_seq) for seed_seq in seed_seqs]
+    config=Vicsek_Model.BatchInitialConfiguration(num_replicas,num_part,space_dim,rngs)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[:,2])
+    out=Vicsek_Model.TrajectoryArrays(num_steps//3+1,num_part,fields,num_replicas=num_replicas)
+    Vicsek_Model.BatchSimulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,neighbor_method,3,out,4,rngs)
+
+    for k in range(num_replicas):
+        rng=np.random.default_rng(seed_seqs[k])
+        config=Vicsek_Model.InitialConfiguration(num_part,space_dim,rng)
+        vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+        replica=Vicsek_Model.TrajectoryArrays(num_steps//3+1,num_part,fields)
+        Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl[k],space_dim,time_step,num_steps,vel_mod,neighbor_method,0.,3,replica,4,rng)
+
+        for field in fields:
+            assert np.array_equal(out[field][k],replica[field])
+
+
+@given(int_radius=st.floats(0,10,exclude_min=True),num_part=st.integers(10,500),space_dim=st.floats(1,50),vel_mod=st.floats(0,10,exclude_min=True),noise_ampl=st.floats(0,1),time_step=st.floats(0,1,exclude_min=True),num_steps=st.integers(100,500))
+@settings(max_examples=1)
+def test_PhaseTransition(int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,num_part):
+
+    """
+    Procedure:
+    1. Initialize random seed
+    2. Set that the interaction radius is a given float in [0, √2*space_dim]
+    3. Generate initial configuration given a certain number of particles (num_part) and linear dimension of space (space_dim)
+    4. Calculate the velocity of the particles given a certain velocity modulus (vel_mod)
+    5. Update a certain number of steps (num_steps) the particles configuration given a certain noise amplitude (noise_ampl) and time step (time_step)
+    ---------
+    Verification:
+    6. The final order parameter is greater or equal than the initial one
+    """
+
+    np.random.seed(3)
+
+    int_radius = int_radius*space_dim*np.sqrt(2)
+
+    initconfig = Vicsek_Model.InitialConfiguration(num_part,space_dim)
+
+    initvel = Vicsek_Model.VelocityCalculation(vel_mod,initconfig[2])
+
+    position, theta = Vicsek_Model.Simulate(initconfig,initvel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+
+    assert Vicsek_Model.OrderParameter(theta[num_steps]) >= Vicsek_Model.OrderParameter(theta[0])
+
+
+def test_OrderParameter_EqualOrientations():
+
+    """
+    Procedure:
+    1. Create vector of 100 equal orientations
+    2. Calculate the order parameter
+    ---------
+    Verification:
+    3. The order parameter is close to 1
+    """
+
+    theta=np.repeat(1.,100)
+
+    phi = Vicsek_Model.OrderParameter(theta)
+
+    assert np.isclose(phi,1)
+
+
+def test_OrderParameter_RandomOrientations():
+
+    """
+    Procedure:
+    1. Create vector of 10 different orientations
+    2. Calculate the order parameter
+    ---------
+    Verification:
+    3. The order parameter is close a certain number between in [0,1]
+    """
+
+    theta = np.array([-0.5,1.5,1.8,2.2,-1.,0.7,2.3,2.1,-0.7,2.5])
+
+    phi = Vicsek_Model.OrderParameter(theta)
+
+    assert np.isclose(phi,0.3673557583)
+
+
+def test_OrderParameter_OppositeOrientations():
+
+    """
+    Procedure:
+    1. Create vector of 10 orientations that cancel out each other
+    2. Calculate the order parameter
+    ---------
+    Verification:
+    3. The order parameter is close to 0
+    """
+
+    theta = np.array([-0.5,np.pi-0.5,-1.8,np.pi-1.8,-3.,np.pi-3.,-2.3,np.pi-2.3,-0.7,np.pi-0.7])
+
+    phi = Vicsek_Model.OrderParameter(theta)
+
+    assert np.isclose(phi,0)
+
+
+def test_CompiledKernel_EqualNumPy():
+
+    """
+    Procedure:
+    1. Set the model parameters with null noise amplitude
+    2. Initialize random seed and generate the initial configuration
+    3. Simulate a few steps with the NumPy functions and with the compiled kernel (or its NumPy fallback if Numba is not installed)
+    ---------
+    Verification:
+    4. The positions and orientations of the two simulations are close
+    5. The saved order parameter is the order parameter of the saved orientations
+    """
+
+    space_dim=10.
+
+    int_radius=1.
+
+    noise_ampl=0.
+
+    vel_mod=0.2
+
+    time_step=1.
+
+    num_part=300
+
+    num_steps=5
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+
+    position, theta = Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod)
+
+    out=Vicsek_Model.TrajectoryArrays(num_steps+1,num_part,['position','theta','phi'])
+    Vicsek_Numba.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,out=out)
+
+    assert np.allclose(out['position'],position)
+    assert np.allclose(np.cos(out['theta']),np.cos(theta))
+    assert np.allclose(np.sin(out['theta']),np.sin(theta))
+
+    assert np.allclose(out['phi'],[Vicsek_Model.OrderParameter(i) for i in out['theta']])
+
+
+def test_Sweep_ParameterGrid():
+
+    """
+    Procedure:
+    1. Create a sweep configuration with a range of 3 noise amplitudes and a list of 2 numbers of particles
+    2. Create the grid of parameters
+    ---------
+    Verification:
+    3. The grid contains the 6 combinations of noise amplitude and number of particles
+    4. The parameters which are not swept keep their fixed value
+    """
+
+    config=configparser.ConfigParser()
+    config.read_dict({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.1', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '200', 'space_dim': '10.0', 'num_steps': '10', 'seed': '1234'},
+                      'sweep': {'noise_ampl': '0:1:3', 'num_part': '100,200'}})
+
+    grid=Sweep.ParameterGrid(config)
+
+    assert [(p['noise_ampl'],p['num_part']) for p in grid] == [(0.,100),(0.,200),(0.5,100),(0.5,200),(1.,100),(1.,200)]
+
+    assert all(p['int_radius'] == 1. and p['space_dim'] == 10. and p['seed'] == 1234 for p in grid)
+
+
+def test_Sweep_ParallelEqualSerial():
+
+    """
+    Procedure:
+    1. Create a grid of parameters with 2 noise amplitudes
+    2. Run the grid in 2 parallel processes
+    3. Run each point of the grid in the current process
+    ---------
+    Verification:
+    4. The parallel results are equal to the serial ones
+    """
+
+    config=configparser.ConfigParser()
+    config.read_dict({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.1', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '50', 'space_dim': '5.0', 'num_steps': '20', 'seed': '1234'},
+                      'sweep': {'noise_ampl': '0.1,0.9', 'transient': '5'}})
+
+    grid=Sweep.ParameterGrid(config)
+
+    results=Sweep.Sweep(grid,2)
+
+    for row,params in zip(results,grid):
+        assert np.array_equal(row[5:],Sweep.RunPoint(params))
+
+
+def test_ParameterGrid_IndependentSeeds():
+
+    """
+    Procedure:
+    1. Create a grid of parameters with the same noise amplitude twice
+    2. Create the same grid again from the same settings
+    3. Run each point of both grids
+    ---------
+    Verification:
+    4. The two points with the same parameters have different results, since each point has its own random number generator
+    5. The results of each point are the same in both grids
+    """
+
+    config=configparser.ConfigParser()
+    config.read_dict({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.1', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '50', 'space_dim': '5.0', 'num_steps': '20', 'seed': '1234'},
+                      'sweep': {'noise_ampl': '0.5,0.5', 'transient': '5'}})
+
+    grid=Sweep.ParameterGrid(config)
+    again=Sweep.ParameterGrid(config)
+
+    first,second=Sweep.RunPoint(grid[0]),Sweep.RunPoint(grid[1])
+
+    assert first[0] != second[0]
+    assert np.array_equal(first,Sweep.RunPoint(again[0]))
+    assert np.array_equal(second,Sweep.RunPoint(again[1]))
+
+
+def test_Sweep_BatchEqualSerial():
+
+    """
+    Procedure:
+    1. Create a grid of parameters with 3 noise amplitudes and 2 numbers of particles, with the batched engine
+    2. Run the grid in 2 parallel processes
+    3. Run each point of the grid in the current process with the numpy engine
+    ---------
+    Verification:
+    4. The batched results are equal to the serial ones
+    """
+
+    config=configparser.ConfigParser()
+    config.read_dict({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.1', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '50', 'space_dim': '5.0', 'num_steps': '20', 'seed': '1234'},
+                      'numerics': {'engine': 'batch'},
+                      'sweep': {'noise_ampl': '0.1,0.5,0.9', 'num_part': '30,50', 'transient': '5'}})
+
+    grid=Sweep.ParameterGrid(config)
+
+    results=Sweep.Sweep(grid,2)
+
+    for row,params in zip(results,grid):
+        params=dict(params,engine='numpy')
+        assert np.array_equal(row[5:],Sweep.RunPoint(params))
+
+
+def test_Ensemble_ReproducibleWorkers():
+
+    """
+    Procedure:
+    1. Set the parameters of a small system
+    2. Simulate an ensemble of 4 replicas with 1 process and with 3 processes
+    ---------
+    Verification:
+    3. The order parameter of each replica is the same whatever the number of processes
+    4. The replicas are independent (different from each other)
+    5. The ensemble mean and standard error are the mean and standard error of the replicas
+    """
+
+    params={'vel_mod': 0.2, 'noise_ampl': 0.3, 'int_radius': 1., 'time_step': 1., 'num_part': 50, 'space_dim': 5., 'num_steps': 20, 'seed': 1234,
+            'neighbor_method': 'kdtree', 'verlet_skin': 0., 'save_every': 2}
+
+    phi, mean_phi, err_phi = Ensemble.Ensemble(params,4,1)
+    phi_3, mean_phi_3, err_phi_3 = Ensemble.Ensemble(params,4,3)
+
+    assert phi.shape == (4,11)
+
+    assert np.array_equal(phi,phi_3)
+    assert np.array_equal(mean_phi,mean_phi_3)
+
+    assert not np.array_equal(phi[0],phi[1])
+
+    assert np.allclose(mean_phi,np.mean(phi,axis=0))
+    assert np.allclose(err_phi,np.std(phi,axis=0,ddof=1)/2)
+
+
+def test_Ensemble_BatchEqualReplicas():
+
+    """
+    Procedure:
+    1. Set the parameters of a small system
+    2. Simulate an ensemble of 5 replicas with the numpy engine and with the batched engine in 2 processes
+    ---------
+    Verification:
+    3. The order parameter of each replica is the same with both engines
+    """
+
+    params={'vel_mod': 0.2, 'noise_ampl': 0.3, 'int_radius': 1., 'time_step': 1., 'num_part': 50, 'space_dim': 5., 'num_steps': 20, 'seed': 1234,
+            'neighbor_method': 'cells', 'verlet_skin': 0., 'save_every': 2}
+
+    phi, mean_phi, err_phi = Ensemble.Ensemble(params,5,1)
+    phi_batch, mean_phi_batch, err_phi_batch = Ensemble.Ensemble(dict(params,engine='batch'),5,2)
+
+    assert np.array_equal(phi,phi_batch)
+
+
+def test_Export_ParallelEqualSerial(tmp_path):
+
+    """
+    Procedure:
+    1. Simulate a small system and save the order parameter, positions and orientations
+    2. Render one saved frame every 2 to PNG files with 1 process and with 2 processes
+    3. Assemble the frames rendered in parallel into a GIF
+    ---------
+    Verification:
+    4. There is a PNG file for each rendered frame, in the order of the frames
+    5. The frames rendered in parallel are equal to the frames rendered serially
+    6. The GIF has a frame for each rendered frame
+    """
+
+    params={'vel_mod': 0.2, 'noise_ampl': 0.3, 'int_radius': 1., 'time_step': 1., 'num_part': 50, 'space_dim': 5., 'save_every': 1,
+              'order_param': str(tmp_path/'phi.npy'), 'position': str(tmp_path/'position.npy'), 'orientation': str(tmp_path/'theta.npy')}
+
+    num_steps=10
+
+    np.random.seed(3)
+    config=Vicsek_Model.InitialConfiguration(params['num_part'],params['space_dim'])
+    vel=Vicsek_Model.VelocityCalculation(params['vel_mod'],config[2])
+    out=Vicsek_Model.TrajectoryArrays(num_steps+1,params['num_part'],['position','theta','phi'])
+    Vicsek_Model.Simulate(config,vel,params['int_radius'],params['noise_ampl'],params['space_dim'],params['time_step'],num_steps,params['vel_mod'],out=out)
+
+    np.save(params['order_param'],out['phi'])
+    np.save(params['position'],out['position'])
+    np.save(params['orientation'],out['theta'])
+
+    frames=range(0,num_steps+1,2)
+
+    serial=Export.ExportFrames(params,frames,str(tmp_path/'serial'),1)
+    parallel=Export.ExportFrames(params,frames,str(tmp_path/'parallel'),2)
+
+    assert [os.path.basename(f) for f in parallel] == ['frame_{:06d}.png'.format(i) for i in frames]
+
+    for f,g in zip(serial,parallel):
+        with Image.open(f) as a, Image.open(g) as b:
+            assert np.array_equal(np.asarray(a.convert('RGB')),np.asarray(b.convert('RGB')))
+
+    Export.AssembleGIF(parallel,str(tmp_path/'animation.gif'),10)
+
+    with Image.open(str(tmp_path/'animation.gif')) as gif:
+        assert gif.n_frames == len(frames)
+
+
+def test_AssembleGIF_OpenFilesLimit(tmp_path):
+
+    """
+    Procedure:
+    1. Write more PNG frames, all different, than the files the process may still open
+    2. Lower the limit of the open files of the process and assemble the frames into a GIF
+    ---------
+    Verification:
+    3. The GIF is assembled, with a frame for each PNG file
+    """
+
+    resource=pytest.importorskip('resource')
+
+    num_frames=300
+
+    files=[]
+    for i in range(num_frames):
+        files.append(str(tmp_path/'frame_{:06d}.png'.format(i)))
+        Image.new('RGB',(8,8),(i % 256,i//256,0)).save(files[-1])
+
+    soft,hard=resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE,(len(os.listdir('/proc/self/fd'))+100,hard))
+
+    try:
+        Export.AssembleGIF(files,str(tmp_path/'animation.gif'),10)
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE,(soft,hard))
+
+    with Image.open(str(tmp_path/'animation.gif')) as gif:
+        assert gif.n_frames == num_frames
+
+
+def test_Trajectory_RandomAccess(tmp_path):
+
+    """
+    Procedure:
+    1. Simulate a small system saving all the fields
+    2. Write the trajectory in chunks of 3 frames, with the settings of the run
+    3. Read single frames, ranges of frames across chunks and the whole fields
+    4. Render a frame from the trajectory and from the .npy files
+    ---------
+    Verification:
+    5. The trajectory has a chunk for every 3 frames
+    6. The frames read are equal to the simulated ones, also with negative indices and steps
+    7. The settings and the order parameter moments are the ones of the run
+    8. The rendered frames are equal
+    """
+
+    config=configparser.ConfigParser()
+    config.read_dict({'parameters': {'num_part': '40', 'space_dim': '4.'}, 'output': {'chunk_frames': '3'}})
+
+    num_steps=10
+
+    np.random.seed(5)
+    particles=Vicsek_Model.InitialConfiguration(40,4.)
+    vel=Vicsek_Model.VelocityCalculation(0.2,particles[2])
+    out=Vicsek_Model.TrajectoryArrays(num_steps+1,40,['position','theta','phi','heading','moments'])
+    Vicsek_Model.Simulate(particles,vel,1.,0.3,4.,1.,num_steps,0.2,out=out)
+
+    path=str(tmp_path/'trajectory')
+    Trajectory.WriteTrajectory(path,out,config,3)
+
+    reader=Trajectory.TrajectoryReader(path)
+
+    assert len(reader.metadata['chunks']) == 4
+    assert reader.num_frames == num_steps+1
+    assert set(reader.fields) == {'position','theta','phi','heading'}
+
+    for field in reader.fields:
+        data=reader[field]
+        assert len(data) == num_steps+1
+        assert np.array_equal(data[4],out[field][4])
+        assert np.array_equal(data[-1],out[field][-1])
+        assert np.array_equal(data[2:8],out[field][2:8])
+        assert np.array_equal(data[1:10:4],out[field][1:10:4])
+        assert np.array_equal(data[:],out[field])
+
+    assert reader.Settings()['output']['chunk_frames'] == '3'
+    assert np.array_equal(reader.moments,out['moments'])
+
+    params={'vel_mod': 0.2, 'noise_ampl': 0.3, 'int_radius': 1., 'time_step': 1., 'num_part': 40, 'space_dim': 4., 'save_every': 1,
+            'order_param': str(tmp_path/'phi.npy'), 'position': str(tmp_path/'position.npy'), 'orientation': str(tmp_path/'theta.npy'), 'trajectory': None}
+
+    np.save(params['order_param'],out['phi'])
+    np.save(params['position'],out['position'])
+    np.save(params['orientation'],out['theta'])
+
+    npy_files=Export.RenderFrames(params,[7],str(tmp_path))
+    with Image.open(npy_files[0]) as image:
+        npy_frame=np.asarray(image.convert('RGB'))
+
+    params['trajectory']=path
+    trajectory_files=Export.RenderFrames(params,[7],str(tmp_path))
+    with Image.open(trajectory_files[0]) as image:
+        assert np.array_equal(np.asarray(image.convert('RGB')),npy_frame)
+
+
+@given(num_samples=st.integers(20,2000), chunk_size=st.integers(1,700), seed=st.integers(0,100))
+@settings(deadline=None)
+def test_Autocorrelation_ChunksEqualDirect(num_samples,chunk_size,seed):
+
+    """
+    Procedure:
+    1. Generate a random time series
+    2. Calculate its autocorrelation function reading it in chunks
+    3. Calculate the sums of the products of the samples directly
+    ---------
+    Verification:
+    4. The autocorrelation function is 1 at lag 0
+    5. The autocorrelation function is equal to the direct one, whatever the size of the chunks
+    """
+
+    rng=np.random.default_rng(seed)
+    series=np.cumsum(rng.normal(size=num_samples))
+
+    max_lag=min(50,num_samples-1)
+    rho=Analysis.Autocorrelation(series,max_lag,chunk_size=chunk_size)
+
+    centered=series-np.mean(series)
+    sums=np.array([np.dot(centered[:num_samples-lag],centered[lag:]) for lag in range(max_lag+1)])
+
+    assert rho[0] == 1
+    assert np.allclose(rho,sums/sums[0],atol=1e-10)
+
+
+def test_Analysis_CorrelatedSeries(tmp_path):
+
+    """
+    Procedure:
+    1. Generate an autoregressive series x(t+1) = a x(t) + noise, whose integrated autocorrelation time is (1+a)/(1-a)
+    2. Analyze it read from an array in chunks and from a trajectory file
+    ---------
+    Verification:
+    3. The integrated autocorrelation time is within 10% of the exact one
+    4. The blocking error of the mean is within 20% of the exact one, and larger than the naive error
+    5. The mean, susceptibility and Binder cumulant are the ones of Vicsek_Model.OrderParameterStatistics
+    6. The results do not depend on the size of the chunks, nor on where the series is read from
+    """
+
+    a=0.8
+    num_samples=2**18
+
+    rng=np.random.default_rng(0)
+    noise=rng.normal(size=num_samples)*0.01
+    series=np.empty(num_samples)
+    series[0]=noise[0]/np.sqrt(1-a**2)
+    for t in range(1,num_samples):
+        series[t]=a*series[t-1]+noise[t]
+    series+=0.5
+
+    results=Analysis.Analyze(series,100,chunk_size=2**10)
+
+    exact_tau=(1+a)/(1-a)
+    exact_err=0.01/np.sqrt(1-a**2)*np.sqrt(exact_tau/num_samples)
+
+    assert abs(results['tau_phi']-exact_tau) < 0.1*exact_tau
+    assert results['tau_phi_converged']
+    assert abs(results['mean_phi_err']-exact_err) < 0.2*exact_err
+    assert results['mean_phi_err'] > np.std(series)/np.sqrt(num_samples)
+
+    moments=np.array([num_samples,np.sum(series),np.sum(series**2),np.sum(series**4)])
+    assert np.allclose([results['mean_phi'],results['chi'],results['binder']],Vicsek_Model.OrderParameterStatistics(moments,100))
+
+    path=str(tmp_path/'trajectory')
+    Trajectory.WriteTrajectory(path,{'phi': series},chunk_frames=5000)
+
+    for other in [Analysis.Analyze(series,100,chunk_size=2**14),Analysis.Analyze(Trajectory.TrajectoryReader(path)['phi'],100,chunk_size=2**10)]:
+        for key in results:
+            assert np.isclose(results[key],other[key],rtol=1e-9,atol=0) or results[key] == other[key]
+
+
+@given(num_samples=st.integers(0,50), excess=st.integers(0,10))
+def test_Blocking_TransientTooLong(num_samples,excess):
+
+    """
+    Procedure:
+    1. Generate a series of num_samples samples
+    2. Set a transient leaving less than 2 samples, up to longer than the whole series
+    ---------
+    Verification:
+    3. The blocking analysis and the whole analysis raise a ValueError instead of failing on the missing samples
+    """
+
+    series=np.random.default_rng(0).random(num_samples)
+    start=max(num_samples-1+excess,0)
+
+    with pytest.raises(ValueError):
+        Analysis.Blocking(series,start)
+
+    with pytest.raises(ValueError):
+        Analysis.Analyze(series,10,start=start)
+
+
+@given(num_part=st.integers(2,200), grid_size=st.integers(3,20), seed=st.integers(0,100))
+@settings(deadline=None)
+def test_SpatialAnalysis_EqualPairs(num_part,grid_size,seed):
+
+    """
+    Procedure:
+    1. Generate random positions and orientations of some frames
+    2. Calculate the velocity correlation on the grid through fast Fourier transforms, in batches of 2 frames
+    3. Calculate it directly, summing over all the pairs of particles the products of the fluctuations of their directions of motion, by shell of the displacement of their cells
+    ---------
+    Verification:
+    4. The grid holds all the particles and the sum of their directions of motion at each frame
+    5. The velocity correlation is equal to the direct one
+    """
+
+    rng=np.random.default_rng(seed)
+    space_dim=10.
+    position=rng.random((5,2,num_part))*space_dim
+    theta=rng.random((5,num_part))*2*np.pi
+
+    density,velocity=Analysis.GridFields(position,theta,space_dim,grid_size)
+    assert np.all(np.sum(density,axis=(1,2)) == num_part)
+    assert np.allclose(np.sum(velocity,axis=(2,3)),np.stack([np.sum(np.cos(theta),axis=1),np.sum(np.sin(theta),axis=1)],axis=1))
+
+    results=Analysis.SpatialAnalysis(position,theta,space_dim,grid_size,batch_frames=2)
+
+    shells,num_shells=Analysis.Shells(grid_size)
+    products=np.zeros(num_shells)
+    pairs=np.zeros(num_shells)
+    for frame in range(5):
+        cells=np.floor(position[frame]/space_dim*grid_size).astype(int) % grid_size
+        directions=np.array([np.cos(theta[frame]),np.sin(theta[frame])])
+        fluctuations=directions-np.mean(directions,axis=1,keepdims=True)
+        pair_shells=shells[(cells[0][:,None]-cells[0][None,:]) % grid_size,(cells[1][:,None]-cells[1][None,:]) % grid_size].ravel()
+        products+=np.bincount(pair_shells,(fluctuations.T@fluctuations).ravel(),minlength=num_shells)[:num_shells]
+        pairs+=np.bincount(pair_shells,minlength=num_shells)[:num_shells]
+
+    with np.errstate(invalid='ignore'):
+        assert np.allclose(results['velocity_correlation'],products/pairs,equal_nan=True)
+
+
+def test_SpatialAnalysis_UniformDensity(tmp_path):
+
+    """
+    Procedure:
+    1. Generate uniformly random positions of independent particles at some frames
+    2. Save them to .npy files and calculate the structure factor reading them memory mapped
+    ---------
+    Verification:
+    3. The structure factor of independent particles is 1 at all wave numbers, within the statistical error
+    4. The results do not depend on the number of frames transformed at a time
+    """
+
+    rng=np.random.default_rng(0)
+    position=rng.random((40,2,500))*20.
+    theta=rng.random((40,500))*2*np.pi
+
+    np.save(str(tmp_path/'position.npy'),position)
+    np.save(str(tmp_path/'theta.npy'),theta)
+
+    results=Analysis.SpatialAnalysis(np.load(str(tmp_path/'position.npy'),mmap_mode='r'),np.load(str(tmp_path/'theta.npy'),mmap_mode='r'),20.,32,batch_frames=8)
+
+    assert results['num_frames'] == 40
+    assert len(results['k']) == len(results['structure_factor']) == 16
+    assert abs(np.mean(results['structure_factor'])-1) < 0.05
+    assert np.all(np.abs(results['structure_factor'][1:]-1) < 0.3)
+
+    other=Analysis.SpatialAnalysis(position,theta,20.,32,batch_frames=64)
+    for key in results:
+        assert np.allclose(results[key],other[key],equal_nan=True)
+
+
+@given(num_part=st.integers(1,80), batch_frames=st.integers(1,4), seed=st.integers(0,100))
+@settings(deadline=None)
+def test_ClusterAnalysis_EqualDirect(num_part,batch_frames,seed):
+
+    """
+    Procedure:
+    1. Generate random positions and orientations of some frames
+    2. Find the clusters of each frame, labeling batch_frames frames at a time
+    3. Find the clusters of each frame directly, joining the particles within int_radius (periodic distance) until no label changes
+    ---------
+    Verification:
+    4. The number of clusters, the sizes and the polarizations of the clusters of each frame are equal to the direct ones
+    5. The size histogram counts all the clusters, and the particles of each frame are in its clusters
+    """
+
+    rng=np.random.default_rng(seed)
+    space_dim=5.
+    position=rng.random((4,2,num_part))*space_dim
+    theta=rng.random((4,num_part))*2*np.pi
+
+    results=Analysis.ClusterAnalysis(position,theta,1.,space_dim,batch_frames=batch_frames)
+
+    assert np.sum(results['size_histogram']) == len(results['sizes'])
+
+    for frame in range(4):
+        begin,end=results['offsets'][frame],results['offsets'][frame+1]
+
+        distance=position[frame][:,:,None]-position[frame][:,None,:]
+        distance-=space_dim*np.round(distance/space_dim)
+        adjacent=np.sum(distance**2,axis=0) <= 1.
+
+        labels=np.arange(num_part)
+        while True:
+            new_labels=np.min(np.where(adjacent,labels[None,:],num_part),axis=1)
+            if np.array_equal(new_labels,labels):
+                break
+            labels=new_labels
+
+        clusters=np.unique(labels)
+        sizes=np.array([np.sum(labels == c) for c in clusters])
+        polarizations=np.array([np.hypot(np.sum(np.cos(theta[frame][labels == c])),np.sum(np.sin(theta[frame][labels == c])))/np.sum(labels == c) for c in clusters])
+
+        assert results['num_clusters'][frame] == len(clusters)
+        assert results['largest_cluster'][frame] == np.max(sizes)
+        assert np.sum(results['sizes'][begin:end]) == num_part
+        assert np.array_equal(np.sort(results['sizes'][begin:end]),np.sort(sizes))
+        assert np.allclose(np.sort(results['polarizations'][begin:end]),np.sort(polarizations))
+
+
+@given(start=st.integers(100,1000), seed=st.integers(0,100))
+@settings(deadline=None)
+def test_Equilibration_Relaxation(start,seed):
+
+    """
+    Procedure:
+    1. Generate a series of 8*start samples that relaxes linearly from 0 to 1 in start samples and then fluctuates around 1
+    2. Generate a series that drifts linearly for all its samples
+    ---------
+    Verification:
+    3. The detected end of the transient of the relaxing series is not before 90% of start, nor after 2*start
+    4. No end of the transient is detected in the drifting series
+    """
+
+    rng=np.random.default_rng(seed)
+    noise=0.01*rng.normal(size=8*start)
+
+    series=np.minimum(np.arange(8*start)/start,1.)+noise
+    detected=Analysis.Equilibration(series)
+
+    assert detected is not None
+    assert 0.9*start <= detected <= 2*start
+
+    assert Analysis.Equilibration(np.arange(8*start)/start+noise) is None
+
+
+def test_AdaptiveStop_EqualSimulate():
+
+    """
+    Procedure:
+    1. Initialize random seed and simulate a small system until 30 independent samples are collected, saving the order parameter every 2 steps
+    2. Initialize the same random seed and simulate the same system for the number of steps of the adaptive run
+    3. Run an adaptive point of a sweep
+    ---------
+    Verification:
+    4. The adaptive run stops before the maximum number of steps, with 30 independent samples after the detected transient
+    5. The saved order parameter, truncated to the last step, is equal to the one of the fixed run
+    6. The moments are the ones of the steps after the transient
+    7. The sweep point stops before its maximum number of steps
+    """
+
+    np.random.seed(11)
+    config=Vicsek_Model.InitialConfiguration(60,5.)
+    vel=Vicsek_Model.VelocityCalculation(0.2,config[2])
+
+    stop=Analysis.AdaptiveStop(num_samples=30,max_steps=20000,check_every=200)
+    out=Vicsek_Model.TrajectoryArrays(20000//2+1,60,['phi'])
+    Vicsek_Model.Simulate(config,vel,1.,0.4,5.,1.,20000,0.2,save_every=2,out=out,stop=stop)
+    info=stop.Info()
+
+    assert info['converged']
+    assert info['num_steps'] < 20000
+    assert info['independent_samples'] >= 30
+    assert info['equilibration_step'] is not None
+
+    np.random.seed(11)
+    config=Vicsek_Model.InitialConfiguration(60,5.)
+    fixed=Vicsek_Model.TrajectoryArrays(info['num_steps']//2+1,60,['phi'])
+    Vicsek_Model.Simulate(config,vel,1.,0.4,5.,1.,info['num_steps'],0.2,save_every=2,out=fixed)
+
+    assert np.array_equal(out['phi'],fixed['phi'])
+    assert stop.Moments()[0] == info['num_steps']+1-info['equilibration_step']
+
+    sweep_config=configparser.ConfigParser()
+    sweep_config.read_dict({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.4', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '60', 'space_dim': '5.0', 'num_steps': '20000', 'seed': '11'},
+                            'adaptive': {'enabled': 'yes', 'num_samples': '30', 'check_every': '200'},
+                            'sweep': {}})
+
+    mean_phi,std_phi,chi,binder,num_steps,transient=Sweep.RunPoint(Sweep.ParameterGrid(sweep_config)[0])
+
+    assert num_steps < 20000
+    assert 0 <= transient < num_steps
+
+
+def test_Run_AdaptiveStreamResume(tmp_path,monkeypatch):
+
+    """
+    Procedure:
+    1. Run adaptively a small system with the frames streamed to disk and a given transient
+    2. Run it again with checkpoints, interrupting it after the first checkpoints, and resume it from the last checkpoint
+    3. Set the numba engine in an adaptive run
+    ---------
+    Verification:
+    4. The saved .npy files are truncated to the last step of the adaptive run and are equal to the returned fields
+    5. The transient is searched after the given one
+    6. The resumed run is equal to the uninterrupted one, with the same information and moments
+    7. The adaptive run with the numba engine raises a ValueError
+    """
+
+    def Sections(data):
+        return {'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.4', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '60', 'space_dim': '5.0', 'num_steps': '20000', 'seed': '11'},
+                'paths': {'order_param': os.path.join(data,'phi.npy'), 'position': os.path.join(data,'position.npy'), 'orientation': os.path.join(data,'theta.npy'),
+                          'moments': os.path.join(data,'moments.npy'), 'checkpoint': os.path.join(data,'checkpoint.pkl')},
+                'output': {'fields': 'position,theta,phi,moments', 'save_every': '2', 'stream': 'yes', 'transient': '300'},
+                'adaptive': {'enabled': 'yes', 'num_samples': '30', 'check_every': '200'}}
+
+    os.makedirs(tmp_path/'first')
+    first=Simulation.Run(Sections(str(tmp_path/'first')))
+    num_steps=first['info']['num_steps']
+
+    assert num_steps < 20000
+    assert first['info']['equilibration_step'] >= 300
+
+    for field, name in [('position','position'),('theta','theta'),('phi','phi')]:
+        saved=np.load(str(tmp_path/'first'/(name+'.npy')))
+        assert len(saved) == num_steps//2+1
+        assert np.array_equal(saved,first['out'][field])
+
+    assert np.array_equal(np.load(str(tmp_path/'first'/'moments.npy')),first['out']['moments'])
+
+    # Interrupt the run after its third checkpoint
+    os.makedirs(tmp_path/'second')
+    sections=Sections(str(tmp_path/'second'))
+    sections['output']['checkpoint_every']='100'
+
+    call=Analysis.AdaptiveStop.__call__
+    def Interrupted(self,step,config):
+        if step == 350:
+            raise RuntimeError('interrupted')
+        return call(self,step,config)
+
+    monkeypatch.setattr(Analysis.AdaptiveStop,'__call__',Interrupted)
+    with pytest.raises(RuntimeError):
+        Simulation.Run(sections)
+    monkeypatch.undo()
+
+    assert Vicsek_Model.LoadCheckpoint(sections['paths']['checkpoint'])['step'] == 300
+
+    config=configparser.ConfigParser()
+    config.read_dict(sections)
+    resumed=Simulation.Run(config,resume=True)
+
+    assert resumed['info'] == first['info']
+    for field in ['position','theta','phi','moments']:
+        assert np.array_equal(resumed['out'][field],first['out'][field])
+
+    sections['numerics']={'engine': 'numba'}
+
+    with pytest.raises(ValueError):
+        Simulation.Run(sections)
+
+
+def test_DomainSimulate_EqualSimulate():
+
+    """
+    Procedure:
+    1. Set the parameters of a system whose strips are narrower than the interaction radius when split among three processes
+    2. Simulate the model with the 'kdtree' neighbor method, in double and single precision
+    3. Simulate the model from the same configuration and random state with the domain engine, with one and three processes
+    ---------
+    Verification:
+    4. The simulations of the domain engine are equal to the serial ones, for all the saved fields
+    """
+
+    int_radius=1.
+
+    vel_mod=0.3
+
+    time_step=1.
+
+    num_part=300
+
+    space_dim=2.5
+
+    num_steps=8
+
+    fields=['position','theta','phi','heading','moments']
+
+    for dtype in [np.float64,np.float32]:
+
+        rng=np.random.default_rng(5)
+        config=Vicsek_Model.InitialConfiguration(num_part,space_dim,rng,np.dtype(dtype))
+        vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+
+        serial=Vicsek_Model.TrajectoryArrays(num_steps//2+1,num_part,fields,dtype=np.dtype(dtype))
+        Vicsek_Model.Simulate(config,vel,int_radius,0.3,space_dim,time_step,num_steps,vel_mod,'kdtree',0.,2,serial,3,np.random.default_rng(6))
+
+        for num_workers in [1,3]:
+            out=Vicsek_Model.TrajectoryArrays(num_steps//2+1,num_part,fields,dtype=np.dtype(dtype))
+            Vicsek_Domain.Simulate(config,vel,int_radius,0.3,space_dim,time_step,num_steps,vel_mod,2,out,3,np.random.default_rng(6),num_workers=num_workers)
+
+            for field in fields:
+                assert np.array_equal(out[field],serial[field])
+
+
+def test_DomainSimulate_CheckpointResume(tmp_path):
+
+    """
+    Procedure:
+    1. Set the parameters of a small system and the checkpoint interval
+    2. Initialize random seed and simulate the model with the domain engine and the global random state, saving checkpoints
+    3. Erase the frames and the order parameter moments after the last checkpoint
+    4. Load the last checkpoint and resume the simulation with the domain engine from its step, configuration, random state and moments
+    ---------
+    Verification:
+    5. The last checkpoint is at the last multiple of the checkpoint interval
+    6. The resumed simulation is equal to the uninterrupted one
+    """
+
+    num_part=80
+
+    space_dim=4.
+
+    int_radius=1.
+
+    vel_mod=0.2
+
+    num_steps=8
+
+    path=str(tmp_path/'checkpoint.pkl')
+
+    np.random.seed(5)
+    config=Vicsek_Model.InitialConfiguration(num_part,space_dim)
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    out=Vicsek_Model.TrajectoryArrays(num_steps+1,num_part,['position','theta','phi','moments'])
+    Vicsek_Domain.Simulate(config,vel,int_radius,0.4,space_dim,1.,num_steps,vel_mod,out=out,transient=2,
+                           checkpoint_path=path,checkpoint_every=3,num_workers=2)
+
+    checkpoint=Vicsek_Model.LoadCheckpoint(path)
+
+    assert checkpoint['step'] == 6
+
+    resumed={field: out[field].copy() for field in out}
+    for field in ['position','theta','phi']:
+        resumed[field][checkpoint['step']+1:]=0
+    resumed['moments'][:]=checkpoint['moments']
+
+    np.random.set_state(checkpoint['rng_state'])
+    config=checkpoint['config']
+    vel=Vicsek_Model.VelocityCalculation(vel_mod,config[2])
+    Vicsek_Domain.Simulate(config,vel,int_radius,0.4,space_dim,1.,num_steps,vel_mod,out=resumed,transient=2,
+                           start_step=checkpoint['step'],num_workers=2)
+
+    for field in out:
+        assert np.array_equal(out[field],resumed[field])
+
+
+def test_Run_CacheEqualSimulation(tmp_path):
+
+    """
+    Procedure:
+    1. Set the sections of a settings file of a small system, with the cache enabled
+    2. Run the simulation twice, then once with the cache disabled, once with another number of processes, once with two threads and once with another seed
+    3. Save the result of the cached run to the local paths
+    4. Run the simulation with another seed and a cache smaller than a single run
+    ---------
+    Verification:
+    5. The first run is simulated and the second one is read from the cache, with the same saved fields and order parameter moments
+    6. The run with the cache disabled is equal to the cached one, the runs with another number of processes or threads are read from the cache, while the run with another seed is simulated
+    7. The saved .npy files are equal to the fields of the run
+    8. The run larger than the cache is evicted, so that it is simulated again
+    """
+
+    data=str(tmp_path)
+
+    sections={'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.3', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '50', 'space_dim': '5.0', 'num_steps': '20', 'seed': '7'},
+              'paths': {'order_param': os.path.join(data,'phi.npy'), 'position': os.path.join(data,'position.npy'), 'orientation': os.path.join(data,'theta.npy'), 'moments': os.path.join(data,'moments.npy')},
+              'output': {'fields': 'position,theta,phi,moments'},
+              'cache': {'enabled': 'yes', 'path': os.path.join(data,'cache'), 'max_size': '64'}}
+
+    first=Simulation.Run(sections)
+    second=Simulation.Run(sections)
+
+    assert not first['cached'] and second['cached']
+
+    for field in ['position','theta','phi','moments']:
+        assert np.array_equal(first['out'][field],second['out'][field])
+
+    uncached=Simulation.Run(sections,use_cache=False)
+
+    assert not uncached['cached']
+    assert np.array_equal(uncached['out']['theta'],second['out']['theta'])
+
+    sections['numerics']={'num_workers': '3'}
+
+    assert Simulation.Run(sections)['cached']
+
+    sections['numerics']={'num_threads': '2'}
+
+    assert Simulation.Run(sections)['cached']
+
+    del sections['numerics']
+    sections['parameters']['seed']='8'
+
+    assert not Simulation.Run(sections)['cached']
+
+    config=configparser.ConfigParser()
+    config.read_dict(sections)
+    Simulation.Save(config,second)
+
+    assert np.array_equal(np.load(os.path.join(data,'position.npy')),second['out']['position'])
+
+    sections['parameters']['seed']='9'
+    sections['cache']['max_size']='1e-6'
+
+    assert not Simulation.Run(sections)['cached']
+    assert not Simulation.Run(sections)['cached']
+
+
+def test_Simulation_LazyImports():
+
+    """
+    Procedure:
+    1. Import the Simulation file in a new interpreter and run a small system with the numpy engine, without cache nor adaptive run length
+    ---------
+    Verification:
+    2. The other engines, the analysis functions and the cache are not imported
+    """
+
+    script=("import sys, Simulation\n"
+            "Simulation.Run({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.3', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '20', 'space_dim': '3.0', 'num_steps': '3', 'seed': '1'},\n"
+            "                'paths': {'order_param': '', 'position': '', 'orientation': ''}})\n"
+            "print(','.join(name for name in ['numba','Vicsek_Numba','Vicsek_Domain','Analysis','Cache'] if name in sys.modules))")
+
+    result=subprocess.run([sys.executable,'-c',script],capture_output=True,text=True,cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    assert result.returncode == 0, result.stderr
+    assert result.stdout.strip() == ''
+
+
+def test_ResultCache_SameRunTwice(tmp_path,monkeypatch):
+
+    """
+    Procedure:
+    1. Simulate a small system
+    2. Store its result twice under the same key, the second time as a process that does not see the run stored by the other one
+    ---------
+    Verification:
+    3. The second store does not fail and leaves no temporary folder
+    4. The run read from the cache is equal to the simulated one
+    """
+
+    np.random.seed(2)
+    config=Vicsek_Model.InitialConfiguration(30,3.)
+    vel=Vicsek_Model.VelocityCalculation(0.2,config[2])
+    out=Vicsek_Model.TrajectoryArrays(6,30,['theta','phi','moments'])
+    Vicsek_Model.Simulate(config,vel,1.,0.3,3.,1.,5,0.2,out=out)
+
+    cache=Cache.ResultCache(str(tmp_path),2**20)
+    cache.Put('run',out,info={'num_steps': 5})
+
+    with monkeypatch.context() as m:
+        m.setattr(os.path,'exists',lambda path: False)
+        cache.Put('run',out,info={'num_steps': 5})
+
+    assert sorted(os.listdir(str(tmp_path))) == ['index.sqlite','run']
+
+    cached,info=cache.Get('run')
+
+    assert info == {'num_steps': 5}
+    for field in out:
+        assert np.array_equal(cached[field],out[field])
+
+
+def test_ResultCache_EvictedWhileRead(tmp_path):
+
+    """
+    Procedure:
+    1. Store the result of a small system in the cache
+    2. Remove its saved frames, as another process evicting the run after its index row has been read
+    3. Read it from the cache, then store it again and read it
+    ---------
+    Verification:
+    4. The run removed while read is a miss and is dropped from the index
+    5. The run stored again is read back
+    """
+
+    np.random.seed(2)
+    config=Vicsek_Model.InitialConfiguration(30,3.)
+    vel=Vicsek_Model.VelocityCalculation(0.2,config[2])
+    out=Vicsek_Model.TrajectoryArrays(6,30,['theta','phi','moments'])
+    Vicsek_Model.Simulate(config,vel,1.,0.3,3.,1.,5,0.2,out=out)
+
+    cache=Cache.ResultCache(str(tmp_path),2**20)
+    cache.Put('run',out)
+
+    for name in os.listdir(str(tmp_path/'run')):
+        if name != 'metadata.json':
+            os.remove(str(tmp_path/'run'/name))
+
+    assert cache.Get('run') is None
+    assert cache.Size() == 0
+
+    cache.Put('run',out)
+
+    assert np.array_equal(cache.Get('run')[0]['theta'],out['theta'])
+
+
+def test_Key_TypedSettings():
+
+    """
+    Procedure:
+    1. Set the sections of a settings file with the default numerical settings left out
+    2. Write the same settings with their values in another form, then change the number of threads and of processes
+    3. Change the code version, the transient and the Verlet skin
+    ---------
+    Verification:
+    4. The equal settings and the settings differing only in the number of threads and of processes have the same key
+    5. Another code version, transient or Verlet skin changes the key, also in an adaptive run
+    6. The key depends on the source files of the trajectory format
+    """
+
+    def Key(sections):
+        config=configparser.ConfigParser()
+        config.read_dict(sections)
+        return Cache.Key(config,'version')
+
+    sections={'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.3', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '50', 'space_dim': '5.0', 'num_steps': '20', 'seed': '7'}}
+    key=Key(sections)
+
+    equal=dict(sections,parameters=dict(sections['parameters'],noise_ampl='0.30',space_dim='5'),
+               numerics={'neighbor_method': 'kdtree', 'verlet_skin': '0', 'engine': 'numpy', 'dtype': 'f8', 'num_threads': '4', 'num_workers': '2'})
+
+    assert Key(equal) == key
+
+    config=configparser.ConfigParser()
+    config.read_dict(sections)
+
+    assert Cache.Key(config,'other') != key
+    assert Key(dict(sections,output={'transient': '5'})) != key
+    assert Key(dict(sections,numerics={'verlet_skin': '0.5'})) != key
+
+    adaptive=dict(sections,adaptive={'enabled': 'yes'})
+
+    assert Key(adaptive) != key
+    assert Key(dict(adaptive,output={'transient': '5'})) != Key(adaptive)
+
+    assert 'Trajectory.py' in Cache.source_files
+
+
+def test_Batch_RetryFailedJobs(tmp_path):
+
+    """
+    Procedure:
+    1. Write in a queue folder the settings files of three small systems with different seeds and a settings file without the model parameters
+    2. Run the queue in a pool of two worker processes, retrying the failed jobs once
+    3. Run the simulation of each valid settings file directly
+    ---------
+    Verification:
+    4. The valid jobs are done and moved to the done folder, the invalid one has failed after two attempts and is moved to the failed folder, with its error in its status
+    5. The order parameter saved by each job is equal to the one of the direct simulation
+    6. All the jobs are run by the same two warm processes
+    """
+
+    queue=str(tmp_path/'queue')
+    os.makedirs(queue)
+
+    for seed in range(3):
+        config=configparser.ConfigParser()
+        config.read_dict({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.3', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '40', 'space_dim': '4.0', 'num_steps': '10', 'seed': str(seed)},
+                          'paths': {'order_param': str(tmp_path/'phi_{}.npy'.format(seed)), 'position': str(tmp_path/'position_{}.npy'.format(seed)), 'orientation': str(tmp_path/'theta_{}.npy'.format(seed))},
+                          'output': {'fields': 'phi'}})
+        with open(os.path.join(queue,'job_{}.ini'.format(seed)),'w') as f:
+            config.write(f)
+
+    with open(os.path.join(queue,'broken.ini'),'w') as f:
+        f.write('[output]\nfields=phi\n')
+
+    summary=Batch.ProcessQueue(queue,workers=2,retries=1,poll=0.1)
+
+    assert summary == {'job_0.ini': 'done', 'job_1.ini': 'done', 'job_2.ini': 'done', 'broken.ini': 'failed'}
+    assert sorted(os.listdir(os.path.join(queue,'done'))) == ['job_0.ini','job_1.ini','job_2.ini']
+    assert os.listdir(os.path.join(queue,'failed')) == ['broken.ini']
+    assert not [name for name in os.listdir(queue) if name.endswith('.ini')]
+
+    with open(os.path.join(queue,'status','broken.json')) as f:
+        status=json.load(f)
+
+    assert status['state'] == 'failed' and status['attempt'] == 2
+    assert 'KeyError' in status['error']
+
+    pids=set()
+    for seed in range(3):
+        config=configparser.ConfigParser()
+        config.read(os.path.join(queue,'done','job_{}.ini'.format(seed)))
+
+        assert np.array_equal(np.load(str(tmp_path/'phi_{}.npy'.format(seed))),Simulation.Run(config)['out']['phi'])
+
+        with open(os.path.join(queue,'status','job_{}.json'.format(seed))) as f:
+            status=json.load(f)
+
+        assert status['state'] == 'done' and status['attempt'] == 1
+        pids.add(status['pid'])
+
+    assert len(pids) <= 2
+
+
+def CrashJob(path):
+
+    """
+    This function kills its worker process if the name of the settings file contains crash, otherwise it runs the job after a while, so that the two jobs are running together when the worker dies.
+    """
+
+    if 'crash' in os.path.basename(path):
+        time.sleep(0.5)
+        os._exit(1)
+
+    time.sleep(2)
+
+    return Batch.RunJob(path)
+
+
+def test_Batch_WorkerCrash(tmp_path):
+
+    """
+    Procedure:
+    1. Write in a queue folder the settings file of a small system and a job that kills its worker process
+    2. Run the queue in a pool of two worker processes, without retries
+    ---------
+    Verification:
+    3. The valid job, running when the pool broke, is done at its first attempt
+    4. The job that kills its worker has failed and is moved to the failed folder, with the broken pool as error in its status
+    """
+
+    queue=str(tmp_path/'queue')
+    os.makedirs(queue)
+
+    config=configparser.ConfigParser()
+    config.read_dict({'parameters': {'vel_mod': '0.2', 'noise_ampl': '0.3', 'int_radius': '1.0', 'time_step': '1.0', 'num_part': '40', 'space_dim': '4.0', 'num_steps': '10', 'seed': '1'},
+                      'paths': {'order_param': str(tmp_path/'phi.npy'), 'position': str(tmp_path/'position.npy'), 'orientation': str(tmp_path/'theta.npy')},
+                      'output': {'fields': 'phi'}})
+    for name in ['a_crash.ini','b.ini']:
+        with open(os.path.join(queue,name),'w') as f:
+            config.write(f)
+
+    summary=Batch.ProcessQueue(queue,workers=2,retries=0,poll=0.1,run_job=CrashJob)
+
+    assert summary == {'a_crash.ini': 'failed', 'b.ini': 'done'}
+    assert os.listdir(os.path.join(queue,'failed')) == ['a_crash.ini']
+    assert os.path.exists(str(tmp_path/'phi.npy'))
+
+    with open(os.path.join(queue,'status','b.json')) as f:
+        status=json.load(f)
+
+    assert status['state'] == 'done' and status['attempt'] == 1
+
+    with open(os.path.join(queue,'status','a_crash.json')) as f:
+        status=json.load(f)
+
+    assert status['state'] == 'failed' and 'BrokenProcessPool' in status['error']
+
+
+def test_Benchmarks_Records():
+
+    """
+    Procedure:
+    1. Run the benchmarks of a small system with a very short minimum time
+    2. Compare the results with themselves
+    ---------
+    Verification:
+    3. There is a record for each benchmark, with positive times
+    4. The step hot paths of both neighbor methods are timed
+    5. The save and load paths of the .npy files and of the trajectory folder are timed
+    6. The comparison of the results with themselves has ratio 1
+    """
+
+    results=Benchmarks.Run([50],[2],num_steps=2,min_time=0.)
+
+    names=[r['name'] for r in results['records']]
+
+    assert len(names) == len(set(names))
+    assert all(r['best'] > 0 and r['best'] <= r['median'] for r in results['records'])
+
+    for method in ['kdtree','cells']:
+        assert 'NeighborPairs[{}]'.format(method) in names
+        assert 'ConfigurationUpdate[{}]'.format(method) in names
+        assert 'Simulate[{}]'.format(method) in names
+
+    for name in ['npy','container']:
+        assert 'Save[{}]'.format(name) in names
+        assert 'Load[{}]'.format(name) in names
+
+    comparison=Benchmarks.Compare(results,results)
+
+    assert len(comparison) == len(names)
+    assert all(c[-1] == 1 for c in comparison)
 
 
 if __name__ == "main":
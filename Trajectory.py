@@ -0,0 +1,223 @@
+#=======================================================================
+# Trajectory
+#
+# Aim: To store the saved fields of a simulation of the 2D Viscek Model
+#      in a single folder of compressed chunks, together with the
+#      settings of the run and an index of the frames, and to read any
+#      range of frames without loading the whole trajectory.
+#=======================================================================
+
+import bisect
+import configparser
+import json
+import os
+import sys
+import numpy as np
+
+# Fields saved at each frame, the order parameter moments are stored in the metadata
+frame_fields = ['position','theta','phi','heading']
+
+def WriteMetadata(path,metadata):
+
+    """
+    This function writes the metadata of a trajectory, first under a temporary name and then renaming it, so that the index is never partially written.
+
+    Parameters
+        path: folder of the trajectory
+        metadata: dictionary of the metadata
+    """
+
+    with open(os.path.join(path,'metadata.json.tmp'),'w') as f:
+        json.dump(metadata,f,indent=1)
+    os.replace(os.path.join(path,'metadata.json.tmp'),os.path.join(path,'metadata.json'))
+
+def WriteTrajectory(path,out,settings=None,chunk_frames=0):
+
+    """
+    This function writes the saved fields of a simulation in a folder of compressed chunks of chunk_frames frames each (chunk_<index>.npz), with a metadata.json file containing the settings of the run, the fields and the index of the frames of each chunk.
+    The fields are read one chunk at a time, so that memory mapped arrays are never loaded whole.
+
+    Parameters
+        path: folder of the trajectory
+        out: dictionary of the arrays of the saved fields (see Vicsek_Model.TrajectoryArrays)
+        settings: ConfigParser of the settings file of the run, embedded in the metadata
+        chunk_frames: number of frames of each chunk, if 0 the chunks are of about 8 MB
+    """
+
+    os.makedirs(path,exist_ok=True)
+
+    fields = [field for field in frame_fields if field in out]
+    num_frames = len(out[fields[0]]) if fields else 0
+
+    if chunk_frames <= 0:
+        frame_size = sum(out[field][0].nbytes for field in fields) if num_frames > 0 else 1
+        chunk_frames = max(1,2**23//frame_size)
+
+    metadata = {'settings': {section: dict(settings[section]) for section in settings.sections()} if settings is not None else {},
+                'fields': {field: {'dtype': out[field].dtype.str, 'shape': list(out[field].shape[1:])} for field in fields},
+                'moments': np.asarray(out['moments']).tolist() if 'moments' in out else None,
+                'num_frames': num_frames,
+                'chunk_frames': chunk_frames,
+                'chunks': []}
+
+    for start in range(0,num_frames,chunk_frames):
+        stop = min(start+chunk_frames,num_frames)
+
+        name = 'chunk_{:06d}.npz'.format(len(metadata['chunks']))
+        np.savez_compressed(os.path.join(path,name),**{field: np.asarray(out[field][start:stop]) for field in fields})
+
+        metadata['chunks'].append({'file': name, 'start': start, 'stop': stop})
+
+    WriteMetadata(path,metadata)
+
+class TrajectoryField:
+
+    """
+    This class reads a field of a trajectory lazily: indexing it with a frame or a range of frames loads only the chunks containing them. The last chunk read is kept in memory, so that consecutive frames are read with a single decompression.
+
+    Parameters:
+        path: folder of the trajectory
+        metadata: dictionary of the metadata of the trajectory
+        field: name of the field
+    """
+
+    def __init__(self,path,metadata,field):
+
+        self.path=path
+        self.field=field
+        self.chunks=metadata['chunks']
+        self.starts=[chunk['start'] for chunk in self.chunks]
+        self.num_frames=metadata['num_frames']
+        self.dtype=np.dtype(metadata['fields'][field]['dtype'])
+        self.shape=(self.num_frames,)+tuple(metadata['fields'][field]['shape'])
+
+        self.cached_chunk=None
+        self.cached_data=None
+
+    def __len__(self):
+
+        return self.num_frames
+
+    def Chunk(self,index):
+
+        """
+        This method loads the data of the field in a chunk.
+
+        Parameters:
+            index: index of the chunk
+
+        Returns:
+            Array of the field in the frames of the chunk (data).
+        """
+
+        if self.cached_chunk != index:
+            with np.load(os.path.join(self.path,self.chunks[index]['file'])) as chunk:
+                self.cached_data=chunk[self.field]
+            self.cached_chunk=index
+
+        return self.cached_data
+
+    def Frames(self,start,stop):
+
+        """
+        This method reads the field in the frames from start to stop (excluded).
+
+        Parameters:
+            start: first frame
+            stop: frame after the last one
+
+        Returns:
+            Array of the field in the frames (data).
+        """
+
+        start=max(start,0)
+        stop=min(stop,self.num_frames)
+        if stop <= start:
+            return np.empty((0,)+self.shape[1:],dtype=self.dtype)
+
+        first=bisect.bisect_right(self.starts,start)-1
+        last=bisect.bisect_right(self.starts,stop-1)-1
+
+        parts=[]
+        for index in range(first,last+1):
+            offset=self.chunks[index]['start']
+            parts.append(self.Chunk(index)[max(start-offset,0):stop-offset])
+
+        data=parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+        return data
+
+    def __getitem__(self,key):
+
+        if isinstance(key,slice):
+            start,stop,step=key.indices(self.num_frames)
+            if step == 1:
+                return self.Frames(start,stop)
+            return np.array([self[i] for i in range(start,stop,step)]).reshape((-1,)+self.shape[1:])
+
+        key=int(key)
+        if key < 0:
+            key+=self.num_frames
+        if key < 0 or key >= self.num_frames:
+            raise IndexError("Frame {} out of range".format(key))
+
+        return self.Frames(key,key+1)[0]
+
+class TrajectoryReader:
+
+    """
+    This class opens a trajectory written by WriteTrajectory, giving access to its settings, to the order parameter moments and to each field through a TrajectoryField.
+
+    Parameters:
+        path: folder of the trajectory
+    """
+
+    def __init__(self,path):
+
+        self.path=path
+
+        with open(os.path.join(path,'metadata.json')) as f:
+            self.metadata=json.load(f)
+
+        self.num_frames=self.metadata['num_frames']
+        self.fields=list(self.metadata['fields'])
+        self.moments=None if self.metadata['moments'] is None else np.array(self.metadata['moments'])
+
+    def Settings(self):
+
+        """
+        This method returns the settings of the run.
+
+        Returns:
+            ConfigParser with the settings embedded in the trajectory (config).
+        """
+
+        config=configparser.ConfigParser()
+        config.read_dict(self.metadata['settings'])
+
+        return config
+
+    def __getitem__(self,field):
+
+        if field not in self.metadata['fields']:
+            raise KeyError("Field not saved in the trajectory: {}".format(field))
+
+        return TrajectoryField(self.path,self.metadata,field)
+
+if __name__ == "__main__":
+
+    # Convert the .npy files of a simulation into a trajectory folder
+    # python Trajectory.py <settings file>
+
+    config=configparser.ConfigParser()
+    config.read(sys.argv[1])
+
+    paths = {'phi': config['paths']['order_param'],
+             'position': config['paths']['position'],
+             'theta': config['paths']['orientation'],
+             'heading': config.get('paths','heading',fallback='./data/heading.npy'),
+             'moments': config.get('paths','moments',fallback='./data/moments.npy')}
+
+    out = {field: np.load(path,mmap_mode='r') for field, path in paths.items() if os.path.exists(path)}
+
+    WriteTrajectory(config.get('paths','trajectory',fallback='./data/trajectory'),out,config,config.getint('output','chunk_frames',fallback=0))
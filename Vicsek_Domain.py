@@ -0,0 +1,321 @@
+#=======================================================================
+# Vicsek_Domain
+#
+# Aim: To simulate large systems of the 2D Viscek Model splitting the
+#      space in strips owned by worker processes, which share the state
+#      of the particles through shared memory and step it together,
+#      with the same result as the serial simulation.
+#=======================================================================
+
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+import numpy as np
+import Vicsek_Model
+
+def Owners(x,space_dim,num_domains):
+
+    """
+    This function assigns each particle to the strip of space along x containing it.
+
+    Parameters
+        x: particles x coordinate
+        space_dim: linear dimension of space
+        num_domains: number of strips
+
+    Returns:
+        Index of the strip of each particle (owners).
+    """
+
+    owners = np.minimum((x*(num_domains/space_dim)).astype(np.int64),num_domains-1)
+
+    return owners
+
+def Halo(x,domain,int_radius,space_dim,num_domains):
+
+    """
+    This function finds the particles within int_radius of a strip, satisfying periodic boundary conditions. A small margin is added so that no neighbor of the particles of the strip is lost in rounding.
+
+    Parameters
+        x: particles x coordinate
+        domain: index of the strip
+        int_radius: interaction radius
+        space_dim: linear dimension of space
+        num_domains: number of strips
+
+    Returns:
+        Boolean mask of the particles within int_radius of the strip, the ones of the strip included (halo).
+    """
+
+    start = domain*space_dim/num_domains
+    stop = (domain+1)*space_dim/num_domains
+    margin = int_radius+1e-9*space_dim
+
+    halo = (np.minimum((start-x) % space_dim,(x-stop) % space_dim) <= margin) | (Owners(x,space_dim,num_domains) == domain)
+
+    return halo
+
+def DomainMeanAngle(x,y,theta,own,local,int_radius,space_dim):
+
+    """
+    This function calculates the mean orientation of the neighbor particles of the particles of a strip, the particle itself included, finding the neighbor pairs among the particles of the strip and of its halo. The particles are taken in increasing index, so that the pairs are sorted as in Vicsek_Model.NeighborPairs and their orientations are summed in the same order, and the result is equal to the serial one.
+
+    Parameters
+        x, y, theta: particles coordinates and orientation
+        own: indices of the particles of the strip, in increasing order
+        local: indices of the particles of the strip and of its halo, in increasing order
+        int_radius: interaction radius
+        space_dim: linear dimension of space
+
+    Returns:
+        Mean orientation of the particles of the strip (mean_theta).
+    """
+
+    pairs = Vicsek_Model.KDTreePairs(np.array([x[local],y[local]]).T,int_radius,space_dim)
+
+    # The halo particles miss the neighbors out of the halo, only the ones of the strip are kept
+    mean_theta = Vicsek_Model.PairsMeanAngle(theta[local],pairs)[np.searchsorted(local,own)]
+
+    return mean_theta
+
+def SharedArrays(blocks,num_part,dtype,vel_dtype):
+
+    """
+    This function creates the arrays of the state of the particles on the shared memory blocks.
+
+    Parameters
+        blocks: shared memory blocks (multiprocessing.shared_memory.SharedMemory)
+        num_part: number of particles
+        dtype: floating point type of the configuration
+        vel_dtype: floating point type of the velocity
+
+    Returns:
+        Dictionary of the arrays (state): x and y coordinates, the two buffers of the orientations (theta), velocity components (vx, vy), noise of the step (noise) and stop flag (control).
+    """
+
+    state = {'x': np.ndarray(num_part,dtype=dtype,buffer=blocks[0].buf),
+             'y': np.ndarray(num_part,dtype=dtype,buffer=blocks[1].buf),
+             'theta': [np.ndarray(num_part,dtype=dtype,buffer=blocks[2].buf),np.ndarray(num_part,dtype=dtype,buffer=blocks[3].buf)],
+             'vx': np.ndarray(num_part,dtype=vel_dtype,buffer=blocks[4].buf),
+             'vy': np.ndarray(num_part,dtype=vel_dtype,buffer=blocks[5].buf),
+             'noise': np.ndarray(num_part,dtype=np.float64,buffer=blocks[6].buf),
+             'control': np.ndarray(1,dtype=np.int64,buffer=blocks[7].buf)}
+
+    return state
+
+def Worker(names,num_part,dtype,vel_dtype,int_radius,noise_ampl,space_dim,time_step,vel_mod,domain,num_domains,barrier):
+
+    """
+    This function steps the particles of a strip, synchronized with the other workers and the main process by barrier, until the main process sets the stop flag. At each step the worker updates the positions of the particles it owns, then, once all the positions are updated, takes the particles now in its strip (the ones that crossed its borders migrate to the neighbor strips) and updates their orientation and velocity. The orientations are read from one buffer and written to the other, so that the halo is never read while it is written.
+    The strip and its halo are searched among the candidate particles within int_radius plus a skin of int_radius of the strip, which are found again in the whole system only when the particles may have moved more than the skin.
+
+    Parameters
+        names: names of the shared memory blocks (see SharedArrays)
+        num_part: number of particles
+        dtype: floating point type of the configuration
+        vel_dtype: floating point type of the velocity
+        int_radius: interaction radius
+        noise_ampl: noise amplitude
+        space_dim: linear dimension of space
+        time_step: time step
+        vel_mod: velocity modulus
+        domain: index of the strip of the worker
+        num_domains: number of strips
+        barrier: barrier of the workers and of the main process (multiprocessing.Barrier)
+    """
+
+    blocks = [shared_memory.SharedMemory(name=name) for name in names]
+    state = SharedArrays(blocks,num_part,dtype,vel_dtype)
+    x, y, vx, vy, noise = state['x'], state['y'], state['vx'], state['vy'], state['noise']
+
+    # Number of steps after which a particle out of the candidates may be within int_radius of the strip, a tenth of the skin is left for rounding
+    skin = int_radius
+    refresh_every = max(int(0.9*skin/(vel_mod*time_step)),1) if vel_mod*time_step > 0 else np.inf
+
+    try:
+        own = np.nonzero(Owners(x,space_dim,num_domains) == domain)[0]
+        current = 0
+        steps = refresh_every
+
+        while True:
+
+            # Start of the step, the main process has drawn the noise
+            barrier.wait()
+            if state['control'][0]:
+                break
+
+            theta = state['theta'][current]
+            new_theta = state['theta'][1-current]
+
+            # Update the positions of the owned particles and impose periodic boundary conditions
+            x[own] = Vicsek_Model.PeriodicBoundary(x[own] + vx[own]*time_step,space_dim)
+            y[own] = Vicsek_Model.PeriodicBoundary(y[own] + vy[own]*time_step,space_dim)
+
+            barrier.wait()
+
+            if steps >= refresh_every:
+                candidates = np.nonzero(Halo(x,domain,int_radius+skin,space_dim,num_domains))[0]
+                steps = 0
+            steps += 1
+
+            # Particles in the strip and in its halo after the update, the neighbors are averaged with the previous orientations
+            candidate_x = x[candidates]
+            own = candidates[Owners(candidate_x,space_dim,num_domains) == domain]
+            if len(own) > 0:
+                local = candidates[Halo(candidate_x,domain,int_radius,space_dim,num_domains)]
+                mean_theta = DomainMeanAngle(x,y,theta,own,local,int_radius,space_dim)
+                new_theta[own] = mean_theta + noise_ampl*np.pi*(2*noise[own]-1)
+
+                vx[own] = vel_mod*np.cos(new_theta[own])
+                vy[own] = vel_mod*np.sin(new_theta[own])
+
+            barrier.wait()
+            current = 1-current
+
+    except BaseException:
+        barrier.abort()
+        raise
+
+    finally:
+        # The arrays on the blocks must be released before closing them
+        del x, y, vx, vy, noise, state
+        for block in blocks:
+            block.close()
+
+def Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,save_every=1,out=None,transient=0,rng=None,stats=None,
+             start_step=0,checkpoint_path=None,checkpoint_every=0,num_workers=None):
+
+    """
+    This function updates the particles position and orientation num_steps times with num_workers processes, each owning a strip of space along x, saving the fields of out every save_every steps. The state of the particles is kept in shared memory; the main process draws the noise of all the particles at each step from rng, in the same order of Vicsek_Model.ConfigurationUpdate, and saves the frames, so that the simulation is equal to Vicsek_Model.Simulate with the 'kdtree' neighbor method.
+
+    Parameters
+        config: previous particles configuration
+        vel: particles velocity
+        int_radius: interaction radius
+        noise_ampl: noise amplitude
+        space_dim: linear dimension of space
+        time_step: time step
+        num_steps: number of steps
+        vel_mod: velocity modulus
+        save_every: number of steps between two saved frames
+        out: dictionary of the arrays where the fields are saved (see Vicsek_Model.TrajectoryArrays), if None the positions and orientations are saved in memory
+        transient: number of initial steps excluded from the order parameter moments
+        rng: random number generator (numpy.random.Generator), if None the global numpy.random state is used
+        stats: Vicsek_Model.SimulationStats where the time of each phase, the steps per second and the peak memory are recorded, if None nothing is recorded
+        start_step: index of the step of config, greater than 0 when resuming from a checkpoint (the frames and moments up to start_step must already be in out)
+        checkpoint_path: path of the checkpoint file
+        checkpoint_every: number of steps between two checkpoints, if 0 no checkpoint is saved
+        num_workers: number of worker processes, if None the number of cores of the machine
+
+    Returns:
+        Position of the particles (position_updates) and orientation of the particles (theta_updates) at each saved frame.
+    """
+
+    if stats is not None:
+        stats.Start()
+
+    # The draws use the global numpy.random state when rng is None, while the checkpoints need rng itself to save that state
+    generator = np.random if rng is None else rng
+
+    num_part = len(config[2])
+    num_workers = num_workers or os.cpu_count()
+    dtype = config.dtype
+    vel_dtype = np.asarray(vel).dtype
+
+    if out is None:
+        out = Vicsek_Model.TrajectoryArrays(num_steps//save_every+1,num_part,dtype=dtype)
+
+    if start_step == 0:
+        Vicsek_Model.SaveFrame(out,0,config)
+
+        if 'moments' in out and transient == 0:
+            Vicsek_Model.AccumulateMoments(out['moments'],config[2])
+
+    # Shared memory blocks of the state of the particles
+    sizes = [num_part*dtype.itemsize]*4+[num_part*vel_dtype.itemsize]*2+[num_part*8,8]
+    blocks = [shared_memory.SharedMemory(create=True,size=max(size,1)) for size in sizes]
+    names = [block.name for block in blocks]
+
+    state = SharedArrays(blocks,num_part,dtype,vel_dtype)
+    state['x'][:] = config[0]
+    state['y'][:] = config[1]
+    state['theta'][0][:] = config[2]
+    state['vx'][:] = vel[0]
+    state['vy'][:] = vel[1]
+    state['control'][0] = 0
+
+    # Start the processes with spawn, the workers attach the shared blocks by name and inherit nothing, not even the threads a previous threaded or compiled simulation left running in this process
+    context = multiprocessing.get_context('spawn')
+    barrier = context.Barrier(num_workers+1)
+    workers = []
+
+    try:
+        workers = [context.Process(target=Worker,args=(names,num_part,dtype,vel_dtype,int_radius,noise_ampl,space_dim,time_step,vel_mod,domain,num_workers,barrier))
+                   for domain in range(num_workers)]
+        for worker in workers:
+            worker.start()
+
+        if stats is not None:
+            stats.Lap('setup')
+
+        current = 0
+        for i in range(start_step+1,num_steps+1):
+
+            # Noise of all the particles, drawn as in Vicsek_Model.ConfigurationUpdate
+            state['noise'][:] = generator.random(num_part)
+
+            if stats is not None:
+                stats.Lap('noise')
+
+            # Positions update, then neighbors averaging and orientations update
+            barrier.wait()
+            barrier.wait()
+            barrier.wait()
+            current = 1-current
+
+            if stats is not None:
+                stats.Lap('step')
+
+            config = np.array([state['x'],state['y'],state['theta'][current]])
+
+            # Save updated positions and orientations every save_every steps
+            if i % save_every == 0:
+                Vicsek_Model.SaveFrame(out,i//save_every,config)
+
+            # Accumulate the order parameter moments at each step after the transient
+            if 'moments' in out and i >= transient:
+                Vicsek_Model.AccumulateMoments(out['moments'],config[2])
+
+            if stats is not None:
+                stats.Lap('storage')
+
+            # Save the state of the simulation every checkpoint_every steps
+            if checkpoint_every > 0 and i % checkpoint_every == 0:
+                Vicsek_Model.Checkpoint(out,checkpoint_path,config,i,rng)
+
+                if stats is not None:
+                    stats.Lap('checkpoint')
+
+        # Stop the workers
+        state['control'][0] = 1
+        barrier.wait()
+
+    except BaseException:
+        barrier.abort()
+        raise
+
+    finally:
+        for worker in workers:
+            worker.join(timeout=10)
+            if worker.is_alive():
+                worker.terminate()
+
+        state = None
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    if stats is not None:
+        stats.Stop(num_steps-start_step)
+
+    return out.get('position'), out.get('theta')
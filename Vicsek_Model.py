@@ -7,11 +7,16 @@
 # Aim: To define the functions needed to simulate the 2D Viscek Model.
 #=======================================================================
 
+import json
+import os
+import pickle
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
-import matplotlib.pyplot as plt
 from scipy.spatial import KDTree
 
-def InitialConfiguration(num_part,space_dim):
+def InitialConfiguration(num_part,space_dim,rng=None,dtype=np.float64):
 
     """
     This function creates random initial positions and orientations of the particles.
@@ -19,26 +24,52 @@ def InitialConfiguration(num_part,space_dim):
     Parameters
         num_part : number of particles
         space_dim : linear dimension of space
+        rng : random number generator (numpy.random.Generator), if None the global numpy.random state is used
+        dtype : floating point type of the configuration (numpy.float64 or numpy.float32)
 
     Returns:
         Initial configuration of the particles (config).
     """
 
+    if rng is None:
+        rng = np.random
+
     # Generate random coordinates of particles between 0 and space_dim
-    x = np.random.rand(num_part)*space_dim
-    y = np.random.rand(num_part)*space_dim
+    x = PeriodicBoundary((rng.random(num_part)*space_dim).astype(dtype),space_dim)
+    y = PeriodicBoundary((rng.random(num_part)*space_dim).astype(dtype),space_dim)
 
     # Assert all particles must be inside the system space
-    assert all(i < space_dim and i >= 0 for i in x)
-    assert all(i < space_dim and i >= 0 for i in y)
+    assert np.all((x < space_dim) & (x >= 0))
+    assert np.all((y < space_dim) & (y >= 0))
 
     # Generate random orientation of particles between -π and π
-    theta = np.pi*(2*np.random.rand(num_part)-1)
+    theta = np.pi*(2*rng.random(num_part)-1)
 
-    config = np.array([x,y,theta])
+    config = np.array([x,y,theta],dtype=dtype)
 
     return config
 
+def PeriodicBoundary(x,space_dim):
+
+    """
+    This function imposes periodic boundary conditions on the particles coordinates.
+
+    Parameters
+        x: particles coordinates
+        space_dim: linear dimension of space
+
+    Returns:
+        Coordinates in [0, space_dim) (x).
+    """
+
+    dtype = np.asarray(x).dtype
+    x = (x % space_dim).astype(dtype,copy=False)
+
+    # A coordinate slightly below 0 can be rounded up to space_dim, or above it in single precision, and is wrapped to 0
+    x = np.where(x >= space_dim, 0, x).astype(dtype,copy=False)
+
+    return x
+
 def VelocityCalculation(vel_mod,theta):
 
     """
@@ -80,7 +111,320 @@ def FindNeighbors(positions,int_radius,particle,space_dim):
 
     return inds
 
-def NeighborsMeanAngle(config,int_radius,space_dim):
+def SortPairs(pairs,num_part):
+
+    """
+    This function sorts the neighbor pairs (i,j) by i and then by j.
+
+    Parameters:
+        pairs: neighbor pairs (i,j) with i < j (P X 2 array)
+        num_part: number of particles
+
+    Returns:
+        Sorted neighbor pairs (pairs).
+    """
+
+    keys=np.sort(pairs[:,0].astype(np.int64)*num_part+pairs[:,1])
+
+    pairs=np.array([keys//num_part,keys % num_part]).T
+
+    return pairs
+
+def KDTreePairs(positions,int_radius,space_dim,num_replicas=1):
+
+    """
+    This function finds all the pairs of particles within a distance int_radius of each other satisfying periodic boundary conditions, building a single KDTree for the whole system.
+
+    Parameters:
+        positions: particles positions (N X 2 array)
+        int_radius: interaction radius
+        space_dim: linear dimension of space
+        num_replicas: number of independent systems whose particles are stored one after the other in positions
+
+    Returns:
+        Array of neighbor pairs (i,j) with i < j, sorted by i and then by j (pairs).
+    """
+
+    # A KDTree for each replica, the indices of the particles of each replica follow the ones of the previous replica
+    num_part=len(positions)//num_replicas
+    pairs_list=[]
+    for k in range(num_replicas):
+        tree=KDTree(positions[k*num_part:(k+1)*num_part],boxsize=space_dim)
+        pairs_list.append(tree.query_pairs(int_radius,output_type='ndarray')+k*num_part)
+
+    pairs=np.concatenate(pairs_list) if num_replicas > 1 else pairs_list[0]
+
+    # Sort the pairs so that the neighbors sums are always accumulated in the same order
+    pairs=SortPairs(pairs,len(positions))
+
+    return pairs
+
+def PairsSquaredDistance(positions,i,j,space_dim):
+
+    """
+    This function calculates the squared distance between the particles i and j of each pair satisfying periodic boundary conditions (minimum image convention).
+
+    Parameters:
+        positions: particles positions (N X 2 array)
+        i: index of the first particle of each pair
+        j: index of the second particle of each pair
+        space_dim: linear dimension of space
+
+    Returns:
+        Squared distance of each pair (dist2).
+    """
+
+    dx=positions[j,0]-positions[i,0]
+    dy=positions[j,1]-positions[i,1]
+
+    dx=dx-space_dim*np.round(dx/space_dim)
+    dy=dy-space_dim*np.round(dy/space_dim)
+
+    dist2=dx*dx+dy*dy
+
+    return dist2
+
+def CellListPairs(positions,int_radius,space_dim,num_replicas=1):
+
+    """
+    This function finds all the pairs of particles within a distance int_radius of each other satisfying periodic boundary conditions, binning the particles into cells of side greater or equal than int_radius and looking for neighbors only in the adjacent cells.
+
+    Parameters:
+        positions: particles positions (N X 2 array)
+        int_radius: interaction radius
+        space_dim: linear dimension of space
+        num_replicas: number of independent systems whose particles are stored one after the other in positions
+
+    Returns:
+        Array of neighbor pairs (i,j) with i < j, sorted by i and then by j (pairs).
+    """
+
+    num_part=len(positions)//num_replicas
+
+    # Cells larger than int_radius are allowed, there is no gain in having more cells than particles
+    num_cells=int(min(space_dim//int_radius,np.sqrt(num_part))) if int_radius > 0 else 0
+    if num_cells > 0 and space_dim/num_cells < int_radius:
+        num_cells-=1
+
+    # With less than 3 cells per side the adjacent cells are not distinct, use the KDTree instead
+    if num_cells < 3:
+        return KDTreePairs(positions,int_radius,space_dim,num_replicas)
+
+    cell_side=space_dim/num_cells
+
+    # Assign each particle to its cell and sort the particles by cell index, the cells of each replica follow the ones of the previous replica
+    cells=(positions//cell_side).astype(np.int64) % num_cells
+    replica=np.arange(len(positions))//num_part
+    cell_index=replica*num_cells**2+cells[:,0]*num_cells+cells[:,1]
+    order=np.argsort(cell_index,kind='stable')
+    cell_count=np.bincount(cell_index,minlength=num_replicas*num_cells**2)
+    cell_start=np.cumsum(cell_count)-cell_count
+
+    # Work on the sorted particles so that the particles of each cell are contiguous in memory
+    sorted_positions=positions[order]
+    sorted_cells=cells[order]
+    sorted_replica=replica[order]
+
+    # Look for neighbors in the same cell and in half of the 8 adjacent cells, so that each pair is found once
+    pairs_list=[]
+    for dx,dy in [(0,0),(1,-1),(1,0),(1,1),(0,1)]:
+
+        neighbor_cell=sorted_replica*num_cells**2+((sorted_cells[:,0]+dx) % num_cells)*num_cells+(sorted_cells[:,1]+dy) % num_cells
+        count=cell_count[neighbor_cell]
+
+        # Expand each particle into the segment of the sorted particles belonging to the adjacent cell
+        i=np.repeat(np.arange(len(positions)),count)
+        j=np.arange(count.sum())+np.repeat(cell_start[neighbor_cell]-(np.cumsum(count)-count),count)
+
+        if dx == 0 and dy == 0:
+            keep=i < j
+            i,j=i[keep],j[keep]
+
+        # Keep only the pairs within the interaction radius
+        keep=PairsSquaredDistance(sorted_positions,i,j,space_dim) <= int_radius**2
+
+        pairs_list.append(np.array([order[i[keep]],order[j[keep]]]).T)
+
+    pairs=np.sort(np.concatenate(pairs_list),axis=1)
+
+    # Sort the pairs so that the neighbors sums are always accumulated in the same order
+    pairs=SortPairs(pairs,len(positions))
+
+    return pairs
+
+class VerletList:
+
+    """
+    This class stores the candidate neighbor pairs within a distance int_radius+skin of each other and reuses them across steps, rebuilding them only when some particle has moved more than skin/2 since the last build.
+
+    Parameters:
+        int_radius: interaction radius
+        space_dim: linear dimension of space
+        skin: thickness of the shell added to int_radius
+        neighbor_method: neighbor search method used to build the list, 'kdtree' or 'cells'
+    """
+
+    def __init__(self,int_radius,space_dim,skin,neighbor_method='kdtree'):
+
+        self.int_radius=int_radius
+        self.space_dim=space_dim
+        self.skin=skin
+        self.neighbor_method=neighbor_method
+
+        self.candidates=None
+        self.last_positions=None
+        self.displacement=None
+        self.num_builds=0
+
+    def Build(self,positions):
+
+        """
+        This method finds the candidate neighbor pairs within int_radius+skin and resets the particles displacements.
+
+        Parameters:
+            positions: particles positions (N X 2 array)
+        """
+
+        self.candidates=NeighborPairs(positions,self.int_radius+self.skin,self.space_dim,self.neighbor_method)
+        self.displacement=np.zeros(positions.shape)
+        self.num_builds+=1
+
+    def Pairs(self,positions):
+
+        """
+        This method finds all the pairs of particles within a distance int_radius of each other satisfying periodic boundary conditions, filtering the candidate pairs.
+
+        Parameters:
+            positions: particles positions (N X 2 array)
+
+        Returns:
+            Array of neighbor pairs (i,j) with i < j, sorted by i and then by j (pairs).
+        """
+
+        if self.candidates is None or len(positions) != len(self.last_positions):
+            self.Build(positions)
+        else:
+            # Accumulate the displacement since the last call undoing the periodic boundary conditions
+            step=positions-self.last_positions
+            step=step-self.space_dim*np.round(step/self.space_dim)
+            self.displacement+=step
+
+            if np.max(self.displacement[:,0]**2+self.displacement[:,1]**2) > (self.skin/2)**2:
+                self.Build(positions)
+
+        self.last_positions=np.array(positions,dtype=float)
+
+        # Keep only the candidate pairs within the interaction radius
+        i=self.candidates[:,0]
+        j=self.candidates[:,1]
+        pairs=self.candidates[PairsSquaredDistance(positions,i,j,self.space_dim) <= self.int_radius**2]
+
+        return pairs
+
+def NeighborPairs(positions,int_radius,space_dim,neighbor_method='kdtree',num_replicas=1):
+
+    """
+    This function finds all the pairs of particles within a distance int_radius of each other satisfying periodic boundary conditions.
+
+    Parameters:
+        positions: particles positions (N X 2 array)
+        int_radius: interaction radius
+        space_dim: linear dimension of space
+        neighbor_method: neighbor search method, 'kdtree', 'cells' or a VerletList
+        num_replicas: number of independent systems whose particles are stored one after the other in positions (not with a VerletList)
+
+    Returns:
+        Array of neighbor pairs (i,j) with i < j, sorted by i and then by j (pairs).
+    """
+
+    if isinstance(neighbor_method,VerletList):
+        pairs=neighbor_method.Pairs(positions)
+    elif neighbor_method == 'kdtree':
+        pairs=KDTreePairs(positions,int_radius,space_dim,num_replicas)
+    elif neighbor_method == 'cells':
+        pairs=CellListPairs(positions,int_radius,space_dim,num_replicas)
+    else:
+        raise ValueError("Unknown neighbor method: {}".format(neighbor_method))
+
+    return pairs
+
+def PairsMeanAngle(theta,pairs):
+
+    """
+    This function calculates the mean orientation of the neighbor particles of each particle (the particle itself included) given the list of neighbor pairs.
+
+    Parameters
+        theta: particles orientation
+        pairs: neighbor pairs (i,j) with i < j (P X 2 array)
+
+    Returns:
+        Mean orientation of the particles (mean_theta).
+    """
+
+    num_part=len(theta)
+
+    sin=np.sin(theta)
+    cos=np.cos(theta)
+
+    i=pairs[:,0]
+    j=pairs[:,1]
+
+    # Sum the orientations of the neighbors of each particle, counting each pair in both directions
+    sum_sin=sin+np.bincount(i,weights=sin[j],minlength=num_part)+np.bincount(j,weights=sin[i],minlength=num_part)
+    sum_cos=cos+np.bincount(i,weights=cos[j],minlength=num_part)+np.bincount(j,weights=cos[i],minlength=num_part)
+    num_neighbors=1+np.bincount(i,minlength=num_part)+np.bincount(j,minlength=num_part)
+
+    mean_theta=np.arctan2(sum_sin/num_neighbors,sum_cos/num_neighbors)
+
+    return mean_theta
+
+def ThreadedPairsMeanAngle(theta,pairs,num_threads):
+
+    """
+    This function calculates the mean orientation of the neighbor particles of each particle (the particle itself included) given the sorted list of neighbor pairs, splitting the particles in contiguous blocks averaged by a pool of threads. The pairs of the particles of a block as first particle are a contiguous block of the sorted pairs, and the ones as second particle all come before the end of that block; NumPy releases the GIL in the sums, so that the threads run on different cores. Each sum is accumulated in the same order as in PairsMeanAngle, so that the result is the same.
+
+    Parameters:
+        theta: particles orientation
+        pairs: neighbor pairs (i,j) with i < j, sorted by i and then by j (P X 2 array)
+        num_threads: number of threads
+
+    Returns:
+        Mean orientation of the particles (mean_theta).
+    """
+
+    num_part=len(theta)
+
+    sin=np.sin(theta)
+    cos=np.cos(theta)
+
+    i=pairs[:,0]
+    j=pairs[:,1]
+
+    # A few blocks per thread, so that the threads end at about the same time
+    bounds=np.linspace(0,num_part,4*num_threads+1).astype(np.int64)
+
+    mean_theta=np.empty(num_part)
+
+    def Block(start,stop):
+
+        # Pairs with the first particle in the block, and pairs before them with the second particle in the block
+        first=slice(np.searchsorted(i,start),np.searchsorted(i,stop))
+        second=np.flatnonzero(j[:first.stop] >= start)
+        second=second[j[second] < stop]
+
+        block=slice(start,stop)
+        sum_sin=sin[block]+np.bincount(i[first]-start,weights=sin[j[first]],minlength=stop-start)+np.bincount(j[second]-start,weights=sin[i[second]],minlength=stop-start)
+        sum_cos=cos[block]+np.bincount(i[first]-start,weights=cos[j[first]],minlength=stop-start)+np.bincount(j[second]-start,weights=cos[i[second]],minlength=stop-start)
+        num_neighbors=1+np.bincount(i[first]-start,minlength=stop-start)+np.bincount(j[second]-start,minlength=stop-start)
+
+        mean_theta[block]=np.arctan2(sum_sin/num_neighbors,sum_cos/num_neighbors)
+
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        list(executor.map(Block,bounds[:-1],bounds[1:]))
+
+    return mean_theta
+
+def NeighborsMeanAngle(config,int_radius,space_dim,neighbor_method='kdtree',stats=None,num_threads=1):
 
     """
     This function calculates the mean orientation of the neighbor partcicles within a circle of radius int_radius around each of the particles.
@@ -89,29 +433,35 @@ def NeighborsMeanAngle(config,int_radius,space_dim):
         config: previous particles configuration
         int_radius: interaction radius
         space_dim: linear dimension of space
+        neighbor_method: neighbor search method, 'kdtree', 'cells' or a VerletList
+        stats: SimulationStats where the time of each phase is recorded, if None nothing is recorded
+        num_threads: number of threads, if greater than 1 the neighbors are averaged by ThreadedPairsMeanAngle, with the same result
 
     Returns:
         Mean orientation of the particles (mean_theta).
     """
 
-    mean_theta=config[2].copy()
-
-    # Prepare the positions array for the functions that finds the neighbors of each particle
+    # Prepare the positions array for the function that finds the neighbor pairs
     pos=np.array([config[0],config[1]]).T
 
-    for i in range(0,len(config[2])):
+    # Find all the neighbor pairs within the interaction radius int_radius satisfying periodic boundary conditions
+    pairs=NeighborPairs(pos,int_radius,space_dim,neighbor_method)
 
-        # Find the neighbors of each particle within the interaction radius int_radius satisfying periodic boundary conditions
-        neighbors = FindNeighbors(pos,int_radius,[pos[i]],space_dim)
+    if stats is not None:
+        stats.Lap('neighbors')
 
-        # Calculate the mean orientation of the neighbor particles within int_radius
-        mean_sin=np.mean(np.sin(config[2][neighbors]))
-        mean_cos=np.mean(np.cos(config[2][neighbors]))
-        mean_theta[i] = np.arctan2(mean_sin,mean_cos)
+    # Calculate the mean orientation of the neighbor particles within int_radius
+    if num_threads > 1:
+        mean_theta=ThreadedPairsMeanAngle(config[2],pairs,num_threads)
+    else:
+        mean_theta=PairsMeanAngle(config[2],pairs)
+
+    if stats is not None:
+        stats.Lap('averaging')
 
     return mean_theta
 
-def ConfigurationUpdate(config,vel,int_radius,noise_ampl,space_dim,time_step):
+def ConfigurationUpdate(config,vel,int_radius,noise_ampl,space_dim,time_step,neighbor_method='kdtree',rng=None,stats=None,num_threads=1):
 
     """
     This function updates the particles position and orienation.
@@ -123,11 +473,18 @@ def ConfigurationUpdate(config,vel,int_radius,noise_ampl,space_dim,time_step):
         noise_ampl: noise amplituse
         space_dim: linear dimension of space
         time_step: time step
+        neighbor_method: neighbor search method, 'kdtree', 'cells' or a VerletList
+        rng: random number generator (numpy.random.Generator), if None the global numpy.random state is used
+        stats: SimulationStats where the time of each phase is recorded, if None nothing is recorded
+        num_threads: number of threads of the neighbors averaging (see NeighborsMeanAngle)
 
     Returns:
         Updated configuration of the particles (config).
     """
 
+    if rng is None:
+        rng = np.random
+
     new_config=config.copy()
 
     # Update particles position
@@ -135,18 +492,24 @@ def ConfigurationUpdate(config,vel,int_radius,noise_ampl,space_dim,time_step):
     new_config[1] = config[1] + vel[1]*time_step
 
     # Impose periodic boundary conditions
-    new_config[0] = new_config[0] % space_dim
-    new_config[1] = new_config[1] % space_dim
+    new_config[0] = PeriodicBoundary(new_config[0],space_dim)
+    new_config[1] = PeriodicBoundary(new_config[1],space_dim)
 
     # Assert all particles must be inside the system space
-    assert all(i < space_dim and i >= 0 for i in new_config[0])
-    assert all(i < space_dim and i >= 0 for i in new_config[1])
+    assert np.all((new_config[0] < space_dim) & (new_config[0] >= 0))
+    assert np.all((new_config[1] < space_dim) & (new_config[1] >= 0))
+
+    if stats is not None:
+        stats.Lap('positions')
 
     # Calculate the mean orientation of particles within int_radius satisfying periodic boundary conditions
-    mean_theta =  NeighborsMeanAngle(new_config,int_radius,space_dim)
+    mean_theta =  NeighborsMeanAngle(new_config,int_radius,space_dim,neighbor_method,stats,num_threads)
 
     # Update particles orientation
-    new_config[2] = mean_theta + noise_ampl*np.pi*(2*np.random.rand(len(new_config[2]))-1)
+    new_config[2] = mean_theta + noise_ampl*np.pi*(2*rng.random(len(new_config[2]))-1)
+
+    if stats is not None:
+        stats.Lap('noise')
 
     return new_config
 
@@ -162,8 +525,9 @@ def OrderParameter(theta):
         Order parameter (phi).
     """
 
-    sx = np.sum(np.cos(theta))
-    sy = np.sum(np.sin(theta))
+    # Calculate the sums in double precision also for single precision orientations
+    sx = np.sum(np.cos(theta,dtype=np.float64))
+    sy = np.sum(np.sin(theta,dtype=np.float64))
     phi = ((sx)**2 + (sy)**2)**(0.5)/len(theta)
 
     # Round the order parameter to the 10th decimal digit
@@ -175,7 +539,371 @@ def OrderParameter(theta):
 
     return phi
 
-def Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod):
+def MeanHeading(theta):
+
+    """
+    This function calculates the mean direction of motion of the particles.
+
+    Parameters
+        theta: particles orientation
+
+    Returns:
+        Mean heading in [-π, π] (heading).
+    """
+
+    heading = np.arctan2(np.sum(np.sin(theta,dtype=np.float64)),np.sum(np.cos(theta,dtype=np.float64)))
+
+    return heading
+
+def AccumulateMoments(moments,theta):
+
+    """
+    This function adds the order parameter of a configuration to the running sums of its moments.
+
+    Parameters
+        moments: running sums [number of samples, sum of phi, sum of phi^2, sum of phi^4]
+        theta: particles orientation
+    """
+
+    phi = OrderParameter(theta)
+
+    moments[0] += 1
+    moments[1] += phi
+    moments[2] += phi**2
+    moments[3] += phi**4
+
+def OrderParameterStatistics(moments,num_part):
+
+    """
+    This function calculates the mean order parameter, the susceptibility and the Binder cumulant from the running sums of the order parameter moments.
+
+    Parameters
+        moments: running sums [number of samples, sum of phi, sum of phi^2, sum of phi^4]
+        num_part: number of particles
+
+    Returns:
+        Mean order parameter (mean_phi), susceptibility (chi), Binder cumulant (binder).
+    """
+
+    mean_phi = moments[1]/moments[0]
+    mean_phi2 = moments[2]/moments[0]
+    mean_phi4 = moments[3]/moments[0]
+
+    chi = num_part*(mean_phi2-mean_phi**2)
+    binder = 1-mean_phi4/(3*mean_phi2**2)
+
+    return mean_phi, chi, binder
+
+def TrajectoryArrays(num_frames,num_part,fields=('position','theta'),paths=None,dtype=np.float64,resume=False,num_replicas=None):
+
+    """
+    This function allocates the arrays where the simulation saves the selected fields at each saved frame.
+
+    Parameters
+        num_frames: number of saved frames
+        num_part: number of particles
+        fields: fields to save, among 'position', 'theta', 'phi', 'heading' (saved every frame) and 'moments' (running sums of the order parameter moments, see AccumulateMoments)
+        paths: dictionary of the .npy files where each field is written while the simulation runs, if None the arrays are kept in memory
+        dtype: floating point type of the positions and orientations, the observables are always saved in double precision
+        resume: if True the existing .npy files of paths are opened to continue writing them, instead of being created
+        num_replicas: number of replicas of the batched engine (see BatchSimulate), if not None each array has a first axis of length num_replicas
+
+    Returns:
+        Dictionary of the arrays of each field (out).
+    """
+
+    shapes={'position': (num_frames,2,num_part), 'theta': (num_frames,num_part), 'phi': (num_frames,), 'heading': (num_frames,), 'moments': (4,)}
+    if num_replicas is not None:
+        shapes={field: (num_replicas,)+shape for field,shape in shapes.items()}
+    dtypes={'position': dtype, 'theta': dtype, 'phi': np.float64, 'heading': np.float64, 'moments': np.float64}
+
+    out={}
+    for field in fields:
+
+        if field not in shapes:
+            raise ValueError("Unknown field: {}".format(field))
+
+        # Memory map the .npy files so that the frames are written to disk as they are produced
+        if paths is not None and resume:
+            out[field]=np.lib.format.open_memmap(paths[field],mode='r+')
+            if out[field].shape != shapes[field] or out[field].dtype != dtypes[field]:
+                raise ValueError("The file {} does not match the resumed simulation".format(paths[field]))
+        elif paths is not None:
+            out[field]=np.lib.format.open_memmap(paths[field],mode='w+',dtype=dtypes[field],shape=shapes[field])
+        else:
+            out[field]=np.empty(shapes[field],dtype=dtypes[field])
+
+    # The moments are running sums, a resumed simulation restores them from the checkpoint
+    if 'moments' in out and not resume:
+        out['moments'][:]=0
+
+    return out
+
+class SimulationStats:
+
+    """
+    This class records the wall time spent in each phase of a simulation (positions update, neighbor search, averaging, noise, velocity, storage of the frames and saving of the files), the number of steps per second and, optionally, the peak memory allocated during the simulation.
+
+    Parameters:
+        memory: if True the peak memory is measured through tracemalloc, which slows down the allocations
+    """
+
+    def __init__(self,memory=False):
+
+        self.memory=memory
+
+        self.phases={}
+        self.num_steps=0
+        self.total_time=0.
+        self.peak_memory=None
+        self.last=None
+        self.start=None
+        self.tracing=False
+
+    def Start(self):
+
+        """
+        This method starts the total time and, if requested, the peak memory measurement.
+        """
+
+        if self.memory:
+            # Do not stop at the end a measurement started by someone else
+            self.tracing=not tracemalloc.is_tracing()
+            if self.tracing:
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+
+        self.start=time.perf_counter()
+        self.last=self.start
+
+    def Tic(self):
+
+        """
+        This method starts the time of the next phase.
+        """
+
+        self.last=time.perf_counter()
+
+    def Lap(self,phase):
+
+        """
+        This method adds the time passed since the end of the last phase to the given phase.
+
+        Parameters:
+            phase: name of the phase
+        """
+
+        now=time.perf_counter()
+        self.phases[phase]=self.phases.get(phase,0.)+now-self.last
+        self.last=now
+
+    def Stop(self,num_steps):
+
+        """
+        This method stops the total time and the peak memory measurement.
+
+        Parameters:
+            num_steps: number of steps simulated since Start
+        """
+
+        self.total_time+=time.perf_counter()-self.start
+        self.num_steps+=num_steps
+
+        if self.memory:
+            peak=tracemalloc.get_traced_memory()[1]
+            self.peak_memory=peak if self.peak_memory is None else max(self.peak_memory,peak)
+            if self.tracing:
+                tracemalloc.stop()
+                self.tracing=False
+
+    def ToDict(self):
+
+        """
+        This method collects the recorded statistics.
+
+        Returns:
+            Dictionary with the number of steps, the total time in seconds, the steps per second, the time of each phase in seconds and the peak memory in bytes (stats).
+        """
+
+        stats={'num_steps': self.num_steps,
+               'total_time': self.total_time,
+               'steps_per_second': self.num_steps/self.total_time if self.total_time > 0 else None,
+               'phases': dict(self.phases),
+               'peak_memory': self.peak_memory}
+
+        return stats
+
+    def Dump(self,path):
+
+        """
+        This method saves the recorded statistics in a .json file.
+
+        Parameters:
+            path: path of the file
+        """
+
+        with open(path,'w') as f:
+            json.dump(self.ToDict(),f,indent=1)
+
+def SaveFrame(out,frame,config):
+
+    """
+    This function saves the selected fields of a configuration in the given frame.
+
+    Parameters
+        out: dictionary of the arrays where the fields are saved (see TrajectoryArrays)
+        frame: index of the frame
+        config: particles configuration
+    """
+
+    if 'position' in out:
+        out['position'][frame]=config[:2]
+    if 'theta' in out:
+        out['theta'][frame]=config[2]
+    if 'phi' in out:
+        out['phi'][frame]=OrderParameter(config[2])
+    if 'heading' in out:
+        out['heading'][frame]=MeanHeading(config[2])
+
+def RandomState(rng=None):
+
+    """
+    This function returns the state of a random number generator.
+
+    Parameters
+        rng: random number generator (numpy.random.Generator), if None the global numpy.random state is returned
+
+    Returns:
+        State of the random number generator (state).
+    """
+
+    if rng is None:
+        return np.random.get_state()
+
+    return rng.bit_generator.state
+
+def SetRandomState(state,rng=None):
+
+    """
+    This function restores the state of a random number generator.
+
+    Parameters
+        state: state returned by RandomState
+        rng: random number generator (numpy.random.Generator), if None the global numpy.random state is restored
+    """
+
+    if rng is None:
+        np.random.set_state(state)
+    else:
+        rng.bit_generator.state = state
+
+def SaveCheckpoint(path,config,step,rng=None,moments=None,stop=None):
+
+    """
+    This function saves the state of a simulation after a step. The file is first written under a temporary name and then renamed, so that an interruption never leaves a partial checkpoint.
+
+    Parameters
+        path: path of the checkpoint file
+        config: particles configuration after the step
+        step: index of the step
+        rng: random number generator (numpy.random.Generator), if None the state of the global numpy.random is saved
+        moments: running sums of the order parameter moments, if None they are not saved
+        stop: stopping criterion of the simulation (see Simulate), pickled with its state
+    """
+
+    checkpoint={'config': np.array(config),
+                'step': step,
+                'rng_state': RandomState(rng),
+                'moments': None if moments is None else np.array(moments),
+                'stop': stop}
+
+    with open(path+'.tmp','wb') as f:
+        pickle.dump(checkpoint,f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path+'.tmp',path)
+
+def LoadCheckpoint(path):
+
+    """
+    This function loads the state of a simulation saved by SaveCheckpoint.
+
+    Parameters
+        path: path of the checkpoint file
+
+    Returns:
+        Dictionary with the particles configuration (config), the index of the step (step), the state of the random number generator (rng_state), the running sums of the order parameter moments (moments) and the stopping criterion (stop).
+    """
+
+    with open(path,'rb') as f:
+        checkpoint=pickle.load(f)
+
+    return checkpoint
+
+def Checkpoint(out,path,config,step,rng=None,stop=None):
+
+    """
+    This function writes to disk the saved fields that are memory mapped and then saves the checkpoint, so that the files are complete up to the checkpoint step.
+
+    Parameters
+        out: dictionary of the arrays where the fields are saved (see TrajectoryArrays)
+        path: path of the checkpoint file
+        config: particles configuration after the step
+        step: index of the step
+        rng: random number generator (numpy.random.Generator), if None the state of the global numpy.random is saved
+        stop: stopping criterion of the simulation (see Simulate), if None it is not saved
+    """
+
+    for field in out:
+        if isinstance(out[field],np.memmap):
+            out[field].flush()
+
+    SaveCheckpoint(path,config,step,rng,out.get('moments'),stop)
+
+def TruncateArrays(out,num_frames):
+
+    """
+    This function keeps only the first num_frames frames of the saved fields, e.g. of a simulation stopped before num_steps. The arrays in memory are replaced by their first frames, while the .npy files of the memory mapped ones are cut in place after writing the new shape in their header, so that no frame is copied.
+
+    Parameters
+        out: dictionary of the arrays where the fields are saved (see TrajectoryArrays), changed in place
+        num_frames: number of frames to keep
+    """
+
+    headers={(1,0): (np.lib.format.read_array_header_1_0,np.lib.format.write_array_header_1_0),
+             (2,0): (np.lib.format.read_array_header_2_0,np.lib.format.write_array_header_2_0)}
+
+    for field in out:
+
+        if field == 'moments' or len(out[field]) <= num_frames:
+            continue
+
+        if not isinstance(out[field],np.memmap):
+            out[field]=out[field][:num_frames]
+            continue
+
+        # Release the map before cutting the file
+        out[field].flush()
+        path,dtype,shape=out[field].filename,out[field].dtype,(num_frames,)+out[field].shape[1:]
+        out[field]=None
+
+        with open(path,'r+b') as f:
+            read_header,write_header=headers[np.lib.format.read_magic(f)]
+            read_header(f)
+            offset=f.tell()
+
+            # NumPy leaves room in the header for the number of frames to change without moving the data
+            f.seek(0)
+            write_header(f,{'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': shape})
+            if f.tell() != offset:
+                raise ValueError("The header of the file {} can not be changed in place".format(path))
+
+            f.truncate(offset+int(np.prod(shape))*dtype.itemsize)
+
+        out[field]=np.lib.format.open_memmap(path,mode='r+')
+
+def Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,neighbor_method='kdtree',skin=0.,save_every=1,out=None,transient=0,rng=None,stats=None,
+             start_step=0,checkpoint_path=None,checkpoint_every=0,num_threads=1,stop=None):
 
     """
     This function updates the particles position and orienation and calculates the order parameter num_steps times.
@@ -189,28 +917,282 @@ def Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_
         time_step: time step
         num_steps: number of steps
         vel_mod: velocity modulus
+        neighbor_method: neighbor search method, 'kdtree' or 'cells'
+        skin: thickness of the Verlet list shell, if greater than 0 the neighbor pairs are reused across steps
+        save_every: number of steps between two saved frames
+        out: dictionary of the arrays where the fields are saved (see TrajectoryArrays), if None the positions and orientations are saved in memory
+        transient: number of initial steps excluded from the order parameter moments
+        rng: random number generator (numpy.random.Generator), if None the global numpy.random state is used
+        stats: SimulationStats where the time of each phase, the steps per second and the peak memory are recorded, if None nothing is recorded
+        start_step: index of the step of config, greater than 0 when resuming from a checkpoint (the frames and moments up to start_step must already be in out)
+        checkpoint_path: path of the checkpoint file
+        checkpoint_every: number of steps between two checkpoints, if 0 no checkpoint is saved
+        num_threads: number of threads of the neighbors averaging (see NeighborsMeanAngle)
+        stop: function called with the index of the step and the configuration at the initial step and after each step, such as an Analysis.AdaptiveStop, the simulation ends after the first step at which it returns True and the fields of out are then truncated (see TruncateArrays); if None the simulation runs num_steps steps. It is saved in the checkpoints with its state
 
     Returns:
-        Position of the particles (position_updates), orientation of the particles (position_updates) at each step.
+        Position of the particles (position_updates, num_frames X 2 X N array), orientation of the particles (theta_updates, num_frames X N array) at each saved frame, with num_frames = num_steps//save_every+1, or less if stopped.
     """
 
-    # Initial positions and orientations
-    init_config=config.copy()
-    position_updates=[[init_config[0],init_config[1]]]
-    theta_updates=[init_config[2]]
+    if stats is not None:
+        stats.Start()
+
+    num_part=len(config[2])
+
+    # Preallocate the positions and orientations of the particles at each saved frame
+    if out is None:
+        out = TrajectoryArrays(num_steps//save_every+1,num_part,dtype=config.dtype)
+
+    # Initial positions and orientations, already saved when resuming
+    if start_step == 0:
+        SaveFrame(out,0,config)
+
+        if 'moments' in out and transient == 0:
+            AccumulateMoments(out['moments'],config[2])
+
+        if stop is not None:
+            stop(0,config)
+
+    if stats is not None:
+        stats.Lap('storage')
+
+    # Reuse the neighbor pairs across steps through a Verlet list
+    if skin > 0:
+        neighbor_method = VerletList(int_radius,space_dim,skin,neighbor_method)
+
+    step = start_step
 
     # Main loop
-    for i in range(num_steps):
+    for i in range(start_step+1,num_steps+1):
+
+        step = i
 
         # Update configuration
-        config = ConfigurationUpdate(config,vel,int_radius,noise_ampl,space_dim,time_step)
-        new_config=config.copy()
+        config = ConfigurationUpdate(config,vel,int_radius,noise_ampl,space_dim,time_step,neighbor_method,rng,stats,num_threads)
 
         # Update velocity
-        vel = VelocityCalculation(vel_mod,new_config[2])
+        vel = VelocityCalculation(vel_mod,config[2])
+
+        if stats is not None:
+            stats.Lap('velocity')
+
+        # Save updated positions and orientations every save_every steps
+        if i % save_every == 0:
+            SaveFrame(out,i//save_every,config)
+
+        # Accumulate the order parameter moments at each step after the transient
+        if 'moments' in out and i >= transient:
+            AccumulateMoments(out['moments'],config[2])
+
+        if stats is not None:
+            stats.Lap('storage')
+
+        # Check the stopping criterion before the checkpoint, which saves it
+        if stop is not None:
+            stopped = stop(i,config)
+
+            if stats is not None:
+                stats.Lap('analysis')
+
+            if stopped:
+                break
+
+        # Save the state of the simulation every checkpoint_every steps
+        if checkpoint_every > 0 and i % checkpoint_every == 0:
+            Checkpoint(out,checkpoint_path,config,i,rng,stop)
+
+            if stats is not None:
+                stats.Lap('checkpoint')
+
+    # Keep only the frames saved before stopping
+    if step < num_steps:
+        TruncateArrays(out,step//save_every+1)
+
+    if stats is not None:
+        stats.Stop(step-start_step)
+
+    return out.get('position'), out.get('theta')
+
+def BatchInitialConfiguration(num_replicas,num_part,space_dim,rngs=None,dtype=np.float64):
+
+    """
+    This function creates the random initial configurations of num_replicas independent systems.
+
+    Parameters
+        num_replicas: number of replicas
+        num_part: number of particles of each replica
+        space_dim: linear dimension of space
+        rngs: random number generator of each replica, if None the global numpy.random state is used for all of them
+        dtype: floating point type of the configurations
+
+    Returns:
+        Initial configurations of the replicas (config, num_replicas X 3 X N array).
+    """
+
+    if rngs is None:
+        rngs = [None]*num_replicas
+
+    config = np.array([InitialConfiguration(num_part,space_dim,rng,dtype) for rng in rngs])
+
+    return config
+
+def BatchConfigurationUpdate(config,vel,int_radius,noise_ampl,space_dim,time_step,neighbor_method='cells',rngs=None):
+
+    """
+    This function updates the particles position and orientation of num_replicas independent systems at once. The particles of all the replicas are searched for neighbors and averaged together, without pairs between different replicas, and each replica draws its noise from its own random number generator, so that each replica evolves as with ConfigurationUpdate.
+
+    Parameters
+        config: previous particles configuration of each replica (num_replicas X 3 X N array)
+        vel: particles velocity of each replica (2 X num_replicas X N array)
+        int_radius: interaction radius
+        noise_ampl: noise amplitude, the same for all the replicas or one for each replica
+        space_dim: linear dimension of space
+        time_step: time step
+        neighbor_method: neighbor search method, 'kdtree' or 'cells'; the cell list bins the particles of all the replicas at once, while the KDTree search builds a tree for each replica
+        rngs: random number generator of each replica, if None the global numpy.random state is used for all of them
+
+    Returns:
+        Updated configuration of the replicas (config).
+    """
+
+    num_replicas, _, num_part = config.shape
+
+    new_config=config.copy()
+
+    # Update particles position
+    new_config[:,0] = config[:,0] + vel[0]*time_step
+    new_config[:,1] = config[:,1] + vel[1]*time_step
+
+    # Impose periodic boundary conditions
+    new_config[:,0] = PeriodicBoundary(new_config[:,0],space_dim)
+    new_config[:,1] = PeriodicBoundary(new_config[:,1],space_dim)
+
+    # Assert all particles must be inside the system space
+    assert np.all((new_config[:,:2] < space_dim) & (new_config[:,:2] >= 0))
+
+    # Find the neighbor pairs of all the replicas at once, the particles of each replica follow the ones of the previous replica
+    pos=np.array([new_config[:,0].ravel(),new_config[:,1].ravel()]).T
+    pairs=NeighborPairs(pos,int_radius,space_dim,neighbor_method,num_replicas)
+
+    # Calculate the mean orientation of the neighbor particles within int_radius
+    mean_theta=PairsMeanAngle(new_config[:,2].ravel(),pairs).reshape(num_replicas,num_part)
+
+    # Draw the noise of each replica from its own random number generator
+    if rngs is None:
+        noise=np.random.random((num_replicas,num_part))
+    else:
+        noise=np.array([rng.random(num_part) for rng in rngs])
+
+    # Update particles orientation
+    noise_ampl=np.reshape(noise_ampl,(-1,1))
+    new_config[:,2] = mean_theta + noise_ampl*np.pi*(2*noise-1)
+
+    return new_config
+
+def BatchOrderParameter(theta):
+
+    """
+    This function calculates the order parameter of each replica.
+
+    Parameters
+        theta: particles orientation of each replica (num_replicas X N array)
+
+    Returns:
+        Order parameter of each replica (phi).
+    """
+
+    # Calculate the sums in double precision also for single precision orientations
+    sx = np.sum(np.cos(theta,dtype=np.float64),axis=1)
+    sy = np.sum(np.sin(theta,dtype=np.float64),axis=1)
+    phi = ((sx)**2 + (sy)**2)**(0.5)/theta.shape[1]
+
+    # Round the order parameter to the 10th decimal digit
+    phi = np.round(phi,10)
+
+    # Assert that the order parameter must be between 0 and 1
+    assert np.all(phi >= 0)
+    assert np.all(phi <= 1)
+
+    return phi
+
+def BatchSaveFrame(out,frame,config,moments=False):
+
+    """
+    This function saves the selected fields of the configurations of the replicas in the given frame and, if requested, adds their order parameter to the running sums of its moments.
+
+    Parameters
+        out: dictionary of the arrays where the fields are saved (see TrajectoryArrays with num_replicas)
+        frame: index of the frame, if None no frame is saved
+        config: particles configuration of each replica
+        moments: if True the order parameter moments are accumulated
+    """
+
+    if frame is not None:
+        if 'position' in out:
+            out['position'][:,frame]=config[:,:2]
+        if 'theta' in out:
+            out['theta'][:,frame]=config[:,2]
+        if 'heading' in out:
+            out['heading'][:,frame]=np.arctan2(np.sum(np.sin(config[:,2],dtype=np.float64),axis=1),np.sum(np.cos(config[:,2],dtype=np.float64),axis=1))
+
+    if ('phi' in out and frame is not None) or ('moments' in out and moments):
+
+        phi = BatchOrderParameter(config[:,2])
+
+        if 'phi' in out and frame is not None:
+            out['phi'][:,frame]=phi
+
+        if 'moments' in out and moments:
+            out['moments'][:,0] += 1
+            out['moments'][:,1] += phi
+            out['moments'][:,2] += phi**2
+
+            # The fourth power of an array is rounded differently from the one of a number, raise each order parameter as AccumulateMoments does
+            out['moments'][:,3] += [p**4 for p in phi]
+
+def BatchSimulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,neighbor_method='cells',save_every=1,out=None,transient=0,rngs=None):
+
+    """
+    This function updates num_replicas independent systems num_steps times at once, so that the per step overhead of the NumPy calls is shared by all the replicas, which pays off for small and dilute systems. Each replica evolves as with Simulate and its own random number generator.
+
+    Parameters
+        config: initial particles configuration of each replica (num_replicas X 3 X N array)
+        vel: particles velocity of each replica (2 X num_replicas X N array)
+        int_radius: interaction radius
+        noise_ampl: noise amplitude, the same for all the replicas or one for each replica
+        space_dim: linear dimension of space
+        time_step: time step
+        num_steps: number of steps
+        vel_mod: velocity modulus
+        neighbor_method: neighbor search method, 'kdtree' or 'cells' (see BatchConfigurationUpdate)
+        save_every: number of steps between two saved frames
+        out: dictionary of the arrays where the fields are saved (see TrajectoryArrays with num_replicas), if None the positions and orientations are saved in memory
+        transient: number of initial steps excluded from the order parameter moments
+        rngs: random number generator of each replica, if None the global numpy.random state is used for all of them
+
+    Returns:
+        Position of the particles (position_updates, num_replicas X num_frames X 2 X N array) and orientation of the particles (theta_updates, num_replicas X num_frames X N array) at each saved frame.
+    """
+
+    num_replicas, _, num_part = config.shape
+
+    if out is None:
+        out = TrajectoryArrays(num_steps//save_every+1,num_part,dtype=config.dtype,num_replicas=num_replicas)
+
+    if 'moments' in out:
+        out['moments'][:]=0
+
+    # Initial positions and orientations
+    BatchSaveFrame(out,0,config,transient == 0)
+
+    # Main loop
+    for i in range(1,num_steps+1):
+
+        # Update configuration and velocity of all the replicas
+        config = BatchConfigurationUpdate(config,vel,int_radius,noise_ampl,space_dim,time_step,neighbor_method,rngs)
+        vel = VelocityCalculation(vel_mod,config[:,2])
 
-        # Save updated positions and orientations
-        position_updates.append([new_config[0],new_config[1]])
-        theta_updates.append(new_config[2])
+        # Save every save_every steps and accumulate the order parameter moments after the transient
+        BatchSaveFrame(out,i//save_every if i % save_every == 0 else None,config,i >= transient)
 
-    return position_updates, theta_updates
+    return out.get('position'), out.get('theta')
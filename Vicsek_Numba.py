@@ -0,0 +1,255 @@
+#=======================================================================
+# Vicsek_Numba
+#
+# Aim: To simulate the 2D Viscek Model with a compiled kernel that runs
+#      many steps in a single call. Numba is optional: without it the
+#      simulation falls back to the NumPy functions of Vicsek_Model.
+#=======================================================================
+
+import numpy as np
+import Vicsek_Model
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+def Kernel(x,y,theta,int_radius,noise_ampl,space_dim,time_step,start_step,num_steps,vel_mod,save_every,transient,
+           position_out,theta_out,phi_out,heading_out,moments):
+
+    """
+    This function updates the particles position and orientation from step start_step to step num_steps, finding the neighbors through a cell list, and saves the requested fields every save_every steps.
+
+    Parameters
+        x, y, theta: particles coordinates and orientation, updated in place
+        int_radius: interaction radius
+        noise_ampl: noise amplitude
+        space_dim: linear dimension of space
+        time_step: time step
+        start_step: index of the step of the given particles, the initial configuration is saved only if it is 0
+        num_steps: index of the last step
+        vel_mod: velocity modulus
+        save_every: number of steps between two saved frames
+        transient: number of initial steps excluded from the order parameter moments
+        position_out, theta_out, phi_out, heading_out: arrays of the saved fields, an array with no frames is not saved
+        moments: running sums of the order parameter moments, updated in place
+    """
+
+    num_part = len(theta)
+
+    # Cells of side greater or equal than int_radius, with less than 3 cells per side all the particles are compared
+    num_cells = 0
+    if int_radius > 0:
+        num_cells = int(min(space_dim//int_radius,np.sqrt(num_part)))
+        if num_cells > 0 and space_dim/num_cells < int_radius:
+            num_cells -= 1
+    use_cells = num_cells >= 3
+    if not use_cells:
+        num_cells = 1
+    cell_side = space_dim/num_cells
+
+    cell_count = np.zeros(num_cells*num_cells,dtype=np.int64)
+    cell_start = np.zeros(num_cells*num_cells,dtype=np.int64)
+    cell_fill = np.zeros(num_cells*num_cells,dtype=np.int64)
+    cell_index = np.zeros(num_part,dtype=np.int64)
+    order = np.zeros(num_part,dtype=np.int64)
+
+    sin = np.empty(num_part)
+    cos = np.empty(num_part)
+    mean_theta = np.empty(num_part)
+
+    r2 = int_radius*int_radius
+
+    for step in range(start_step+1 if start_step > 0 else 0,num_steps+1):
+
+        if step > 0:
+
+            # Update particles position and impose periodic boundary conditions
+            for i in numba.prange(num_part):
+                x[i] = (x[i] + vel_mod*np.cos(theta[i])*time_step) % space_dim
+                y[i] = (y[i] + vel_mod*np.sin(theta[i])*time_step) % space_dim
+                if x[i] >= space_dim:
+                    x[i] = 0.
+                if y[i] >= space_dim:
+                    y[i] = 0.
+
+            # Sort the particles by cell index
+            cell_count[:] = 0
+            for i in range(num_part):
+                cx = int(x[i]/cell_side) % num_cells
+                cy = int(y[i]/cell_side) % num_cells
+                cell_index[i] = cx*num_cells+cy
+                cell_count[cell_index[i]] += 1
+            total = 0
+            for c in range(num_cells*num_cells):
+                cell_start[c] = total
+                cell_fill[c] = total
+                total += cell_count[c]
+            for i in range(num_part):
+                order[cell_fill[cell_index[i]]] = i
+                cell_fill[cell_index[i]] += 1
+
+            for i in numba.prange(num_part):
+                sin[i] = np.sin(theta[i])
+                cos[i] = np.cos(theta[i])
+
+            # Calculate the mean orientation of the particles within int_radius, the particle itself included
+            for i in numba.prange(num_part):
+                sum_sin = 0.
+                sum_cos = 0.
+                count = 0
+                cx = cell_index[i]//num_cells
+                cy = cell_index[i] % num_cells
+                num_adjacent = 3 if use_cells else 1
+                for dx in range(num_adjacent):
+                    for dy in range(num_adjacent):
+                        if use_cells:
+                            c = ((cx+dx-1) % num_cells)*num_cells+(cy+dy-1) % num_cells
+                        else:
+                            c = 0
+                        for k in range(cell_start[c],cell_start[c]+cell_count[c]):
+                            j = order[k]
+                            ddx = x[j]-x[i]
+                            ddy = y[j]-y[i]
+                            ddx -= space_dim*np.round(ddx/space_dim)
+                            ddy -= space_dim*np.round(ddy/space_dim)
+                            if ddx*ddx+ddy*ddy <= r2:
+                                sum_sin += sin[j]
+                                sum_cos += cos[j]
+                                count += 1
+                mean_theta[i] = np.arctan2(sum_sin/count,sum_cos/count)
+
+            # Update particles orientation
+            noise = np.random.random(num_part)
+            for i in numba.prange(num_part):
+                theta[i] = mean_theta[i] + noise_ampl*np.pi*(2*noise[i]-1)
+
+        # Order parameter and mean heading
+        sx = 0.
+        sy = 0.
+        for i in range(num_part):
+            sx += np.cos(np.float64(theta[i]))
+            sy += np.sin(np.float64(theta[i]))
+        phi = min(round(np.sqrt(sx*sx+sy*sy)/num_part,10),1.)
+
+        # Save the requested fields every save_every steps
+        if step % save_every == 0:
+            frame = step//save_every
+            if position_out.shape[0] > 0:
+                position_out[frame,0,:] = x
+                position_out[frame,1,:] = y
+            if theta_out.shape[0] > 0:
+                theta_out[frame,:] = theta
+            if phi_out.shape[0] > 0:
+                phi_out[frame] = phi
+            if heading_out.shape[0] > 0:
+                heading_out[frame] = np.arctan2(sy,sx)
+
+        # Accumulate the order parameter moments after the transient
+        if moments.shape[0] > 0 and step >= transient:
+            moments[0] += 1
+            moments[1] += phi
+            moments[2] += phi**2
+            moments[3] += phi**4
+
+def SeedKernel(seed):
+
+    """
+    This function seeds the random number generator used inside the compiled kernel.
+
+    Parameters
+        seed: random seed
+    """
+
+    np.random.seed(seed)
+
+if numba is not None:
+    Kernel = numba.njit(parallel=True,cache=True)(Kernel)
+    SeedKernel = numba.njit(SeedKernel)
+
+def Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,save_every=1,out=None,transient=0,rng=None,stats=None,
+             start_step=0,checkpoint_path=None,checkpoint_every=0):
+
+    """
+    This function updates the particles position and orientation num_steps times with the compiled kernel, saving the fields of out every save_every steps. If Numba is not installed, it calls Vicsek_Model.Simulate.
+    With checkpoints, the kernel runs between two checkpoints at a time and is seeded again at each call, so that a resumed simulation is equal to an uninterrupted one with the same checkpoint_every.
+
+    Parameters
+        config: previous particles configuration
+        vel: particles velocity
+        int_radius: interaction radius
+        noise_ampl: noise amplitude
+        space_dim: linear dimension of space
+        time_step: time step
+        num_steps: number of steps
+        vel_mod: velocity modulus
+        save_every: number of steps between two saved frames
+        out: dictionary of the arrays where the fields are saved (see Vicsek_Model.TrajectoryArrays), if None the positions and orientations are saved in memory
+        transient: number of initial steps excluded from the order parameter moments
+        rng: random number generator (numpy.random.Generator), if None the global numpy.random state is used
+        stats: Vicsek_Model.SimulationStats where the time of the kernel, the steps per second and the peak memory are recorded, if None nothing is recorded
+        start_step: index of the step of config, greater than 0 when resuming from a checkpoint (the frames and moments up to start_step must already be in out)
+        checkpoint_path: path of the checkpoint file
+        checkpoint_every: number of steps between two checkpoints, if 0 no checkpoint is saved
+
+    Returns:
+        Position of the particles (position_updates) and orientation of the particles (theta_updates) at each saved frame.
+    """
+
+    if numba is None:
+        return Vicsek_Model.Simulate(config,vel,int_radius,noise_ampl,space_dim,time_step,num_steps,vel_mod,'cells',0.,save_every,out,transient,rng,stats,
+                                     start_step,checkpoint_path,checkpoint_every)
+
+    if stats is not None:
+        stats.Start()
+
+    num_part = len(config[2])
+
+    # The state is kept in the floating point type of the configuration
+    dtype = np.result_type(config.dtype,np.float32)
+
+    if out is None:
+        out = Vicsek_Model.TrajectoryArrays(num_steps//save_every+1,num_part,dtype=dtype)
+
+    x = np.array(config[0],dtype=dtype)
+    y = np.array(config[1],dtype=dtype)
+    theta = np.array(config[2],dtype=dtype)
+
+    # Fields that are not requested are passed as arrays with no frames
+    def Field(name,shape):
+        return np.asarray(out[name]) if name in out else np.empty(shape)
+
+    fields = (Field('position',(0,2,num_part)),Field('theta',(0,num_part)),Field('phi',(0,)),Field('heading',(0,)),Field('moments',(0,)))
+
+    if stats is not None:
+        stats.Lap('setup')
+
+    # Steps at the end of each call of the kernel, a checkpoint is saved after each of them
+    if checkpoint_every > 0:
+        ends = list(range((start_step//checkpoint_every+1)*checkpoint_every,num_steps,checkpoint_every))+[num_steps]
+    else:
+        ends = [num_steps]
+
+    step = start_step
+    for end in ends:
+
+        # The kernel has its own random number generator, seeded from the given one
+        SeedKernel(int(rng.integers(2**31)) if rng is not None else int(np.random.randint(2**31)))
+
+        # The first call includes the compilation of the kernel, whose phases can not be timed separately
+        Kernel(x,y,theta,float(int_radius),float(noise_ampl),float(space_dim),float(time_step),int(step),int(end),float(vel_mod),int(save_every),int(transient),*fields)
+        step = end
+
+        if stats is not None:
+            stats.Lap('kernel')
+
+        if checkpoint_every > 0 and step % checkpoint_every == 0:
+            Vicsek_Model.Checkpoint(out,checkpoint_path,np.array([x,y,theta]),step,rng)
+
+            if stats is not None:
+                stats.Lap('checkpoint')
+
+    if stats is not None:
+        stats.Stop(num_steps-start_step)
+
+    return out.get('position'), out.get('theta')